@@ -0,0 +1,87 @@
+"""
+Benchmark admission control (src/utils/admission.py) under a bulk upload of images.
+
+One customer sends --bulk image classifications at once while --interactive other customers each send TXT
+files one after another. The CPU executor is simulated by --workers slots served first come first served,
+a file holds a slot for its estimated cost times --ms-per-cost, so the run measures queueing only:
+- off: every request goes straight to the executor, as before admission control
+- on: requests are admitted through an AdmissionController with the default lanes sized for --workers
+
+Reports p50/p99 latency of the interactive requests, the bulk requests completed and rejected (429) and
+the longest a bulk request took, from percentiles shared with pipeline_benchmark.
+
+Run from the root of the repo:
+    python -m src.benchmarks.admission_benchmark --bulk 200 --interactive 4 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from src.benchmarks.pipeline_benchmark import _percentile
+from src.errors import AdmissionRejected
+from src.settings import ADMISSION_CHEAP_CAPACITY, ADMISSION_CHEAP_QUEUE, ADMISSION_CUSTOMER_QUEUE, ADMISSION_EXPENSIVE_QUEUE
+from src.utils.admission import CHEAP, EXPENSIVE, AdmissionController, Lane
+
+BULK_CUSTOMER = 0
+
+
+async def _run(admission: bool, bulk: int, interactive: int, requests_per_client: int, workers: int, ms_per_cost: float, wait_seconds: float) -> dict:
+    controller = AdmissionController(enabled=admission, lanes={
+        CHEAP: Lane(CHEAP, ADMISSION_CHEAP_CAPACITY, ADMISSION_CHEAP_QUEUE, ADMISSION_CUSTOMER_QUEUE, wait_seconds),
+        EXPENSIVE: Lane(EXPENSIVE, 100 * workers, ADMISSION_EXPENSIVE_QUEUE, ADMISSION_CUSTOMER_QUEUE, wait_seconds),
+    })
+    executor = asyncio.Semaphore(workers)  # FIFO, like the executor's work queue
+
+    async def classify(customer_id: int, filename: str) -> float:
+        cost = controller.estimate_cost(filename)
+        start = time.perf_counter()
+        async with controller.admit(customer_id, [cost]):
+            async with executor:
+                await asyncio.sleep(cost * ms_per_cost / 1000)
+        return time.perf_counter() - start
+
+    async def bulk_request(index: int):
+        try:
+            return await classify(BULK_CUSTOMER, f"scan_{index}.jpg")
+        except AdmissionRejected:
+            return None
+
+    async def interactive_client(customer_id: int) -> list[float]:
+        await asyncio.sleep(0.01)  # the bulk upload is already queued
+        return [await classify(customer_id, f"note_{index}.txt") for index in range(requests_per_client)]
+
+    bulk_results, *interactive_results = await asyncio.gather(
+        asyncio.gather(*[bulk_request(index) for index in range(bulk)]),
+        *[interactive_client(customer_id) for customer_id in range(1, interactive + 1)],
+    )
+    latencies = sorted(latency for client in interactive_results for latency in client)
+    completed = sorted(latency for latency in bulk_results if latency is not None)
+    return {
+        "interactive_p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "interactive_p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "bulk_completed": len(completed),
+        "bulk_rejected": bulk - len(completed),
+        "bulk_max_ms": round(completed[-1] * 1000, 1) if completed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interactive latency during a bulk image upload, with and without admission control")
+    parser.add_argument("--bulk", type=int, default=200, help="images sent at once by the bulk customer")
+    parser.add_argument("--interactive", type=int, default=4, help="other customers sending TXT files one after another")
+    parser.add_argument("--requests", type=int, default=20, help="TXT files per interactive customer")
+    parser.add_argument("--workers", type=int, default=4, help="simulated CPU workers")
+    parser.add_argument("--ms-per-cost", type=float, default=1.0, help="milliseconds a worker spends per unit of cost")
+    parser.add_argument("--wait-seconds", type=float, default=5.0, help="ADMISSION_WAIT_SECONDS of the run")
+    args = parser.parse_args()
+
+    print(json.dumps({
+        mode: asyncio.run(_run(mode == "on", args.bulk, args.interactive, args.requests, args.workers, args.ms_per_cost, args.wait_seconds))
+        for mode in ("off", "on")
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Offline evaluation of the classification cascade (src/utils/cascade.py): accuracy against average latency
+for a set of escalation thresholds.
+
+Every tier is run once per document and its answer, confidence and time are recorded, then each threshold
+setting is replayed over those records: a document is decided by the first tier that is confident enough
+(or the most confident one) and costs the time of every tier up to the one that decided. The replay is cheap
+so many thresholds can be compared on one pass over the corpus. The non cascade path (extract_and_classify_task,
+full extraction with OCR then the main model) is measured on the same documents as the baseline.
+
+Documents come from a corpus directory written by src/benchmarks/corpus.py (--corpus) or are generated in
+memory. Corpus filenames contain the label, --filenames hide renames them to "document_<n>.<ext>" so the
+content has to carry the decision.
+
+Run from the root of the repo:
+    python -m src.benchmarks.cascade_evaluation --docs 120 --formats pdf docx txt jpg scanned_pdf --thresholds 0.6 0.8 0.9 0.95
+    python -m src.benchmarks.cascade_evaluation --corpus bench_corpus --filenames hide --class-thresholds "bank_statement=0.8,invoice=0.95"
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass
+
+from src.benchmarks.corpus import ALL_FORMATS, FORMATS, generate_documents
+from src.settings import CASCADE_DEFAULT_THRESHOLD, CASCADE_THRESHOLDS
+from src.utils.cascade import CascadeClassifier, TierResult, parse_thresholds
+from src.utils.tasks import extract_and_classify_task
+
+
+@dataclass
+class DocumentRecord:
+    label: str
+    tiers: list[tuple[TierResult, float]]  # every tier's result and seconds taken, cheapest first
+    baseline_class: str
+    baseline_seconds: float
+
+
+def _load_documents(corpus_dir, docs, formats, seed, max_pages):
+    if corpus_dir is None:
+        for document, content in generate_documents(docs, formats, seed, max_pages):
+            yield document.filename, document.label, content
+        return
+    with open(os.path.join(corpus_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    for document in manifest["documents"][:docs or None]:
+        with open(os.path.join(corpus_dir, document["filename"]), "rb") as f:
+            yield document["filename"], document["label"], f.read()
+
+def record_documents(cascade: CascadeClassifier, documents, hide_filenames: bool) -> list[DocumentRecord]:
+    records = []
+    for index, (filename, label, content) in enumerate(documents):
+        if hide_filenames:
+            filename = f"document_{index}.{filename.rsplit('.', 1)[-1]}"
+
+        tiers = []
+        tier_iterator = cascade.iter_tiers(content, filename)
+        while True:
+            start = time.perf_counter()
+            result = next(tier_iterator, None)
+            if result is None:
+                break
+            tiers.append((result, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        _, baseline_class, _ = extract_and_classify_task(content, filename)
+        records.append(DocumentRecord(label, tiers, baseline_class, time.perf_counter() - start))
+    return records
+
+def replay(cascade: CascadeClassifier, records: list[DocumentRecord]) -> dict:
+    """Accuracy, latency and deciding tier counts of the cascade's thresholds over the recorded tiers."""
+    correct, latencies, decided_by = 0, [], {}
+    for record in records:
+        results = []
+        seconds = 0.0
+        for result, tier_seconds in record.tiers:
+            results.append(result)
+            seconds += tier_seconds
+            if cascade.is_confident(result):
+                break
+        decision = cascade.decide(results)
+        correct += decision.file_class == record.label
+        latencies.append(seconds)
+        decided_by[f"tier{decision.tier}"] = decided_by.get(f"tier{decision.tier}", 0) + 1
+    return {
+        "accuracy": round(correct / len(records), 4),
+        "mean_latency_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p99_latency_ms": round(sorted(latencies)[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000, 3),
+        "decided_by": dict(sorted(decided_by.items())),
+    }
+
+def baseline(records: list[DocumentRecord]) -> dict:
+    return {
+        "accuracy": round(sum(record.baseline_class == record.label for record in records) / len(records), 4),
+        "mean_latency_ms": round(statistics.mean(record.baseline_seconds for record in records) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy against latency of the classification cascade")
+    parser.add_argument("--corpus", default=None, help="corpus directory with a manifest.json, generated in memory when not set")
+    parser.add_argument("--docs", type=int, default=120)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=ALL_FORMATS)
+    parser.add_argument("--max-pages", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--filenames", choices=["keep", "hide"], default="hide")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.99],
+                        help="uniform thresholds to compare, applied to every class")
+    parser.add_argument("--class-thresholds", default=CASCADE_THRESHOLDS,
+                        help='per class thresholds to compare as well, e.g. "bank_statement=0.8,invoice=0.95"')
+    parser.add_argument("--out", default=None, help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    documents = _load_documents(args.corpus, args.docs, args.formats, args.seed, args.max_pages)
+    records = record_documents(CascadeClassifier(thresholds={}, default_threshold=1.1), documents, args.filenames == "hide")
+
+    settings = {f"uniform_{threshold}": CascadeClassifier(thresholds={}, default_threshold=threshold) for threshold in args.thresholds}
+    if args.class_thresholds:
+        settings[f"classes_{args.class_thresholds}"] = CascadeClassifier(
+            thresholds=parse_thresholds(args.class_thresholds), default_threshold=CASCADE_DEFAULT_THRESHOLD
+        )
+
+    results = {
+        "documents": len(records),
+        "filenames": args.filenames,
+        "baseline_no_cascade": baseline(records),
+        "cascade": {name: replay(cascade, records) for name, cascade in settings.items()},
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the pickled sklearn pipeline against the compiled array model.
+
+Each model is measured in a fresh spawned process so import cost and RSS are not shared:
+- load_s: time to import the runtime and load the model
+- rss_mb: resident memory added by the import and load
+- single_doc_ms: mean latency of predict on one document
+- batch_doc_ms: mean latency per document of one predict over the whole batch
+
+Run from the root of the repo, after compiling the model:
+    python -m src.scripts.compile_model --out text_classifier_compiled
+    python -m src.benchmarks.compiled_model_benchmark --compiled text_classifier_compiled --docs 1000
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _measure(kind: str, path: str, texts: list[str], single_runs: int) -> dict:
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    if kind == "pickle":
+        import pickle
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+    else:
+        from src.compiled_model import CompiledTextClassifier
+        model = CompiledTextClassifier.load(path)
+    load_s = time.perf_counter() - start
+    rss_mb = _rss_mb() - rss_before
+
+    model.predict(texts[:1])  # warm up
+    start = time.perf_counter()
+    for text in texts[:single_runs]:
+        model.predict([text])
+    single_doc_ms = (time.perf_counter() - start) / single_runs * 1000
+
+    start = time.perf_counter()
+    predictions = model.predict(texts)
+    batch_doc_ms = (time.perf_counter() - start) / len(texts) * 1000
+
+    return {
+        "load_s": round(load_s, 4),
+        "rss_mb": round(rss_mb, 1),
+        "single_doc_ms": round(single_doc_ms, 4),
+        "batch_doc_ms": round(batch_doc_ms, 4),
+        "predictions": [str(p) for p in predictions],
+    }
+
+
+def synthetic_texts(n_docs: int, seed: int = 0) -> list[str]:
+    words = (
+        "invoice number date total due bill to item service account holder statement period direct deposit "
+        "atm withdrawal bank fee driver license expires date of birth height weight address name sex eyes"
+    ).split()
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(words) for _ in range(rnd.randint(20, 300))) for _ in range(n_docs)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pickled pipeline vs compiled array model")
+    parser.add_argument("--model", default="text_classifier_pipeline.pkl")
+    parser.add_argument("--compiled", default="text_classifier_compiled")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--single-runs", type=int, default=200)
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.docs)
+    single_runs = min(args.single_runs, args.docs)
+    results = {}
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for kind, path in (("pickle", args.model), ("compiled", args.compiled)):
+            results[kind] = pool.apply(_measure, (kind, path, texts, single_runs))
+
+    parity = results["pickle"].pop("predictions") == results["compiled"].pop("predictions")
+    print(json.dumps({"docs": args.docs, "identical_predictions": parity, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Synthetic document corpus for benchmarks and offline evaluation.
+
+Documents are rendered from templates modelled on the bank statements, invoices and driver licences used to train
+the model (notebooks/model_develop.ipynb), with randomised names, numbers, dates and line items, as:
+- pdf: text PDF written directly (one or more pages, Helvetica), readable by PyPDF2
+- docx: python-docx paragraphs, invoice line items as a table like real invoices keep them
+- txt: utf-8 text
+- jpg: the text drawn on a white card with PIL, for the OCR extractor
+- scanned_pdf: a PDF with no text layer, every page is a JPEG like a scan (not in the default formats)
+
+A manifest.json next to the files lists every file with its label so results can be scored.
+
+Run from the root of the repo:
+    python -m src.benchmarks.corpus --out bench_corpus --count 300 --formats pdf docx txt jpg --seed 0
+"""
+
+import argparse
+import json
+import os
+import random
+from dataclasses import asdict, dataclass
+from io import BytesIO
+
+LABELS = ["bank_statement", "invoice", "driver_license"]
+FORMATS = ["pdf", "docx", "txt", "jpg"]
+# PDFs without a text layer, opt in as they go through OCR, written with a .pdf extension
+ALL_FORMATS = FORMATS + ["scanned_pdf"]
+
+FIRST_NAMES = ["John", "Jane", "Sarah", "David", "Lisa", "Peter", "Karen", "Kyle", "Anna", "Richard", "James", "Maria"]
+LAST_NAMES = ["Doe", "Smith", "Brown", "Lee", "Green", "Taylor", "Wong", "Williams", "Roe", "Cox", "James", "Garcia"]
+STREETS = ["Main St", "Elm St", "Oak St", "Pine St", "Sunset Blvd", "Highway 10", "Tech Avenue", "Lark Lane"]
+CITIES = [("Los Angeles", "CA", "90001"), ("Dallas", "TX", "75001"), ("New York", "NY", "10001"), ("Seattle", "WA", "98101"),
+          ("Detroit", "MI", "48201"), ("Richmond", "VA", "23220"), ("Boston", "MA", "02108"), ("Miami", "FL", "33101")]
+STATES = ["CALIFORNIA", "TEXAS", "NEW YORK STATE", "FLORIDA", "MICHIGAN", "VIRGINIA", "ILLINOIS", "WASHINGTON STATE", "OHIO"]
+TRANSACTIONS = [("Direct Deposit", False), ("ATM Withdrawal", True), ("Wire Transfer", False), ("POS Purchase", True),
+                ("Loan Repayment", True), ("ACH Payment", True), ("Online Transfer", False), ("Bank Fee", True),
+                ("Debit Card Purchase", True), ("Check Deposit", False)]
+SERVICES = ["Service Charge", "Web Development", "SEO Optimization", "Graphic Design", "Branding", "Consultation",
+            "Website Hosting", "SSL Certificate", "Maintenance Fee", "Website Redesign", "Cloud Storage", "Support Plan"]
+COMPANIES = ["Tech Solutions Ltd.", "Design Innovations", "Lark Systems", "Web Innovations", "Digital Solutions", "Bright Ideas Co."]
+
+
+@dataclass
+class CorpusDocument:
+    filename: str
+    label: str
+    format: str
+    pages: int
+
+
+def _name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def _address(rng: random.Random) -> str:
+    city, state, zip_code = rng.choice(CITIES)
+    return f"{rng.randint(10, 9999)} {rng.choice(STREETS)}, {city}, {state} {zip_code}"
+
+def bank_statement_text(rng: random.Random, pages: int = 1) -> str:
+    bank = rng.randint(1, 99)
+    month = rng.randint(1, 12)
+    lines = [
+        f"Bank {bank} of Testing",
+        "Customer Support: 1-800-555-1234",
+        "www.fakebankdomain.com",
+        f"Account Holder: {_name(rng)}",
+        f"Account Number: XXXX-XXXX-XXXX-{rng.randint(1000, 9999)}",
+        f"Statement Period: 2023-{month:02d}",
+        "Date Description Debit ($) Credit ($)",
+    ]
+    for page in range(pages):
+        for _ in range(rng.randint(8, 14)):
+            description, debit = rng.choice(TRANSACTIONS)
+            amount = f"{rng.uniform(5, 900):.2f}"
+            lines.append(f"{rng.randint(1, 28):02d}/{month:02d}/2023 {description} {amount if debit else '0.00'} {'0.00' if debit else amount}")
+        lines.append(f"Bank {bank} - Confidential Statement | Page {page + 1}")
+    return "\n".join(lines)
+
+def invoice_text(rng: random.Random, pages: int = 1) -> str:
+    lines = [
+        rng.choice(["Invoice", "INVOICE", "Tax Invoice"]),
+        f"Invoice Number: {rng.randint(1000, 99999)}",
+        f"Date: 2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "",
+        f"Bill To: {_name(rng)}",
+        f"Company: {rng.choice(COMPANIES)}",
+        f"Address: {_address(rng)}",
+        "",
+    ]
+    total = 0.0
+    for page in range(pages):
+        for item in range(rng.randint(2, 6)):
+            price = round(rng.uniform(20, 2000), 2)
+            total += price
+            lines.append(f"Item No: {page * 10 + item + 1:02d} - {rng.choice(SERVICES)} - ${price:.2f}")
+    lines += ["", f"Total Due: ${total:.2f}", f"Due Date: 2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"]
+    return "\n".join(lines)
+
+def driver_license_text(rng: random.Random, pages: int = 1) -> str:
+    return "\n".join([
+        f"{rng.choice(STATES)} DRIVER LICENSE",
+        f"Number: {rng.choice('ABCDMOPVWX')}{rng.randint(1000000, 9999999)}",
+        f"Expires: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2023, 2030)}",
+        f"Name: {_name(rng).upper()}",
+        f"Sex: {rng.choice('MF')} Height: {rng.randint(5, 6)}'{rng.randint(0, 11)} Weight: {rng.randint(110, 230)} lbs",
+        f"Address: {_address(rng).upper()}",
+        f"DOB: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1950, 2005)}",
+    ])
+
+TEMPLATES = {"bank_statement": bank_statement_text, "invoice": invoice_text, "driver_license": driver_license_text}
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def _split_pages(text: str, pages: int) -> list[list[str]]:
+    lines = text.split("\n")
+    per_page = max(1, -(-len(lines) // pages))
+    return [lines[start:start + per_page] for start in range(0, len(lines), per_page)] or [[]]
+
+# objects are (dictionary, stream bytes or None), numbered from 1 in order, object 2 is always the page tree
+def _write_pdf(objects: list[tuple[str, bytes]]) -> bytes:
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, (dictionary, stream) in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{dictionary}\n".encode("latin-1"))
+        if stream is not None:
+            out.write(b"stream\n" + stream + b"\nendstream\n")
+        out.write(b"endobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+def _page_tree(objects: list, page_ids: list[int]) -> None:
+    objects[1] = (f"<< /Type /Pages /Kids [{' '.join(f'{pid} 0 R' for pid in page_ids)}] /Count {len(page_ids)} >>", None)
+
+def render_pdf(text: str, pages: int = 1) -> bytes:
+    """Write a minimal text PDF, the lines are split evenly over the pages."""
+    objects = [("<< /Type /Catalog /Pages 2 0 R >>", None), None, ("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", None)]
+    page_ids = []
+    for chunk in _split_pages(text, pages):
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in chunk) + " ET"
+        stream_bytes = stream.encode("latin-1", errors="replace")
+        objects.append((f"<< /Length {len(stream_bytes)} >>", stream_bytes))
+        content_id = len(objects)
+        objects.append((f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>", None))
+        page_ids.append(len(objects))
+    _page_tree(objects, page_ids)
+    return _write_pdf(objects)
+
+def render_scanned_pdf(text: str, pages: int = 1) -> bytes:
+    """Write a PDF with no text layer, each page is a JPEG of its lines like a scanner produces."""
+    from PIL import Image
+
+    objects = [("<< /Type /Catalog /Pages 2 0 R >>", None), None]
+    page_ids = []
+    for chunk in _split_pages(text, pages):
+        jpg = render_jpg("\n".join(chunk))
+        width, height = Image.open(BytesIO(jpg)).size
+        objects.append((f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpg)} >>", jpg))
+        image_id = len(objects)
+        stream_bytes = f"q 612 0 0 {842 * min(1, height / width * 612 / 842):.2f} 0 0 cm /Im1 Do Q".encode()
+        objects.append((f"<< /Length {len(stream_bytes)} >>", stream_bytes))
+        content_id = len(objects)
+        objects.append((f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /XObject << /Im1 {image_id} 0 R >> >> /Contents {content_id} 0 R >>", None))
+        page_ids.append(len(objects))
+    _page_tree(objects, page_ids)
+    return _write_pdf(objects)
+
+def render_docx(text: str) -> bytes:
+    from docx import Document
+
+    document = Document()
+    table = None
+    for line in text.split("\n"):
+        if not line.startswith("Item No:"):
+            document.add_paragraph(line)
+            table = None
+            continue
+        cells = line.split(" - ")  # "Item No: 01 - Web Development - $120.00", one column per part
+        if table is None:
+            table = document.add_table(rows=0, cols=len(cells))
+        for cell, value in zip(table.add_row().cells, cells):
+            cell.text = value
+    out = BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+def render_jpg(text: str) -> bytes:
+    from PIL import Image, ImageDraw, ImageFont
+
+    lines = text.split("\n")
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:
+        font = ImageFont.load_default()
+    image = Image.new("RGB", (1400, 60 + 40 * len(lines)), "white")
+    draw = ImageDraw.Draw(image)
+    for number, line in enumerate(lines):
+        draw.text((40, 30 + 40 * number), line, fill="black", font=font)
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+def render(text: str, file_format: str, pages: int = 1) -> bytes:
+    if file_format == "pdf":
+        return render_pdf(text, pages)
+    if file_format == "docx":
+        return render_docx(text)
+    if file_format == "txt":
+        return text.encode("utf-8")
+    if file_format == "jpg":
+        return render_jpg(text)
+    if file_format == "scanned_pdf":
+        return render_scanned_pdf(text, pages)
+    raise ValueError(f"Unsupported corpus format: {file_format}")
+
+
+def generate_documents(count: int, formats: list[str] = FORMATS, seed: int = 0, max_pages: int = 1):
+    """Yield (CorpusDocument, file bytes) for count documents, labels and formats rotate so the mix is even."""
+    rng = random.Random(seed)
+    for index in range(count):
+        label = LABELS[index % len(LABELS)]
+        file_format = formats[(index // len(LABELS)) % len(formats)]
+        pages = rng.randint(1, max_pages) if file_format in ("pdf", "scanned_pdf") else 1
+        text = TEMPLATES[label](rng, pages)
+        extension = "pdf" if file_format == "scanned_pdf" else file_format
+        yield CorpusDocument(f"{label}_{index:05d}.{extension}", label, file_format, pages), render(text, file_format, pages)
+
+def write_corpus(out_dir: str, count: int, formats: list[str] = FORMATS, seed: int = 0, max_pages: int = 1) -> list[CorpusDocument]:
+    os.makedirs(out_dir, exist_ok=True)
+    documents = []
+    for document, content in generate_documents(count, formats, seed, max_pages):
+        with open(os.path.join(out_dir, document.filename), "wb") as f:
+            f.write(content)
+        documents.append(document)
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump({"seed": seed, "documents": [asdict(document) for document in documents]}, f, indent=2)
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a synthetic document corpus")
+    parser.add_argument("--out", default="bench_corpus")
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=ALL_FORMATS)
+    parser.add_argument("--max-pages", type=int, default=1, help="PDFs get between 1 and this many pages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents = write_corpus(args.out, args.count, args.formats, args.seed, args.max_pages)
+    print(f"Wrote {len(documents)} documents to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark the DOCX extraction engines on large generated invoices.
+
+An invoice (src/benchmarks/corpus.py) with --rows line items in a table is rendered once per size and read with:
+- python_docx: the previous engine, loads the whole document object model and reads the body paragraphs
+- python_docx_tables: python-docx reading the tables as well, what the previous engine costs for the same text
+- stream: word/document.xml, headers and footers parsed straight from the zip, tables included, no budget
+- stream_budget: the same with the default DOCX_CHAR_BUDGET, stops parsing once the budget is used up
+- stream_head: the first CASCADE_HEAD_CHARS characters, what tier 0 of the cascade reads
+
+Latency comes from measure() in pipeline_benchmark. python-docx allocates most of its memory in lxml, which
+tracemalloc cannot see, so the peak resident memory each engine adds is measured in a fresh interpreter per
+engine and size that only reads the file: the high water mark of resident memory (VmHWM, Linux) is reset after
+the engine is warmed up and read again after one extraction.
+
+Run from the root of the repo:
+    python -m src.benchmarks.docx_benchmark --rows 1000 10000 50000 --repeat 3
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from src.benchmarks.corpus import invoice_text, render_docx
+from src.benchmarks.pipeline_benchmark import measure
+from src.settings import CASCADE_HEAD_CHARS, DOCX_CHAR_BUDGET
+from src.utils.extract_text import DocxTextExtractor
+
+
+def _python_docx_with_tables(content: bytes) -> str:
+    from docx import Document
+
+    document = Document(BytesIO(content))
+    lines = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        lines.extend("\t".join(cell.text for cell in row.cells) for row in table.rows)
+    return "\n".join(lines)
+
+ENGINES = {
+    "python_docx": lambda content: DocxTextExtractor(engine="python-docx", max_chars=0).extract_text(BytesIO(content)),
+    "python_docx_tables": _python_docx_with_tables,
+    "stream": lambda content: DocxTextExtractor(engine="stream", max_chars=0).extract_text(BytesIO(content)),
+    "stream_budget": lambda content: DocxTextExtractor(engine="stream", max_chars=DOCX_CHAR_BUDGET).extract_text(BytesIO(content)),
+    "stream_head": lambda content: DocxTextExtractor(engine="stream").extract_head(BytesIO(content), CASCADE_HEAD_CHARS),
+}
+
+
+def large_invoice_docx(rows: int, seed: int = 0) -> bytes:
+    # invoice_text adds 2 to 6 line items per page, ask for enough pages and keep the first `rows` items
+    lines = invoice_text(random.Random(seed), pages=rows // 2 + 1).split("\n")
+    items = [line for line in lines if line.startswith("Item No:")][:rows]
+    header = [line for line in lines if line and not line.startswith("Item No:")]
+    return render_docx("\n".join(header[:-2] + items + header[-2:]))
+
+# ru_maxrss is kept across fork and exec so it would report the parent's peak, VmHWM belongs to this process
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def run_one(engine: str, path: str) -> dict:
+    with open(path, "rb") as f:
+        content = f.read()
+    ENGINES[engine](render_docx("Invoice"))  # import the engine's libraries before the baseline
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # reset VmHWM to the current resident memory
+    before = _status_mb("VmHWM")
+    start = time.perf_counter()
+    chars = len(ENGINES[engine](content))
+    return {"seconds": round(time.perf_counter() - start, 4), "added_peak_rss_mb": round(_status_mb("VmHWM") - before, 1), "chars": chars}
+
+def bench_size(rows: int, repeat: int, seed: int) -> dict:
+    content = large_invoice_docx(rows, seed)
+    results = {"docx_kb": round(len(content) / 1024, 1)}
+    with tempfile.NamedTemporaryFile(suffix=".docx") as f:
+        f.write(content)
+        f.flush()
+        for engine, extract in ENGINES.items():
+            result = measure([lambda: extract(content)], repeat)
+            output = subprocess.run(
+                [sys.executable, "-m", "src.benchmarks.docx_benchmark", "--run-one", engine, "--path", f.name],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            result.update(json.loads(output.strip().splitlines()[-1]))
+            results[engine] = result
+    # python_docx_tables reads the same text as stream
+    results["stream_speedup_p50"] = round(results["python_docx_tables"]["p50_ms"] / results["stream"]["p50_ms"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and memory of the DOCX extraction engines on large documents")
+    parser.add_argument("--rows", nargs="+", type=int, default=[1000, 10000], help="invoice line items per document")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-one", choices=list(ENGINES), default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--path", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one, args.path)))
+        return
+
+    print(json.dumps({f"rows_{rows}": bench_size(rows, args.repeat, args.seed) for rows in args.rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark micro batched inference (src/utils/inference_scheduler.py) against one model call per request.
+
+--clients concurrent clients each classify texts back to back (closed loop) through:
+- unbatched: one classify_texts_task per text on the CPU executor, the path without the scheduler
+- window_<ms>: the scheduler with that batching window and --max-batch-size
+
+For each configuration it reports throughput, the p50/p99 latency of a request, the mean batch size and the
+p99 latency added over the unbatched run. One client shows the latency the window costs when nothing else is
+in flight to batch with, many clients show what batching buys under load.
+
+Texts are generated with the corpus templates (src/benchmarks/corpus.py) so they look like extracted documents.
+
+Run from the root of the repo:
+    python -m src.benchmarks.inference_batching_benchmark --clients 1 16 64 --windows-ms 0 2 5 10 20 --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from src.benchmarks.corpus import TEMPLATES
+from src.benchmarks.pipeline_benchmark import _percentile
+from src.utils.executors import get_cpu_executor, run_cpu, shutdown_executors
+from src.utils.inference_scheduler import InferenceScheduler
+from src.utils.tasks import classify_texts_task, warm_worker_task
+
+
+def make_texts(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    labels = list(TEMPLATES)
+    return [TEMPLATES[labels[i % len(labels)]](rng, pages=rng.randint(1, 3)) for i in range(count)]
+
+async def _unbatched(text: str) -> None:
+    await run_cpu(classify_texts_task, [text])
+
+async def run_load(classify, texts: list[str], clients: int, requests: int) -> dict:
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def client():
+        for index in remaining:
+            start = time.perf_counter()
+            await classify(texts[index % len(texts)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "throughput_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+    }
+
+async def bench_clients(texts: list[str], clients: int, requests: int, windows_ms: list[float], max_batch_size: int) -> dict:
+    results = {"unbatched": await run_load(_unbatched, texts, clients, requests)}
+    for window_ms in windows_ms:
+        batch_sizes = []
+        scheduler = InferenceScheduler(window_seconds=window_ms / 1000, max_batch_size=max_batch_size)
+
+        async def infer(batch, run=scheduler.infer):
+            batch_sizes.append(len(batch))
+            return await run(batch)
+
+        scheduler.infer = infer
+
+        async def classify(text):
+            await scheduler.classify(text)
+
+        result = await run_load(classify, texts, clients, requests)
+        result["mean_batch_size"] = round(sum(batch_sizes) / len(batch_sizes), 2)
+        result["added_p99_ms"] = round(result["p99_ms"] - results["unbatched"]["p99_ms"], 3)
+        result["throughput_gain"] = round(result["throughput_per_s"] / results["unbatched"]["throughput_per_s"], 2)
+        results[f"window_{window_ms:g}ms"] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and latency of micro batched inference by batching window")
+    parser.add_argument("--clients", nargs="+", type=int, default=[1, 16, 64], help="concurrent closed loop clients")
+    parser.add_argument("--windows-ms", nargs="+", type=float, default=[0, 2, 5, 10, 20])
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per configuration")
+    parser.add_argument("--texts", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, args.seed)
+    # load the model in every CPU worker before measuring
+    for future in [get_cpu_executor().submit(warm_worker_task) for _ in range(8)]:
+        future.result()
+
+    async def run_all():
+        return {
+            f"clients_{clients}": await bench_clients(texts, clients, args.requests, args.windows_ms, args.max_batch_size)
+            for clients in args.clients
+        }
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        shutdown_executors()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
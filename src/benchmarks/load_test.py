@@ -0,0 +1,341 @@
+"""
+End to end load test of the API for capacity planning.
+
+Boots src.fastapi_app:app under uvicorn against local stand-ins: a moto S3 server and a sqlite db in a temp
+directory. It then:
+1. seeds --files generated documents (src/benchmarks/corpus.py) across --customers customers through /upload_file/
+2. drives /classify_file with a --mix of PDF, DOCX, TXT and JPG files, either with --concurrency clients sending
+   back to back (closed loop) or at a target --rps (open loop, latency counted from the scheduled send time so a
+   slow server is not hidden by the client waiting on it)
+3. repeats the run for every uvicorn worker count in --workers, against the same seeded db and bucket
+
+Each run reports throughput, p50/p95/p99 latency, the error rate with the status codes seen, and the peak RSS of
+every uvicorn worker (rss_mb) and of the worker with its CPU pool processes (tree_rss_mb), sampled from /proc
+(Linux). Requests in the first --warmup seconds are not counted. The classification cache is off unless --cache is
+given, so every request is extracted and classified rather than served from the cache after the first pass.
+
+The load generator runs in this process, on a small machine it competes with the server for the CPU, keep
+--concurrency modest or run the server on other cores with taskset.
+
+Run from the root of the repo:
+    python -m src.benchmarks.load_test --files 2000 --customers 50 --workers 1 2 4 --concurrency 32 --duration 60 --out load.json
+    python -m src.benchmarks.load_test --workers 2 --rps 20 --duration 60 --compare load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import boto3
+import httpx
+
+from src.benchmarks.corpus import generate_documents
+from src.benchmarks.pipeline_benchmark import _percentile
+from src.benchmarks.upload_benchmark import start_moto_server
+
+BUCKET_NAME = "load-test-bucket"
+DEFAULT_MIX = "pdf=0.4,docx=0.3,txt=0.2,jpg=0.1"
+CONTENT_TYPES = {"pdf": "application/pdf", "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "txt": "text/plain", "jpg": "image/jpeg"}
+
+
+# "pdf=0.4,docx=0.3" -> {"pdf": 0.4, "docx": 0.3}
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        file_format, _, weight = part.partition("=")
+        if file_format.strip() not in CONTENT_TYPES:
+            raise ValueError(f"Unsupported format in mix: {file_format}")
+        mix[file_format.strip()] = float(weight)
+    total = sum(mix.values())
+    return {file_format: weight / total for file_format, weight in mix.items()}
+
+# documents per format in proportion to the mix, at least one of every format in it
+def plan_files(files: int, customers: int, mix: dict[str, float], seed: int, max_pages: int):
+    """Yield (customer id, filename, format, content), filenames do not give the label away."""
+    index = 0
+    for offset, (file_format, weight) in enumerate(mix.items()):
+        for _, content in generate_documents(max(1, round(files * weight)), [file_format], seed + offset, max_pages):
+            yield index % customers + 1, f"document_{index:06d}.{file_format}", file_format, content
+            index += 1
+
+def summarise_requests(latencies: list[float], statuses: Counter, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    total = sum(statuses.values())
+    errors = total - statuses.get("200", 0)
+    return {
+        "requests": total,
+        "throughput_per_s": round(statuses.get("200", 0) / seconds, 2) if seconds else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+# /proc helpers, memory of the uvicorn workers and their CPU pool processes
+def _rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def _children(pid: int) -> list[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+def _tree(pid: int) -> list[int]:
+    pids = [pid]
+    for child in _children(pid):
+        pids.extend(_tree(child))
+    return pids
+
+class RSSSampler(threading.Thread):
+    """Peak RSS of each uvicorn worker (children of the uvicorn process) alone and with its descendants."""
+
+    def __init__(self, server_pid: int, workers: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.workers = workers
+        self.interval = interval
+        self.peaks: dict[int, dict[str, float]] = {}
+        self._stop_event = threading.Event()
+
+    def _worker_pids(self) -> list[int]:
+        children = _children(self.server_pid)
+        # with a single worker uvicorn serves from its own process, with several the workers are its children
+        # (the multiprocessing resource tracker is also a child, it is skipped as the smallest)
+        if self.workers <= 1:
+            return [self.server_pid]
+        return sorted(children, key=_rss_mb, reverse=True)[:self.workers]
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            for pid in self._worker_pids():
+                peak = self.peaks.setdefault(pid, {"rss_mb": 0.0, "tree_rss_mb": 0.0})
+                peak["rss_mb"] = max(peak["rss_mb"], _rss_mb(pid))
+                peak["tree_rss_mb"] = max(peak["tree_rss_mb"], sum(_rss_mb(p) for p in _tree(pid)))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        peaks = list(self.peaks.values())
+        return {
+            "per_worker_peak_rss_mb": [round(peak["rss_mb"], 1) for peak in peaks],
+            "per_worker_peak_tree_rss_mb": [round(peak["tree_rss_mb"], 1) for peak in peaks],
+            "total_peak_tree_rss_mb": round(sum(peak["tree_rss_mb"] for peak in peaks), 1),
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers: int, port: int, env: dict, timeout: float = 120) -> subprocess.Popen:
+    """Start uvicorn with the app and wait until /ready answers on every worker."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.fastapi_app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        # WEB_CONCURRENCY so each worker sizes its CPU pool to its share of the cores
+        env={**env, "WEB_CONCURRENCY": str(workers)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    ready_in_a_row = 0
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with {server.returncode}")
+        try:
+            ready = httpx.get(f"http://127.0.0.1:{port}/ready", timeout=2).status_code == 200
+        except httpx.HTTPError:
+            ready = False
+        # requests land on any worker, a run of ready answers means every worker has loaded the model
+        ready_in_a_row = ready_in_a_row + 1 if ready else 0
+        if ready_in_a_row >= 3 * workers:
+            return server
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("uvicorn did not become ready")
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+async def seed_files(base_url: str, planned, concurrency: int) -> list[tuple[int, str, str]]:
+    """Upload the planned files through /upload_file/, returns (customer id, filename, format) of each."""
+    targets = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def upload(customer_id, filename, file_format, content):
+            async with semaphore:
+                response = await client.post(
+                    "/upload_file/", params={"customer_id": customer_id},
+                    files={"file": (filename, content, CONTENT_TYPES[file_format])},
+                )
+                response.raise_for_status()
+                targets.append((customer_id, filename, file_format))
+
+        await asyncio.gather(*[upload(*item) for item in planned])
+    return targets
+
+async def drive_load(base_url: str, targets: list[tuple[int, str, str]], mix: dict[str, float], duration: float, warmup: float,
+                     concurrency: int, rps: Optional[float], seed: int) -> dict:
+    rng = random.Random(seed)
+    by_format = {file_format: [target for target in targets if target[2] == file_format] for file_format in mix}
+    formats = [file_format for file_format in mix if by_format[file_format]]
+    weights = [mix[file_format] for file_format in formats]
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    measure_from, end = start + warmup, start + warmup + duration
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=httpx.Limits(max_connections=None)) as client:
+        async def send(scheduled: float):
+            customer_id, filename, _ = rng.choice(by_format[rng.choices(formats, weights)[0]])
+            try:
+                response = await client.post("/classify_file", json={"customer_id": customer_id, "filename": filename})
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if scheduled >= measure_from:
+                latencies.append(time.perf_counter() - scheduled)
+                statuses[status] += 1
+
+        if rps:
+            # open loop, one request every 1 / rps seconds whatever the server's latency
+            in_flight = set()
+            scheduled = start
+            while scheduled < end:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                task = asyncio.ensure_future(send(scheduled))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                scheduled += 1 / rps
+            await asyncio.gather(*in_flight)
+        else:
+            async def closed_loop_client():
+                while time.perf_counter() < end:
+                    await send(time.perf_counter())
+
+            await asyncio.gather(*[closed_loop_client() for _ in range(concurrency)])
+
+    return summarise_requests(latencies, statuses, min(duration, time.perf_counter() - measure_from))
+
+# throughput and p99 change per worker count against an earlier report, positive p99 change is slower
+def compare(baseline: dict, current: dict) -> dict:
+    deltas = {}
+    for name, run in current["runs"].items():
+        before = baseline.get("runs", {}).get(name)
+        if not before or not before.get("throughput_per_s") or not before.get("p99_ms") or run.get("p99_ms") is None:
+            continue
+        deltas[name] = {
+            "throughput_change_pct": round((run["throughput_per_s"] - before["throughput_per_s"]) / before["throughput_per_s"] * 100, 1),
+            "p99_change_pct": round((run["p99_ms"] - before["p99_ms"]) / before["p99_ms"] * 100, 1),
+        }
+    return deltas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end load test of the API against local S3 and db stand-ins")
+    parser.add_argument("--files", type=int, default=2000, help="files seeded through /upload_file/")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f'share of each format in the files and the requests, default "{DEFAULT_MIX}"')
+    parser.add_argument("--max-pages", type=int, default=3, help="pages per generated PDF, 1 to this")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="uvicorn worker counts to sweep")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed loop clients, ignored with --rps")
+    parser.add_argument("--rps", type=float, default=None, help="target requests per second (open loop)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds measured per worker count")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--cache", action="store_true", help="leave the classification cache on")
+    parser.add_argument("--env", nargs="*", default=[], help="extra KEY=VALUE settings for the server, e.g. CPU_WORKERS=2")
+    parser.add_argument("--upload-concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the JSON report to this file")
+    parser.add_argument("--compare", default=None, help="earlier report to compare throughput and p99 against")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    work_dir = tempfile.mkdtemp(prefix="load-test-")
+    s3_port, api_port = _free_port(), _free_port()
+    env = {
+        **os.environ,
+        "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": "us-east-1",
+        "S3_ENDPOINT_URL": f"http://127.0.0.1:{s3_port}",
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'load_test.db')}",
+        "BUCKET_NAME": BUCKET_NAME,
+        "SEED_ON_STARTUP": "false",
+        "JOB_WORKERS": "0",
+        "CLASSIFICATION_CACHE_ENABLED": "true" if args.cache else "false",
+        **dict(item.split("=", 1) for item in args.env),
+    }
+    os.environ.update({key: env[key] for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY")})
+
+    s3_server = start_moto_server(s3_port)
+    report = {
+        "config": {key: getattr(args, key) for key in ("files", "customers", "mix", "max_pages", "workers", "concurrency", "rps", "duration", "warmup", "cache", "env", "seed")},
+        "runs": {},
+    }
+    try:
+        boto3.client("s3", region_name="us-east-1", endpoint_url=env["S3_ENDPOINT_URL"]).create_bucket(Bucket=BUCKET_NAME)
+        targets = None
+        for workers in args.workers:
+            server = start_server(workers, api_port, env)
+            try:
+                base_url = f"http://127.0.0.1:{api_port}"
+                if targets is None:
+                    start = time.perf_counter()
+                    planned = plan_files(args.files, args.customers, mix, args.seed, args.max_pages)
+                    targets = asyncio.run(seed_files(base_url, planned, args.upload_concurrency))
+                    report["seed_seconds"] = round(time.perf_counter() - start, 1)
+                sampler = RSSSampler(server.pid, workers)
+                sampler.start()
+                try:
+                    run = asyncio.run(drive_load(base_url, targets, mix, args.duration, args.warmup, args.concurrency, args.rps, args.seed))
+                finally:
+                    memory = sampler.stop()
+                run.update(memory)
+                report["runs"][f"workers_{workers}"] = run
+                print(json.dumps({f"workers_{workers}": run}), file=sys.stderr)
+            finally:
+                stop_server(server)
+    finally:
+        s3_server.terminate()
+        s3_server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(json.load(f), report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
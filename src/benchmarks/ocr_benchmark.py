@@ -0,0 +1,86 @@
+"""
+Benchmark per image OCR latency before and after the reader pool.
+
+before: a new easyocr.Reader is built for every image and the full size colour image is OCR'd
+after:  OCRTextExtractor, a pooled reader and a grayscale image downscaled to OCR_MAX_DIMENSION
+
+Run from the root of the repo:
+    python -m src.benchmarks.ocr_benchmark --images files/drivers_license_1.jpg files/drivers_licence_2.jpg --repeat 3
+"""
+
+import argparse
+import json
+import statistics
+import time
+from io import BytesIO
+
+import easyocr
+import numpy as np
+from PIL import Image
+
+from src.settings import OCR_LANGUAGES, OCR_USE_GPU
+from src.utils.extract_text import OCRTextExtractor
+from src.utils.ocr_pool import get_ocr_pool
+
+
+def _summary(latencies: list[float]) -> dict:
+    return {
+        "runs": len(latencies),
+        "mean_s": round(statistics.mean(latencies), 4),
+        "p50_s": round(statistics.median(latencies), 4),
+        "max_s": round(max(latencies), 4),
+    }
+
+# old behaviour, a reader per image
+def bench_reader_per_image(images: list[bytes], repeat: int) -> list[float]:
+    latencies = []
+    for _ in range(repeat):
+        for image_bytes in images:
+            start = time.perf_counter()
+            reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_USE_GPU)
+            reader.readtext(np.asarray(Image.open(BytesIO(image_bytes))))
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+# new behaviour, pooled reader and preprocessed image
+def bench_pooled(images: list[bytes], repeat: int) -> list[float]:
+    extractor = OCRTextExtractor()
+    latencies = []
+    for _ in range(repeat):
+        for image_bytes in images:
+            start = time.perf_counter()
+            extractor.extract_text(BytesIO(image_bytes))
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per image OCR latency before and after the reader pool")
+    parser.add_argument("--images", nargs="+", default=["files/drivers_license_1.jpg"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    before = bench_reader_per_image(images, args.repeat)
+
+    warm_start = time.perf_counter()
+    get_ocr_pool().warm()
+    warm_s = time.perf_counter() - warm_start
+
+    after = bench_pooled(images, args.repeat)
+
+    print(json.dumps({
+        "images": args.images,
+        "before_reader_per_image": _summary(before),
+        "after_pooled_reader": _summary(after),
+        "pool_warm_s": round(warm_s, 4),
+        "speedup_mean": round(statistics.mean(before) / statistics.mean(after), 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
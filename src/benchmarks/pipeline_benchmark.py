@@ -0,0 +1,207 @@
+"""
+Per stage micro benchmarks of the classification pipeline on a synthetic corpus (src/benchmarks/corpus.py).
+
+Stages, each measured on its own:
+- s3_fetch: download_file_return_bytes against a local S3 stand-in (moto server in a child process)
+- extract_pdf / extract_docx / extract_txt / extract_jpg: each TextExtractor subclass (extract_scanned_pdf with --formats scanned_pdf)
+- clean_text
+- model_load: load_model with the model cache cleared
+- predict_single: classify_file_ml one document at a time
+- predict_batched: classify_files_ml over --batch-size documents, reported per document
+
+Every stage reports mean, p50, p99 and max latency in ms from the timed runs and the peak Python heap
+(tracemalloc) from one extra untimed pass, so tracing does not skew the latencies. Results are written as
+JSON with the commit and machine details, --compare prints the p50 change against an earlier results file.
+
+Run from the root of the repo:
+    python -m src.benchmarks.pipeline_benchmark --docs 60 --repeat 3 --out bench_results.json
+    python -m src.benchmarks.pipeline_benchmark --compare bench_results.json --out bench_results_new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Callable, Optional
+
+from src.benchmarks.corpus import ALL_FORMATS, FORMATS, generate_documents
+from src.classifier import _load_model, classify_file_ml, classify_files_ml, clean_text, load_model
+from src.settings import MODEL_PATH
+from src.utils.extract_text import DocxTextExtractor, OCRTextExtractor, PDFTextExtractor, TxtTextExtractor
+
+BUCKET_NAME = "benchmark-bucket"
+EXTRACTORS = {"pdf": PDFTextExtractor, "docx": DocxTextExtractor, "txt": TxtTextExtractor, "jpg": OCRTextExtractor, "scanned_pdf": PDFTextExtractor}
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarise(latencies: list[float], peak_bytes: int, items_per_run: int = 1) -> dict:
+    per_item = sorted(latency / items_per_run for latency in latencies)
+    return {
+        "runs": len(per_item),
+        "mean_ms": round(statistics.mean(per_item) * 1000, 4),
+        "p50_ms": round(_percentile(per_item, 50) * 1000, 4),
+        "p99_ms": round(_percentile(per_item, 99) * 1000, 4),
+        "max_ms": round(per_item[-1] * 1000, 4),
+        "peak_mem_kb": round(peak_bytes / 1024, 1),
+    }
+
+def measure(work: list[Callable[[], object]], repeat: int, items_per_run: int = 1, setup: Optional[Callable[[], None]] = None) -> dict:
+    """Time every callable `repeat` times, then run each once more under tracemalloc for the peak heap."""
+    latencies = []
+    for _ in range(repeat):
+        for call in work:
+            if setup:
+                setup()
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+
+    peak = 0
+    for call in work:
+        if setup:
+            setup()
+        tracemalloc.start()
+        call()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return summarise(latencies, peak, items_per_run)
+
+
+def bench_s3_fetch(documents: list[tuple], repeat: int) -> dict:
+    import boto3
+
+    from src.benchmarks.upload_benchmark import start_moto_server
+    from src.utils.utils import download_file_return_bytes
+
+    # the stand-in accepts any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = start_moto_server(port)
+    try:
+        s3_client = boto3.client("s3", region_name="us-east-1", endpoint_url=f"http://127.0.0.1:{port}")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        for document, content in documents:
+            s3_client.put_object(Bucket=BUCKET_NAME, Key=document.filename, Body=content)
+        work = [lambda key=document.filename: download_file_return_bytes(s3_client, BUCKET_NAME, key) for document, _ in documents]
+        return measure(work, repeat)
+    finally:
+        server.terminate()
+        server.wait()
+
+def bench_extractors(documents: list[tuple], repeat: int) -> tuple[dict, dict[str, list[str]]]:
+    results = {}
+    texts = {}
+    for file_format, extractor_cls in EXTRACTORS.items():
+        docs = [content for document, content in documents if document.format == file_format]
+        if not docs:
+            continue
+        try:
+            extractor = extractor_cls()
+            texts[file_format] = [extractor.extract_text(BytesIO(content)) for content in docs]  # warm up, e.g. OCR readers
+        except Exception as e:
+            results[f"extract_{file_format}"] = {"skipped": f"{type(e).__name__}: {e}"}
+            continue
+        work = [lambda content=content: extractor.extract_text(BytesIO(content)) for content in docs]
+        results[f"extract_{file_format}"] = measure(work, repeat)
+    return results, texts
+
+def bench_model(texts: list[str], repeat: int, batch_size: int, model_path: str) -> dict:
+    results = {}
+    results["clean_text"] = measure([lambda text=text: clean_text(text) for text in texts], repeat)
+    results["model_load"] = measure([lambda: load_model(model_path)], max(1, repeat), setup=_load_model.cache_clear)
+
+    load_model(model_path)
+    results["predict_single"] = measure([lambda text=text: classify_file_ml(text) for text in texts], repeat)
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    full_batches = [batch for batch in batches if len(batch) == batch_size] or batches
+    results["predict_batched"] = measure(
+        [lambda batch=batch: classify_files_ml(batch) for batch in full_batches], repeat, items_per_run=len(full_batches[0])
+    )
+    results["predict_batched"]["batch_size"] = len(full_batches[0])
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(docs: int, repeat: int, formats: list[str], batch_size: int, seed: int, max_pages: int, skip_s3: bool, model_path: str = MODEL_PATH) -> dict:
+    documents = list(generate_documents(docs, formats, seed, max_pages))
+    stages = {}
+    if not skip_s3:
+        stages["s3_fetch"] = bench_s3_fetch(documents, repeat)
+    extract_results, texts = bench_extractors(documents, repeat)
+    stages.update(extract_results)
+    all_texts = [text for format_texts in texts.values() for text in format_texts]
+    stages.update(bench_model(all_texts, repeat, batch_size, model_path))
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "model_path": model_path,
+            "docs": docs,
+            "repeat": repeat,
+            "formats": formats,
+            "seed": seed,
+        },
+        "stages": stages,
+    }
+
+# p50 change per stage against an earlier results file, positive is slower
+def compare(baseline: dict, current: dict) -> dict:
+    deltas = {}
+    for stage, result in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {})
+        if "p50_ms" in result and before.get("p50_ms"):
+            deltas[stage] = {
+                "p50_ms_before": before["p50_ms"],
+                "p50_ms_after": result["p50_ms"],
+                "change_pct": round((result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100, 1),
+            }
+    return deltas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the classification pipeline")
+    parser.add_argument("--docs", type=int, default=60, help="documents in the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=ALL_FORMATS)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-pages", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--skip-s3", action="store_true", help="skip the S3 fetch stage (needs moto[server])")
+    parser.add_argument("--out", default=None, help="write the JSON results to this file")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare p50 latencies against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.docs, args.repeat, args.formats, args.batch_size, args.seed, args.max_pages, args.skip_s3, args.model)
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = compare(json.load(f), results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark OCR throughput on a scanned PDF as the number of page OCR workers grows.
+
+A synthetic bank statement (src/benchmarks/corpus.py) is rendered as a PDF with no text layer, one JPEG per page,
+and read with PDFTextExtractor using 1, 2, 4 ... up to --max-workers OCR workers, each with its own pooled reader.
+The same statement as a digital PDF is read with the OCR fallback on and off to check digital PDFs pay nothing extra.
+
+Reports pages/sec and the speedup over one worker.
+
+Run from the root of the repo:
+    python -m src.benchmarks.scanned_pdf_benchmark --pages 50 --max-workers 8
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from io import BytesIO
+
+from src.benchmarks.corpus import bank_statement_text, render_pdf, render_scanned_pdf
+from src.utils.extract_text import PDFTextExtractor
+from src.utils.ocr_pool import OCRReaderPool
+
+
+def _time(extractor: PDFTextExtractor, content: bytes, repeat: int) -> list[float]:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extractor.extract_text(BytesIO(content))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_scanned(content: bytes, pages: int, worker_counts: list[int], repeat: int) -> dict:
+    results = {}
+    for workers in worker_counts:
+        pool = OCRReaderPool(size=workers)
+        pool.warm()  # reader load time is paid once per process, not per document
+        extractor = PDFTextExtractor(max_pages=0, max_chars=0, ocr_page_cap=pages, ocr_workers=workers, ocr_pool=pool)
+        mean_s = statistics.mean(_time(extractor, content, repeat))
+        results[workers] = {"mean_s": round(mean_s, 4), "pages_per_s": round(pages / mean_s, 2)}
+    base = results[worker_counts[0]]["mean_s"]
+    for result in results.values():
+        result["speedup"] = round(base / result["mean_s"], 2)
+    return results
+
+def bench_digital(content: bytes, repeat: int) -> dict:
+    with_ocr = statistics.median(_time(PDFTextExtractor(max_pages=0, max_chars=0), content, repeat))
+    without_ocr = statistics.median(_time(PDFTextExtractor(max_pages=0, max_chars=0, ocr=False), content, repeat))
+    return {"ocr_fallback_on_p50_s": round(with_ocr, 4), "ocr_fallback_off_p50_s": round(without_ocr, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scanned PDF OCR throughput by number of OCR workers")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = bank_statement_text(random.Random(args.seed), pages=args.pages)
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(json.dumps({
+        "pages": args.pages,
+        "cpus": os.cpu_count(),
+        "scanned_by_workers": bench_scanned(render_scanned_pdf(text, args.pages), args.pages, worker_counts, args.repeat),
+        "digital": bench_digital(render_pdf(text, args.pages), args.repeat * 5),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark out of core training against the notebook's in memory fit on large synthetic corpora.
+
+For every --docs size the texts come from the corpus templates (synthetic_documents in
+src/scripts/train_incremental_model.py) and are trained with:
+- incremental: train() from the training CLI, hashed features and partial_fit a --batch-size batch at a time
+- in_memory: the notebook pipeline (notebooks/model_develop.ipynb), CountVectorizer(ngram_range=(1, 3)) and a
+  100 tree RandomForest fitted on every text at once, only up to --in-memory-max-docs as it grows with the corpus
+
+Each run is a fresh interpreter so the peak resident memory (VmHWM, Linux) belongs to that run only: the high
+water mark is reset once the libraries are imported and read when training ends. The holdout documents are
+the same for both (every 10th, up to 2000).
+
+Run from the root of the repo:
+    python -m src.benchmarks.training_benchmark --docs 10000 100000 --in-memory-max-docs 20000
+"""
+
+import argparse
+import json
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.pipeline import make_pipeline
+
+from src.classifier import clean_text
+from src.scripts.train_incremental_model import peak_rss_mb, reset_peak_rss, synthetic_documents, train
+
+TRAINERS = ["incremental", "in_memory"]
+HOLDOUT_EVERY = 10
+HOLDOUT_MAX = 2000
+
+
+def _in_memory(docs: int, seed: int) -> dict:
+    start = time.perf_counter()
+    texts, labels, holdout_texts, holdout_labels = [], [], [], []
+    for index, (label, text) in enumerate(synthetic_documents(docs, seed)):
+        if index % HOLDOUT_EVERY == HOLDOUT_EVERY - 1 and len(holdout_texts) < HOLDOUT_MAX:
+            holdout_texts.append(clean_text(text))
+            holdout_labels.append(label)
+        else:
+            texts.append(clean_text(text))
+            labels.append(label)
+    model = make_pipeline(CountVectorizer(ngram_range=(1, 3), stop_words="english"), RandomForestClassifier(n_estimators=100, random_state=42))
+    model.fit(texts, labels)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "holdout_accuracy": round(float(np.mean(model.predict(holdout_texts) == np.array(holdout_labels))), 4),
+        "model": model,
+        "vocabulary": len(model[0].vocabulary_),
+    }
+
+def _incremental(docs: int, seed: int, batch_size: int) -> dict:
+    model, _, report = train(synthetic_documents(docs, seed), batch_size=batch_size, holdout_every=HOLDOUT_EVERY, holdout_max=HOLDOUT_MAX)
+    return {"seconds": report.seconds, "holdout_accuracy": report.holdout_accuracy, "model": model}
+
+def run_one(trainer: str, docs: int, seed: int, batch_size: int) -> dict:
+    reset_peak_rss()
+    before = peak_rss_mb()
+    result = _in_memory(docs, seed) if trainer == "in_memory" else _incremental(docs, seed, batch_size)
+    added_peak = peak_rss_mb() - before
+    model = result.pop("model")
+    return {
+        **result,
+        "seconds": round(result["seconds"], 2),
+        "docs_per_sec": round(docs / result["seconds"], 1),
+        "added_peak_rss_mb": round(added_peak, 1),
+        "model_mb": round(len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 2 ** 20, 1),
+    }
+
+def bench_size(docs: int, trainers: list[str], in_memory_max_docs: int, seed: int, batch_size: int) -> dict:
+    results = {}
+    for trainer in trainers:
+        if trainer == "in_memory" and docs > in_memory_max_docs:
+            results[trainer] = {"skipped": f"more than --in-memory-max-docs {in_memory_max_docs}"}
+            continue
+        output = subprocess.run(
+            [sys.executable, "-m", "src.benchmarks.training_benchmark", "--run-one", trainer, "--docs", str(docs),
+             "--seed", str(seed), "--batch-size", str(batch_size)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[trainer] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and peak memory of out of core and in memory training")
+    parser.add_argument("--docs", nargs="+", type=int, default=[10000, 100000], help="corpus sizes")
+    parser.add_argument("--trainers", nargs="+", default=TRAINERS, choices=TRAINERS)
+    parser.add_argument("--in-memory-max-docs", type=int, default=20000, help="largest corpus fitted in memory")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-one", choices=TRAINERS, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one, args.docs[0], args.seed, args.batch_size)))
+        return
+
+    print(json.dumps({
+        f"docs_{docs}": bench_size(docs, args.trainers, args.in_memory_max_docs, args.seed, args.batch_size) for docs in args.docs
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
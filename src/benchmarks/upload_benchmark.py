@@ -0,0 +1,111 @@
+"""
+Benchmark upload throughput against a local S3 stand-in (moto server, run in its own process so its
+in memory object store does not count towards the measured heap).
+
+streaming: chunks piped into stream_upload_to_s3, multipart with the hash computed in the same pass
+temp_file: the previous behaviour, copy to a local file then s3_client.upload_file
+
+Reports MB/s and the peak Python heap (tracemalloc) for each path.
+
+Run from the root of the repo:
+    python -m src.benchmarks.upload_benchmark --size-mb 256
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+
+from src.utils.streaming_upload import stream_upload_to_s3
+
+BUCKET_NAME = "benchmark-bucket"
+CHUNK_SIZE = 1024 * 1024
+
+
+async def _chunks(size: int):
+    block = os.urandom(CHUNK_SIZE)
+    sent = 0
+    while sent < size:
+        chunk = block[:min(CHUNK_SIZE, size - sent)]
+        sent += len(chunk)
+        yield chunk
+
+
+# start moto's S3 server in a child process and wait until it accepts requests
+def start_moto_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    probe = boto3.client("s3", region_name="us-east-1", endpoint_url=f"http://127.0.0.1:{port}")
+    for _ in range(100):
+        try:
+            probe.list_buckets()
+            return server
+        except Exception:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("moto server did not start")
+
+
+def bench_streaming(s3_client, size: int) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = asyncio.run(stream_upload_to_s3(_chunks(size), s3_client, BUCKET_NAME, "bench/streaming.bin"))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 3), "mb_per_s": round(size / elapsed / 2**20, 1), "peak_heap_mb": round(peak / 2**20, 1), "parts": result.parts, "disk_bytes": 0}
+
+
+def bench_temp_file(s3_client, size: int) -> dict:
+    async def collect(path):
+        with open(path, "wb") as f:
+            async for chunk in _chunks(size):
+                f.write(chunk)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "upload.bin")
+        asyncio.run(collect(path))
+        s3_client.upload_file(path, BUCKET_NAME, "bench/temp_file.bin")
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 3), "mb_per_s": round(size / elapsed / 2**20, 1), "peak_heap_mb": round(peak / 2**20, 1), "disk_bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming multipart upload vs temp file upload")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+    size = args.size_mb * 2**20
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    server = start_moto_server(args.port)
+    try:
+        s3_client = boto3.client("s3", region_name="us-east-1", endpoint_url=f"http://127.0.0.1:{args.port}")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        results = {
+            "size_mb": args.size_mb,
+            "streaming": bench_streaming(s3_client, size),
+            "temp_file": bench_temp_file(s3_client, size),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
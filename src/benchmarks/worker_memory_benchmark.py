@@ -0,0 +1,94 @@
+"""
+Benchmark the memory each CPU worker costs with and without shared model weights.
+
+Each configuration runs in a fresh interpreter with its own settings, starts a pool of --workers CPU workers
+through make_cpu_executor, loads the model in every worker and reads each worker's memory from /proc (Linux):
+- rss: resident memory, shared pages counted in full in every process
+- pss: shared pages split between the processes sharing them, the sum over processes is the real footprint
+- uss: pages private to the worker, i.e. the memory one more worker adds
+
+Configurations:
+- spawn: every worker loads its own copy (the previous behaviour)
+- forkserver_preload: the models are loaded once in the forkserver and the workers are forked from it
+- with --compiled DIR, both again serving a compiled model (src/scripts/compile_model.py) memory mapped read only
+
+Run from the root of the repo:
+    python -m src.benchmarks.worker_memory_benchmark --workers 4
+    python -m src.benchmarks.worker_memory_benchmark --workers 4 --compiled text_classifier_compiled
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _hold_and_measure(delay: float) -> tuple[int, dict]:
+    # imported here so the settings are read from the environment of the benchmark run
+    from src.classifier import load_model
+    from src.utils.preload import process_memory
+
+    load_model()
+    time.sleep(delay)  # keeps this worker busy so every task lands on a different worker
+    return os.getpid(), process_memory()
+
+def run_one(workers: int) -> dict:
+    from src.settings import CPU_MP_START_METHOD, MODEL_PATH, MODEL_PRELOAD
+    from src.utils.executors import make_cpu_executor
+    from src.utils.preload import process_memory
+
+    start = time.perf_counter()
+    executor = make_cpu_executor("process", workers)
+    try:
+        measured = dict(future.result() for future in [executor.submit(_hold_and_measure, 1.0) for _ in range(workers)])
+    finally:
+        executor.shutdown()
+    per_worker = list(measured.values())
+    return {
+        "start_method": CPU_MP_START_METHOD,
+        "preload": MODEL_PRELOAD,
+        "model_path": MODEL_PATH,
+        "workers_measured": len(per_worker),
+        "startup_s": round(time.perf_counter() - start, 2),
+        "parent": process_memory(),
+        "mean_rss_mb": round(statistics.mean(memory.get("rss_mb", 0) for memory in per_worker), 1),
+        "mean_uss_mb_per_additional_worker": round(statistics.mean(memory.get("uss_mb", 0) for memory in per_worker), 1),
+        "total_pss_mb": round(sum(memory.get("pss_mb", 0) for memory in per_worker), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per CPU worker with and without shared model weights")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--compiled", default=None, help="compiled model directory to also measure, memory mapped")
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.workers)))
+        return
+
+    configurations = {
+        "spawn": {"CPU_MP_START_METHOD": "spawn", "MODEL_PRELOAD": "false"},
+        "forkserver_preload": {"CPU_MP_START_METHOD": "forkserver", "MODEL_PRELOAD": "true"},
+    }
+    if args.compiled:
+        configurations["compiled_mmap_spawn"] = {**configurations["spawn"], "MODEL_PATH": args.compiled, "MODEL_MMAP": "true"}
+        configurations["compiled_mmap_forkserver_preload"] = {**configurations["forkserver_preload"], "MODEL_PATH": args.compiled, "MODEL_MMAP": "true"}
+
+    results = {}
+    for name, env in configurations.items():
+        output = subprocess.run(
+            [sys.executable, "-m", "src.benchmarks.worker_memory_benchmark", "--run-one", "--workers", str(args.workers)],
+            env={**os.environ, **env}, capture_output=True, text=True, check=True,
+        ).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
+import hashlib
+import os
 import pickle
 import string
+import time
 from functools import lru_cache
 
+from src.settings import MODEL_MMAP, MODEL_PATH
+
 # Text preprocessing function
 # convert to lower case
 # remove stop words
@@ -12,14 +17,54 @@ def clean_text(text):
     text = " ".join(text.split())  # Remove extra whitespace
     return text
 
-# Load the model via a function and cache it
+# files making up the model, the pickle itself or every array of a compiled model directory
+def _model_files(model_path):
+    if os.path.isdir(model_path):
+        return [os.path.join(model_path, name) for name in sorted(os.listdir(model_path))]
+    return [model_path]
+
+# mtime and size of the model files, a change to either means the model was replaced
+def _model_signature(model_path):
+    signature = []
+    for path in _model_files(model_path):
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
 @lru_cache(maxsize=1)  # Cache the loaded model in memory (maxsize=1 ensures only 1 cached item)
-def load_model(model_path="text_classifier_pipeline.pkl"):
-    # Load the pickled pipeline only once
+def _load_model(model_path, signature):
+    # compiled models (see src/scripts/compile_model.py) are served without sklearn
+    # imported here so numpy is only loaded with the model, not when the app is imported
+    from src.compiled_model import CompiledTextClassifier, is_compiled_model
+
+    if is_compiled_model(model_path):
+        # memory mapped read only, the arrays stay in the page cache shared by every process rather than copied into each
+        return CompiledTextClassifier.load(model_path, mmap=MODEL_MMAP)
+
+    # Load the pickled pipeline only once per version of the file
     with open(model_path, "rb") as file:
         loaded_model = pickle.load(file)
     return loaded_model
 
+# Load the model via a function and cache it
+# the cache is keyed on the file signature so a replaced pickle is picked up without a restart
+def load_model(model_path=MODEL_PATH):
+    return _load_model(model_path, _model_signature(model_path))
+
+@lru_cache(maxsize=4)
+def _hash_model_file(model_path, signature):
+    digest = hashlib.sha256()
+    for path in _model_files(model_path):
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+# version of the model currently on disk, the sha256 of the model file(s)
+# anything derived from the model (e.g. cached classifications) should be keyed on this
+def get_model_version(model_path=MODEL_PATH):
+    return _hash_model_file(model_path, _model_signature(model_path))
+
 def classify_file_ml(text):
     # Load the cached model
     loaded_model = load_model()
@@ -29,3 +74,105 @@ def classify_file_ml(text):
     
     # Predict the file type using the model
     return loaded_model.predict([preprocessed_text])[0]
+
+# Classify many texts with a single vectorised call to the model
+# returns a (file_class, confidence) tuple per text, in the same order as the input
+# one predict_proba over the whole batch amortises the sklearn/RandomForest call overhead
+# pass a timings dict to have the seconds spent cleaning and predicting added to its "clean" and "inference" keys
+def classify_files_ml(texts, timings=None):
+    if not texts:
+        return []
+
+    # Load the cached model
+    loaded_model = load_model()
+
+    # Preprocess all the input texts
+    start = time.perf_counter()
+    preprocessed_texts = [clean_text(text) for text in texts]
+    cleaned = time.perf_counter()
+
+    # predict_proba gives the class and its confidence in one pass over the trees
+    probabilities = loaded_model.predict_proba(preprocessed_texts)
+    if timings is not None:
+        _add_timing(timings, "clean", cleaned - start)
+        _add_timing(timings, "inference", time.perf_counter() - cleaned)
+    best = probabilities.argmax(axis=1)
+    return [
+        (loaded_model.classes_[idx], float(probabilities[row, idx]))
+        for row, idx in enumerate(best)
+    ]
+
+def _add_timing(timings, stage, seconds):
+    timings[stage] = timings.get(stage, 0.0) + seconds
+
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+# clean_text of a text that arrives in pieces, each piece is cleaned once as it arrives
+# the words of a piece that does not start with whitespace continue the last word of the previous piece,
+# so text() is always clean_text of everything added so far
+class _CleanedText:
+    def __init__(self):
+        self.words = []
+        self._open_word = False  # the last piece ended inside a word
+
+    def add(self, text):
+        text = text.lower().translate(_PUNCTUATION)
+        words = text.split()
+        if words and self._open_word and not text[0].isspace():
+            self.words[-1] += words.pop(0)
+        self.words.extend(words)
+        if text:
+            self._open_word = not text[-1].isspace()
+
+    def text(self):
+        return " ".join(self.words)
+
+# pages after which the text read so far is classified, 1, 2, 4, 8 ... so a document of n pages costs
+# log2(n) model calls and each page is cleaned once
+def _is_checkpoint(pages_read):
+    return pages_read & (pages_read - 1) == 0
+
+# Classify a document page by page and stop as soon as the model is confident enough
+# the text read so far is classified after pages 1, 2, 4, 8 ..., so a 200 page statement is usually decided on page one
+# when the pages run out between checkpoints everything read is classified once more
+# returns (file_class, confidence, pages_read, text_read), timings as for classify_files_ml
+def classify_pages_ml(pages, confidence_threshold, timings=None):
+    loaded_model = load_model()
+
+    text_parts = []
+    cleaned_text = _CleanedText()
+    file_class, confidence = None, 0.0
+    pages_read = 0
+    classified_pages = None  # pages read at the last prediction
+    for page_text in pages:
+        text_parts.append(page_text)
+        pages_read += 1
+        if not confidence_threshold:
+            continue
+
+        start = time.perf_counter()
+        cleaned_text.add(page_text)
+        if timings is not None:
+            _add_timing(timings, "clean", time.perf_counter() - start)
+        if not _is_checkpoint(pages_read):
+            continue
+        file_class, confidence = _predict_cleaned(loaded_model, cleaned_text.text(), timings)
+        classified_pages = pages_read
+        if confidence >= confidence_threshold:
+            break
+    else:
+        # budget or document exhausted without a confident answer, classify everything that was read
+        if not confidence_threshold or pages_read == 0:
+            [(file_class, confidence)] = classify_files_ml(["".join(text_parts)], timings)
+        elif classified_pages != pages_read:
+            file_class, confidence = _predict_cleaned(loaded_model, cleaned_text.text(), timings)
+
+    return file_class, confidence, pages_read, "".join(text_parts)
+
+def _predict_cleaned(loaded_model, preprocessed_text, timings):
+    start = time.perf_counter()
+    probabilities = loaded_model.predict_proba([preprocessed_text])[0]
+    if timings is not None:
+        _add_timing(timings, "inference", time.perf_counter() - start)
+    best = probabilities.argmax()
+    return loaded_model.classes_[best], float(probabilities[best])
@@ -0,0 +1,106 @@
+"""
+Lightweight runtime for the compiled text classifier.
+
+`src/scripts/compile_model.py` exports the fitted CountVectorizer + RandomForest pipeline into a directory
+of flat NumPy arrays. This module evaluates that artifact with NumPy only (no sklearn import), and exposes
+the same predict / predict_proba / classes_ interface as the pipeline so it can be served by load_model.
+
+Artifact layout (one .npy file per array plus meta.json):
+- vocabulary:  sorted array of the n-grams used by at least one tree split, indexed into a dict on load
+- stop_words:  stop words removed before n-grams are built
+- classes:     class labels in model order
+- left/right:  child node index per node, trees concatenated, leaves point at themselves
+- feature:     index into vocabulary tested at each node
+- threshold:   split threshold per node, a document goes left when count <= threshold
+- value:       class probabilities per node (only read at leaves)
+- roots:       index of the root node of each tree
+- meta.json:   tokenizer settings and the maximum tree depth
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+ARRAY_NAMES = ("vocabulary", "stop_words", "classes", "left", "right", "feature", "threshold", "value", "roots")
+
+
+class CompiledTextClassifier:
+    def __init__(self, arrays: dict, meta: dict):
+        self.vocabulary = arrays["vocabulary"]
+        self.classes_ = arrays["classes"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.stop_words = frozenset(arrays["stop_words"].tolist())
+        # hash index over the sorted vocabulary array, built once at load, it only holds the few hundred n-grams the trees use
+        self._index = {term: position for position, term in enumerate(self.vocabulary.tolist())}
+        self.lowercase = meta["lowercase"]
+        self.min_n, self.max_n = meta["ngram_range"]
+        self.max_depth = meta["max_depth"]
+        self._token_pattern = re.compile(meta["token_pattern"])
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "CompiledTextClassifier":
+        """Load an artifact directory, with mmap=True the arrays are memory mapped read only rather than copied."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(arrays, meta)
+
+    # same analysis as sklearn's CountVectorizer(analyzer="word")
+    def _ngrams(self, text: str) -> list[str]:
+        if self.lowercase:
+            text = text.lower()
+        tokens = [token for token in self._token_pattern.findall(text) if token not in self.stop_words]
+        ngrams = list(tokens) if self.min_n == 1 else []
+        for n in range(max(self.min_n, 2), min(self.max_n, len(tokens)) + 1):
+            ngrams.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return ngrams
+
+    def transform(self, texts: list[str]) -> np.ndarray:
+        """Dense (n_docs, n_features) count matrix over the compiled vocabulary."""
+        counts = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        rows, positions = [], []
+        index_get = self._index.get
+        for row, text in enumerate(texts):
+            for ngram in self._ngrams(text):
+                position = index_get(ngram)
+                if position is not None:
+                    rows.append(row)
+                    positions.append(position)
+        # one scatter add for the whole batch
+        np.add.at(counts, (np.asarray(rows, dtype=np.intp), np.asarray(positions, dtype=np.intp)), 1)
+        return counts
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        counts = self.transform(texts)
+        n_docs = len(texts)
+        docs = np.arange(n_docs)
+
+        # walk every tree for every document at once, leaves point at themselves so max_depth steps always land on a leaf
+        nodes = np.broadcast_to(self.roots, (n_docs, len(self.roots))).copy()
+        doc_index = docs[:, None]
+        for _ in range(self.max_depth):
+            go_left = counts[doc_index, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # accumulate tree by tree in the same order as sklearn so probabilities (and ties) match exactly
+        proba = np.zeros((n_docs, self.value.shape[1]), dtype=np.float64)
+        for tree in range(len(self.roots)):
+            proba += self.value[nodes[:, tree]]
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, texts: list[str]) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(texts), axis=1))
+
+
+# a compiled artifact is a directory containing meta.json, the pickle is a single file
+def is_compiled_model(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
@@ -3,18 +3,23 @@ This module manages the connection to the database using SQLAlchemy and variable
 
 - Establishes a connection to the database using the URL stored in environment variables.
 - Creates a session factory (`SessionLocal`) to interact with the database.
-- Provides a `create_tables` function to create all database tables defined in the models.
+- Provides a `create_tables` function to create all database tables defined in the models and bring existing
+  tables up to date (`migrate_tables`).
 
 The module is responsible for setting up and managing the database as well as connecting to the db
 """
 
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 
 from src.data_models.tables import Base
 
+logger = logging.getLogger(__name__)
+
 # Load in env vars
 load_dotenv()
 
@@ -38,4 +43,46 @@ def create_tables():
     Returns:
         None
     """
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    migrate_tables()
+
+# Bring tables created by an older version of the app up to date
+# create_all only creates missing tables, so columns and indexes added to a model since its table was created
+# are added here. Idempotent: only what is missing is added, so it runs on every startup and seed
+def migrate_tables(bind=None):
+    """
+    Adds the columns and indexes of the models that are missing from existing tables.
+    New columns must be nullable (or have a server default) as existing rows get NULL.
+
+    Args:
+        bind: engine to migrate, the app's engine by default.
+
+    Returns:
+        list[str]: the columns and indexes that were added, as "table.name".
+    """
+    bind = bind if bind is not None else engine
+    added = []
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                connection.exec_driver_sql(ddl)
+                added.append(f"{table.name}.{column.name}")
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=connection, checkfirst=True)
+                    added.append(f"{table.name}.{index.name}")
+    if added:
+        logger.info(f"Migrated existing tables, added {', '.join(added)}")
+    return added
\ No newline at end of file
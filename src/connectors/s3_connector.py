@@ -0,0 +1,79 @@
+"""
+This module manages the connection to S3 using boto3 and the variables needed to connect to it
+
+- Builds one application scoped S3 client (`get_s3_client`) with a tuned connection pool, retries and timeouts.
+  boto3 clients are thread safe, so the same client and its open TLS connections are shared by every request
+  rather than resolving credentials and building a new Session per request.
+- Provides ranged reads (`get_object_range`) so callers that only need the start of a file, like file
+  sniffing, fetch those bytes rather than the whole object.
+
+Set S3_ENDPOINT_URL to point the client at a local stand-in such as moto.
+"""
+
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from src.settings import (
+    S3_ENDPOINT_URL,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_CONNECT_TIMEOUT,
+    S3_READ_TIMEOUT,
+    S3_MAX_ATTEMPTS,
+    S3_RETRY_MODE,
+)
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+# Load in env vars
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_s3_client() -> "BaseClient":
+    """
+    Returns the application scoped S3 client, built on first use.
+
+    Returns:
+        BaseClient: boto3 S3 client shared across requests and threads.
+    """
+    # boto3 is imported with the first client rather than with the app
+    import boto3
+    from botocore.config import Config
+
+    session = boto3.Session(
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_DEFAULT_REGION"),
+    )
+    config = Config(
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+        tcp_keepalive=True,
+    )
+    return session.client("s3", endpoint_url=S3_ENDPOINT_URL, config=config)
+
+
+def get_object_range(s3_client: "BaseClient", bucket: str, s3_path: str, start: int, end: int) -> bytes:
+    """
+    Downloads bytes start..end (inclusive, like the HTTP Range header) of an object.
+    Fewer bytes come back when the object ends before end.
+
+    Raises:
+        FileNotFoundError: if the object does not exist.
+    """
+    try:
+        s3_object = s3_client.get_object(Bucket=bucket, Key=s3_path, Range=f"bytes={start}-{end}")
+    except s3_client.exceptions.NoSuchKey:
+        raise FileNotFoundError(f"File '{s3_path}' not found in S3")
+    except s3_client.exceptions.ClientError as e:
+        # an empty object has no byte 0, it reads as no bytes rather than an error
+        if e.response.get("Error", {}).get("Code") == "InvalidRange":
+            return b""
+        raise
+    return s3_object["Body"].read()
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -30,9 +32,91 @@ class File(Base):
     s3Path = Column(String, nullable=False)  # The path where the file is stored in S3
     customerId = Column(Integer, ForeignKey('customers.id'))  # Foreign key to link to the Customer table
     fileClassification = Column(String, nullable=True)  # This will store the classification result
+    contentHash = Column(String, nullable=True, index=True)  # sha256 of the file bytes, computed on upload
+    sizeBytes = Column(Integer, nullable=True)  # size of the file in bytes
+    modelVersion = Column(String, nullable=True, index=True)  # version (sha256) of the model that produced fileClassification
+    uploadedAt = Column(DateTime, nullable=True, default=lambda: datetime.now(timezone.utc))  # when the file was added
+
+    # the listing pages through a customer's files in id order (keyset pagination), filtered by class or upload
+    # time, and the bulk lookup matches many filenames of one customer. Each ends in id so a page is a range scan
+    __table_args__ = (
+        Index("ix_files_customer_id", "customerId", "id"),
+        Index("ix_files_customer_filename", "customerId", "filename"),
+        Index("ix_files_customer_class", "customerId", "fileClassification", "id"),
+        Index("ix_files_customer_uploaded", "customerId", "uploadedAt", "id"),
+    )
 
     # Relationship to the Customer model
     customer = relationship("Customer", back_populates="files")
 
     def __repr__(self):
         return f"<File(id={self.id}, filename={self.filename}, s3Path={self.s3Path}, fileClassification={self.fileClassification})>"
+
+
+# Classification cache table
+# content addressed store of extracted text and predicted class
+# keyed by the sha256 of the file bytes and the version (sha256) of the model that produced the class
+class ClassificationCacheEntry(Base):
+    __tablename__ = 'classification_cache'
+
+    contentHash = Column(String, primary_key=True)  # sha256 of the file bytes
+    modelVersion = Column(String, primary_key=True, index=True)  # sha256 of the model file
+    extractedText = Column(Text, nullable=False)  # text extracted from the file
+    fileClassification = Column(String, nullable=False)  # predicted class
+    createdAt = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<ClassificationCacheEntry(contentHash={self.contentHash}, modelVersion={self.modelVersion}, fileClassification={self.fileClassification})>"
+
+
+# Classification job table
+# one row per asynchronous classification request, workers update the status as the job moves through the queue
+# status is one of queued, running, retrying, succeeded, failed (not retryable) or dead (dead lettered after max attempts)
+class ClassificationJob(Base):
+    __tablename__ = 'classification_jobs'
+
+    id = Column(String, primary_key=True)  # uuid returned to the client
+    customerId = Column(Integer, nullable=False)
+    filename = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    fileClassification = Column(String, nullable=True)  # set once the job succeeded
+    error = Column(Text, nullable=True)  # last error seen by a worker
+    callbackUrl = Column(String, nullable=True)  # POSTed the job once it is finished
+    createdAt = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updatedAt = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<ClassificationJob(id={self.id}, status={self.status}, attempts={self.attempts})>"
+
+
+# Queue message table used by the sqlite job queue backend
+# mirrors an SQS queue: a message is invisible to other consumers until visibleAt, each receive hands out a new
+# receipt handle and bumps receiveCount, messages on the "<queue>-dlq" queue are dead letters
+class QueueMessage(Base):
+    __tablename__ = 'queue_messages'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    queueName = Column(String, nullable=False, index=True)
+    body = Column(Text, nullable=False)  # json message body
+    visibleAt = Column(Float, nullable=False, index=True)  # epoch seconds after which the message can be received
+    receiveCount = Column(Integer, nullable=False, default=0)
+    receiptHandle = Column(String, nullable=True)
+    createdAt = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<QueueMessage(id={self.id}, queueName={self.queueName}, receiveCount={self.receiveCount})>"
+
+
+# Classification lease table
+# a row is held by the worker classifying a file while it runs, so concurrent duplicates in other worker
+# processes wait for its result instead of classifying the same file again. Expired rows can be taken over.
+class ClassificationLease(Base):
+    __tablename__ = 'classification_leases'
+
+    key = Column(String, primary_key=True)  # "<customer id>/<filename>"
+    owner = Column(String, nullable=False)  # host, pid and call of the holder
+    expiresAt = Column(Float, nullable=False)  # epoch seconds, the holder renews the lease while it works
+
+    def __repr__(self):
+        return f"<ClassificationLease(key={self.key}, owner={self.owner}, expiresAt={self.expiresAt})>"
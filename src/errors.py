@@ -1,3 +1,52 @@
 class FileExtensionNotSupported(Exception):
     def __init__(self, msg, status_code=400):
         self.status_code = status_code
+
+# raised when the first bytes of a stored file do not match its extension (src/validation/file_type_validation.py)
+class FileContentMismatch(Exception):
+    def __init__(self, msg="File content does not match its extension", status_code=415):
+        self.msg = msg
+        self.status_code = status_code
+        super().__init__(msg)
+
+# raised when an upload's multipart/form-data body cannot be parsed or has no file (src/utils/streaming_upload.py)
+class MultipartUploadError(Exception):
+    def __init__(self, msg="Invalid multipart upload", status_code=400):
+        self.msg = msg
+        self.status_code = status_code
+        super().__init__(msg)
+
+class WriteBehindQueueFull(Exception):
+    def __init__(self, msg="Classification write queue is full", status_code=503):
+        self.msg = msg
+        self.status_code = status_code
+
+# raised when a file does not fit in the memory budget (src/utils/buffers.py), 503 when the budget is busy
+# and the client should retry, 413 when the file is larger than the whole budget
+class MemoryBudgetExceeded(Exception):
+    def __init__(self, msg="Memory budget exceeded, retry later", status_code=503):
+        self.msg = msg
+        self.status_code = status_code
+        super().__init__(msg)
+
+# raised by a job worker for failures that retrying cannot fix (e.g. the file is not in the db)
+class JobNotRetryable(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+        super().__init__(msg)
+
+# raised when a job's callback url is not allowed (src/validation/callback_url_validation.py), a ValueError so
+# pydantic turns it into a 422 when the url is validated in a request body
+class CallbackUrlNotAllowed(ValueError):
+    def __init__(self, msg="Callback url not allowed"):
+        self.msg = msg
+        super().__init__(msg)
+
+# raised by admission control (src/utils/admission.py) when a request is not admitted, retry_after is the
+# number of seconds the client should wait, sent as the Retry-After header of the 429
+class AdmissionRejected(Exception):
+    def __init__(self, msg="Too many requests, retry later", retry_after=1, status_code=429):
+        self.msg = msg
+        self.retry_after = retry_after
+        self.status_code = status_code
+        super().__init__(msg)
@@ -1,22 +1,40 @@
-from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, status
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session
-import shutil
-import boto3
 import os
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import json
 import logging
+import asyncio
 from dotenv import load_dotenv
 
-from src.scripts.populate_customers import populate_customers
-from src.scripts.populate_files import add_file, populate_files  # Ensure you import add_file
-from src.classifier import classify_file_ml
+from src.scripts.populate_files import add_file_record
+from src.scripts.seed import seed
+from src.errors import (
+    AdmissionRejected, FileContentMismatch, FileExtensionNotSupported, MemoryBudgetExceeded, MultipartUploadError, WriteBehindQueueFull,
+)
 from src.connectors.db_connector import SessionLocal, create_tables
+from src.connectors.s3_connector import get_s3_client as get_shared_s3_client
 from src.data_models.tables import File as FileModel
-from src.utils.utils import logging_decorator, download_file_return_bytes, update_file_classification, get_file_metadata
+from src.utils.utils import logging_decorator, get_file_metadata
 from src.validation.file_type_validation import allowed_file
-from src.validation.payload_models import ClassifyFileRequest, ClassifyFileResponse
-from src.utils.extract_text import extract_text_from_file
-from src.settings import UPLOAD_DIRECTORY
+from src.validation.payload_models import ClassifyFileRequest, ClassifyFileResponse, ClassifyBatchRequest, ClassifyBatchResponse, ClassifyJobRequest, FileLookupRequest
+from src.utils.admission import admission_controller
+from src.utils.batch_processing import classify_batch
+from src.utils.executors import run_io, run_cpu, start_executors, shutdown_executors
+from src.utils.classify_pipeline import classify_stored_file
+from src.utils.classification_cache import classification_cache
+from src.settings import OCR_WARM_ON_STARTUP, WRITE_BEHIND_ENABLED, JOB_WORKERS, SEED_ON_STARTUP, CPU_EXECUTOR, CPU_WORKERS
+from src.utils.tasks import warm_worker_task, worker_memory_task
+from src.utils.streaming_upload import MultipartFileReader, stream_upload_to_s3
+from src.utils.ocr_pool import get_ocr_pool
+from src.utils.write_behind import classification_writer
+from src.utils.job_queue import get_queue_backend
+from src.utils.jobs import JobWorkerPool, submit_job, get_job, job_to_dict
+from src.utils.file_listing import FileFilter, iter_files, lookup_files
+from src.utils.metrics import TimingMiddleware, file_type_of, registry as metrics_registry, span
 
 # Load in env vars
 load_dotenv()
@@ -26,20 +44,22 @@ BUCKET_NAME = os.getenv("BUCKET_NAME")
 
 app = FastAPI()
 
+# times every request: per route counters and latency histograms, and a Server-Timing header with the stage spans
+app.add_middleware(TimingMiddleware)
+
 # S3 dependency
+# returns the application scoped client, so requests share one connection pool instead of building a Session each time
 def get_s3_client():
-    # Fetch credentials and region from environment variables
-    aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-    aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-    aws_region = os.getenv("AWS_DEFAULT_REGION")
-
-    session = boto3.Session(
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region
-    )
-    s3_client = session.client('s3')
-    return s3_client
+    return get_shared_s3_client()
+
+# job queue dependency, the backend is picked by JOB_QUEUE_BACKEND
+def get_job_queue():
+    return get_queue_backend()
+
+# session factory dependency, for responses that keep reading from the db after the endpoint has returned
+# (streamed responses), the session from get_db is closed by then
+def get_session_factory():
+    return SessionLocal
 
 # fast api dependency to get the database session
 # will create a session when the api is hit, and then kill this session when the endpoint returns
@@ -53,56 +73,141 @@ def get_db():
     finally:
         db.close()
 
-# run this code when app is started/ IE when deployed to prepopulate DB/S3 with some data to use
+# run this code when app is started
+# startup is kept light so new replicas take traffic quickly: nothing is deleted and nothing is seeded
+# unless SEED_ON_STARTUP is set (seeding is idempotent, otherwise run python -m src.scripts.seed once)
 @app.on_event("startup")
 def startup():
 
-    # Only remove the existing DB file if it exists
-    db_file = 'test.db'
-    if os.path.exists(db_file):
-        os.remove(db_file)
+    create_tables()  # Ensure tables are created at app startup, existing tables get the columns and indexes they lack
+
+    if SEED_ON_STARTUP:
+        seed(SessionLocal, get_s3_client(), BUCKET_NAME)
+
+    # load the OCR networks now rather than on the first image request
+    if OCR_WARM_ON_STARTUP:
+        get_ocr_pool().warm()
+
+    start_executors()
+
+    if WRITE_BEHIND_ENABLED:
+        classification_writer.start()
+
+    # only does anything with METRICS_MULTIPROC_DIR set, periodically writes this worker's metrics for /metrics
+    metrics_registry.start()
+
+job_worker_pool = None
+model_ready = False
+_warm_up_task = None
+
+# load the model in the background (in every CPU worker) so the server answers /health straight away,
+# /ready only reports ready once this has finished
+async def warm_up_model():
+    global model_ready
+    try:
+        await asyncio.gather(*[run_cpu(warm_worker_task) for _ in range(max(1, CPU_WORKERS))])
+        model_ready = True
+        logger.info("Model loaded, ready for classification requests")
+        if CPU_EXECUTOR == "process":
+            await log_worker_memory()
+    except Exception as e:
+        logger.error(f"Error loading model: {e}")
 
-    create_tables()  # Ensure tables are created at app startup
-    
-    # populate customers, only customer 1 will eixst
-    with SessionLocal() as session:
-        populate_customers(session)
-    
-    # populate files
-    with SessionLocal() as session:
-        populate_files(session, get_s3_client())
+# memory of the CPU workers, uss is what each worker costs on top of the memory it shares with the others
+async def log_worker_memory():
+    workers = dict(await asyncio.gather(*[run_cpu(worker_memory_task) for _ in range(max(1, CPU_WORKERS))]))
+    for pid, memory in workers.items():
+        logger.info(f"CPU worker {pid} memory: {memory}")
 
+# start the model warm up and the asynchronous job workers, they run as tasks on the app's event loop
+@app.on_event("startup")
+async def start_background_tasks():
+    global job_worker_pool, _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up_model())
+    if JOB_WORKERS > 0:
+        job_worker_pool = JobWorkerPool(get_queue_backend(), SessionLocal, get_s3_client, BUCKET_NAME)
+        job_worker_pool.start()
+
+# stop the job workers, then the I/O and CPU pools (waits for in flight work to finish)
+# then flushes any classifications still queued for the db
+@app.on_event("shutdown")
+async def shutdown():
+    if job_worker_pool is not None:
+        await job_worker_pool.stop()
+    shutdown_executors()
+    classification_writer.stop()
+    metrics_registry.stop()
 
-# Ensure the upload directory exists
-os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-@app.post("/upload_file/", status_code=status.HTTP_201_CREATED)
-async def upload_file(customer_id: int, file: UploadFile = File(...), db: Session = Depends(get_db), s3_client = Depends(get_s3_client)):
+# multipart form upload of the "file" field, e.g. curl -F file=@invoice.pdf
+# the form is parsed as the body arrives rather than through UploadFile, which spools past 1MB to local disk,
+# so like /upload_file_stream/ the file never touches local disk. The schema is declared for the docs
+# as the body is not read by FastAPI
+@app.post("/upload_file/", status_code=status.HTTP_201_CREATED, openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    },
+})
+async def upload_file(customer_id: int, request: Request, db: Session = Depends(get_db), s3_client = Depends(get_s3_client)):
+
+    # Stream the upload straight into S3 (multipart for large files) rather than copying it to a local file first
+    # the sha256 of the content is computed in the same pass
+    try:
+        form = MultipartFileReader(request.headers.get("content-type", ""), request.stream())
+        filename = await form.read_filename()
+        s3_key = f"{customer_id}/{filename}"
+        result = await stream_upload_to_s3(form.iter_file(), s3_client, BUCKET_NAME, s3_key)
+    except MultipartUploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.msg)
 
-    file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
+    # add file record to database
+    new_file = await run_io(add_file_record, db, customer_id, filename, s3_key, result.content_hash, result.size)
 
-    # Save file temporarily to local directory and the upload to s3
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    return JSONResponse(
+        content={
+            "filename": new_file.filename,
+            "s3_path": new_file.s3Path,
+            "file_id": new_file.id,
+            "content_hash": new_file.contentHash,
+            "size_bytes": new_file.sizeBytes
+        },
+        status_code=200  # Explicitly setting the status code
+    )
 
+# upload the raw request body as a file, e.g. curl --data-binary @file
+# the body never touches local disk, it is piped chunk by chunk into an S3 multipart upload with memory bounded
+# to about two parts
+@app.post("/upload_file_stream/", status_code=status.HTTP_201_CREATED)
+async def upload_file_stream(customer_id: int, filename: str, request: Request, db: Session = Depends(get_db), s3_client = Depends(get_s3_client)):
 
-    #Upload file to S3 and add file record to database
     try:
-        new_file = add_file(db, customer_id, file.filename, file_path, BUCKET_NAME, s3_client)
-    finally:
-        os.remove(file_path)  # Cleanup temporary file after upload
+        allowed_file(filename)
+    except FileExtensionNotSupported:
+        raise HTTPException(status_code=400, detail="File type not supported")
+
+    s3_key = f"{customer_id}/{filename}"
+    result = await stream_upload_to_s3(request.stream(), s3_client, BUCKET_NAME, s3_key)
+
+    new_file = await run_io(add_file_record, db, customer_id, filename, s3_key, result.content_hash, result.size)
 
     return JSONResponse(
         content={
             "filename": new_file.filename,
             "s3_path": new_file.s3Path,
-            "file_id": new_file.id
+            "file_id": new_file.id,
+            "content_hash": new_file.contentHash,
+            "size_bytes": new_file.sizeBytes
         },
-        status_code=200  # Explicitly setting the status code
+        status_code=200
     )
 
 # endopint to obtain a classification for a file
@@ -119,40 +224,33 @@ async def classify_file(
     # Check if file extension is allowed
     allowed_file(request.filename)
 
-    file_metadata = get_file_metadata(db, request.customer_id, request.filename)
+    # db and s3 calls run on the I/O thread pool, extraction and inference on the CPU executor
+    # so a slow OCR job does not stall other requests on this worker
+    with span("metadata_lookup", file_type_of(request.filename)):
+        file_metadata = await run_io(get_file_metadata, db, request.customer_id, request.filename)
     # if no file found raise error
     if not file_metadata:
         raise HTTPException(status_code=404, detail= f"File {request.filename} not found for customer {request.customer_id}")
 
-    # Get the s3Path from the metadata
-    s3_path = file_metadata.s3Path
-
     # get file from S3
     # create file bytes object
     # then classify the file using
     # return json response with file_class for given filename and customer_id
     try:
-        # Fetch the file from S3 using the s3_path
-
-        file_bytes = download_file_return_bytes(s3_client, bucket = BUCKET_NAME, s3_path = s3_path)
-        try:
-            text = extract_text_from_file(file_bytes, request.filename)
-        except ValueError as e:
-            logger.error(f"Error processing: {e}")
-            raise HTTPException(status_code=500, detail="Error converting file to bytes")
-
-        file_class = classify_file_ml(text)
-        
-        # Write file classification to db for give  customer and file name
-        # normally just a push to a queue (distributed queue like sqs ideally rather) where a worker can read of queue and do this job
-        # in prod not ideal to just blindly write to the db as it will cause sync issues and load issues
-        update_file_classification(db, file_metadata, file_class)
+        # wait for room in the cheap or expensive lane, or get a 429 when the service is saturated
+        cost = admission_controller.estimate_cost(request.filename, file_metadata.sizeBytes)
+        async with admission_controller.admit(request.customer_id, [cost]):
+            outcome = await classify_stored_file(
+                db, s3_client, BUCKET_NAME, file_metadata, wait_for_persistence=request.wait_for_persistence
+            )
 
         # Construct the response body
         response_body = {   
-                "file_class": file_class,
+                "file_class": outcome.file_class,
                 "filename": request.filename,
-                "customer_id": request.customer_id
+                "customer_id": request.customer_id,
+                "pages_read": outcome.pages_read,
+                "tier": outcome.tier
         }
 
         logging.info(f"Classification Response: {response_body}")
@@ -160,10 +258,83 @@ async def classify_file(
         # Return classification result
         return response_body
 
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.msg, headers={"Retry-After": str(e.retry_after)})
+    except (WriteBehindQueueFull, MemoryBudgetExceeded) as e:
+        # the db writer is behind or the worker has no memory to spare for the file,
+        # ask the client to back off rather than queue without bound
+        logger.error(f"Error processing: {e.msg}")
+        raise HTTPException(status_code=e.status_code, detail=e.msg)
+    except FileContentMismatch as e:
+        # the stored file is not what its extension says, retrying will not help
+        logger.error(f"Error processing: {e.msg}")
+        raise HTTPException(status_code=e.status_code, detail=e.msg)
     except Exception as e:
         logger.error(f"Error processing: {e}")
         raise HTTPException(status_code=500, detail="Error processing")
 
+# endpoint to classify many files in one call
+# metadata is read with one query, files are downloaded/extracted in parallel and the model is called once for the batch
+# failures are reported per item rather than failing the whole batch
+@app.post("/classify_batch", response_model = ClassifyBatchResponse)
+@logging_decorator
+async def classify_files_batch(
+    request: ClassifyBatchRequest,
+    db: Session = Depends(get_db),
+    s3_client = Depends(get_s3_client)
+):
+
+    logging.info(f"classifying batch of {len(request.items)} files")
+
+    items = [(item.customer_id, item.filename) for item in request.items]
+    # the batch is admitted as one request costing the sum of its files (sizes are not known before the metadata
+    # is read), charged to the customer with the most files in it
+    costs = [admission_controller.estimate_cost(filename) for _, filename in items]
+    customer_ids = [customer_id for customer_id, _ in items]
+    try:
+        async with admission_controller.admit(max(customer_ids, key=customer_ids.count, default=None), costs):
+            results = await classify_batch(db, s3_client, BUCKET_NAME, items)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.msg, headers={"Retry-After": str(e.retry_after)})
+    except WriteBehindQueueFull as e:
+        raise HTTPException(status_code=e.status_code, detail=e.msg)
+
+    failed = sum(1 for result in results if result["error"])
+    logging.info(f"Batch classification finished, {len(results) - failed} classified and {failed} failed")
+
+    return {"results": results}
+
+# submit a file for asynchronous classification, returns the job id straight away
+# poll /classify_jobs/{job_id} or pass a callback_url to be POSTed the job once it has finished
+@app.post("/classify_jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_classify_job(
+    request: ClassifyJobRequest,
+    db: Session = Depends(get_db),
+    job_queue = Depends(get_job_queue)
+):
+
+    try:
+        allowed_file(request.filename)
+    except FileExtensionNotSupported:
+        raise HTTPException(status_code=400, detail="File type not supported")
+
+    callback_url = str(request.callback_url) if request.callback_url else None
+    job = await run_io(submit_job, db, job_queue, request.customer_id, request.filename, callback_url)
+    logging.info(f"Queued classification job {job.id} for customer {request.customer_id} and file {request.filename}")
+
+    return JSONResponse(
+        content={"job_id": job.id, "status": job.status, "status_url": f"/classify_jobs/{job.id}"},
+        status_code=status.HTTP_202_ACCEPTED
+    )
+
+# status of an asynchronous classification job, file_class is set once the status is succeeded
+@app.get("/classify_jobs/{job_id}")
+async def get_classify_job(job_id: str, db: Session = Depends(get_db)):
+    job = await run_io(get_job, db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_to_dict(job)
+
 # simple endpoint to use to view a file object in the db
 @app.get("/get_file")
 async def get_file_by_filename_and_customer(
@@ -172,9 +343,69 @@ async def get_file_by_filename_and_customer(
     db: Session = Depends(get_db)  # Dependency for the database session
 ):
 
-    file_metadata = get_file_metadata(db, customer_id, filename)
+    file_metadata = await run_io(get_file_metadata, db, customer_id, filename)
     # if no file found raise error
     if not file_metadata:
         raise HTTPException(status_code=404, detail= f"File {filename} not found for customer {customer_id}")
 
-    return file_metadata
\ No newline at end of file
+    return file_metadata
+
+# stream a customer's files as NDJSON, one JSON object per line in id order
+# filters: status (classified or unclassified), file_class and uploaded_after / uploaded_before (ISO 8601)
+# the listing is read a page at a time with keyset pagination, pass the id of the last line as after_id to resume it
+@app.get("/customers/{customer_id}/files")
+async def list_customer_files(
+    customer_id: int,
+    status: Optional[Literal["classified", "unclassified"]] = None,
+    file_class: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    after_id: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    session_factory = Depends(get_session_factory)
+):
+
+    file_filter = FileFilter(status=status, file_class=file_class, uploaded_after=uploaded_after, uploaded_before=uploaded_before)
+    # a sync generator, starlette iterates it on the thread pool so the db reads do not block the event loop
+    lines = (json.dumps(file) + "\n" for file in iter_files(session_factory, customer_id, file_filter, after_id, limit))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+# look up many of a customer's files in one call, filenames with no file are listed in "missing"
+@app.post("/customers/{customer_id}/files/lookup")
+async def lookup_customer_files(customer_id: int, request: FileLookupRequest, db: Session = Depends(get_db)):
+
+    found = await run_io(lookup_files, db, customer_id, request.filenames)
+    return {
+        "files": [found[filename] for filename in dict.fromkeys(request.filenames) if filename in found],
+        "missing": [filename for filename in dict.fromkeys(request.filenames) if filename not in found],
+    }
+
+# hit/miss counts for the content addressed classification cache
+@app.get("/cache_stats")
+async def cache_stats():
+    return classification_cache.stats()
+
+# capacity, cost in flight and queue of each admission lane of this worker
+@app.get("/admission_stats")
+async def admission_stats():
+    return admission_controller.stats()
+
+# request, stage, classification and cache metrics in the Prometheus text format
+# summed over every uvicorn worker when METRICS_MULTIPROC_DIR is set
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # reading the other workers' snapshots is file I/O, so it runs on the I/O pool
+    body = await run_io(metrics_registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+# liveness endpoint, does no blocking work so it stays responsive while classification runs on the executors
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+# readiness endpoint, 503 until the model is loaded so a load balancer only routes traffic to warm replicas
+@app.get("/ready")
+async def ready():
+    if not model_ready:
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready"}
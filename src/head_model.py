@@ -0,0 +1,106 @@
+"""
+Tier 0 of the classification cascade (src/utils/cascade.py): a naive Bayes model over the filename tokens
+and the first few hundred characters of the text layer.
+
+It is pure Python (a dict of per class token log probabilities) so scoring a document is a few hundred dict
+lookups, no numpy or sklearn and nothing extracted past the head of the file. Filename tokens are kept as
+separate features ("f:invoice") from body tokens so the model learns how much to trust each.
+
+Naive Bayes multiplies one likelihood per token and is badly over confident on long inputs, so the log
+likelihood is averaged per token and scaled by `temperature` before the softmax, which keeps confidences
+meaningful for the per class escalation thresholds.
+
+Artifact: a JSON file with classes, log priors, per class token log probabilities, the log probability of
+an unseen token per class and the temperature. Train one with python -m src.scripts.train_head_model.
+"""
+
+import json
+import math
+import re
+from functools import lru_cache
+from typing import Optional
+
+_TOKEN = re.compile(r"[a-z]{2,}")
+
+
+def filename_tokens(filename: str) -> list[str]:
+    """Word tokens of a filename without its extension, e.g. "Bank_Statement-2023.pdf" -> ["bank", "statement"]."""
+    stem = filename.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return _TOKEN.findall(stem.lower())
+
+def features(filename: str, head_text: str) -> list[str]:
+    return [f"f:{token}" for token in filename_tokens(filename)] + _TOKEN.findall(head_text.lower())
+
+
+class HeadClassifier:
+    def __init__(self, classes: list[str], log_priors: list[float], token_log_probs: dict[str, list[float]],
+                 unseen_log_probs: list[float], temperature: float = 1.0):
+        self.classes_ = classes
+        self.log_priors = log_priors
+        self.token_log_probs = token_log_probs
+        self.unseen_log_probs = unseen_log_probs
+        self.temperature = temperature
+
+    @classmethod
+    def fit(cls, documents: list[tuple[str, str]], labels: list[str], alpha: float = 1.0, temperature: float = 1.0) -> "HeadClassifier":
+        """Fit on (filename, head text) pairs, alpha is the Laplace smoothing added to every token count."""
+        classes = sorted(set(labels))
+        counts = {label: {} for label in classes}
+        totals = {label: 0 for label in classes}
+        for (filename, head_text), label in zip(documents, labels):
+            for token in features(filename, head_text):
+                counts[label][token] = counts[label].get(token, 0) + 1
+                totals[label] += 1
+
+        vocabulary = sorted({token for label_counts in counts.values() for token in label_counts})
+        denominators = [totals[label] + alpha * (len(vocabulary) + 1) for label in classes]
+        token_log_probs = {
+            token: [round(math.log((counts[label].get(token, 0) + alpha) / denominator), 5) for label, denominator in zip(classes, denominators)]
+            for token in vocabulary
+        }
+        unseen_log_probs = [math.log(alpha / denominator) for denominator in denominators]
+        log_priors = [math.log(labels.count(label) / len(labels)) for label in classes]
+        return cls(classes, log_priors, token_log_probs, unseen_log_probs, temperature)
+
+    def predict_proba_one(self, filename: str, head_text: str) -> list[float]:
+        tokens = [token for token in features(filename, head_text) if token in self.token_log_probs]
+        scores = list(self.log_priors)
+        if tokens:
+            for idx in range(len(self.classes_)):
+                mean_log_prob = sum(self.token_log_probs[token][idx] for token in tokens) / len(tokens)
+                scores[idx] += self.temperature * (mean_log_prob - self.unseen_log_probs[idx])
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return [value / total for value in exps]
+
+    def classify(self, filename: str, head_text: str) -> tuple[str, float]:
+        """Most likely class and its probability."""
+        probabilities = self.predict_proba_one(filename, head_text)
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.classes_[best], probabilities[best]
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({
+                "classes": self.classes_,
+                "log_priors": self.log_priors,
+                "temperature": self.temperature,
+                "unseen_log_probs": self.unseen_log_probs,
+                "token_log_probs": self.token_log_probs,
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> "HeadClassifier":
+        with open(path) as f:
+            artifact = json.load(f)
+        return cls(artifact["classes"], artifact["log_priors"], artifact["token_log_probs"], artifact["unseen_log_probs"], artifact["temperature"])
+
+
+# the head model is optional, tier 0 is skipped when the artifact is missing
+@lru_cache(maxsize=1)
+def load_head_model(path: str) -> Optional[HeadClassifier]:
+    try:
+        return HeadClassifier.load(path)
+    except FileNotFoundError:
+        return None
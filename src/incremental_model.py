@@ -0,0 +1,122 @@
+"""
+Incrementally trained text classifier, served by load_model like the pickled pipeline.
+
+The notebook model (notebooks/model_develop.ipynb) is a CountVectorizer + RandomForest fitted in one go: the
+vocabulary and the training matrix grow with the corpus and a new class means a full retrain. This model is
+trained a mini batch at a time with src/scripts/train_incremental_model.py:
+
+- features are word 1-3 grams hashed into n_features columns (HashingVectorizer), there is no vocabulary to
+  fit or keep so the memory of the model and of a batch does not depend on the size of the corpus
+- one binary logistic regression per class (SGDClassifier(loss="log_loss"), one vs rest) updated with
+  partial_fit. A class first seen in a later batch gets a new learner, the existing ones are left as they are
+- predict_proba is the sigmoid of every learner's score normalised over the classes, the same as sklearn's
+  one vs rest, so the pipeline's predict / predict_proba / classes_ interface is kept
+
+A learner added for a new class has seen none of the earlier documents, so training also keeps a ReplayBuffer:
+a fixed size reservoir sample of hashed rows per class. A new learner is first fitted on the buffer, which
+gives it the earlier classes as negatives, and every batch is topped up with rows from it so a stream of only
+new documents does not make the model forget the old classes. The buffer is a training artifact, saved next
+to the model but not loaded to serve it.
+"""
+
+import random
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+DEFAULT_N_FEATURES = 2 ** 20
+
+
+class IncrementalTextClassifier:
+    def __init__(self, n_features: int = DEFAULT_N_FEATURES, ngram_range: tuple[int, int] = (1, 3), alpha: float = 1e-5, seed: int = 0):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.alpha = alpha
+        self.seed = seed
+        # stop words as the notebook's CountVectorizer, the texts are cleaned with clean_text before they get here
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=self.ngram_range, stop_words="english", alternate_sign=False, norm="l2",
+        )
+        self.classes_ = np.array([], dtype=object)
+        self.learners: dict[str, SGDClassifier] = {}
+        self.samples_seen: dict[str, int] = {}
+
+    def transform(self, texts: list[str]) -> sp.csr_matrix:
+        return self.vectorizer.transform(texts)
+
+    def add_class(self, label: str, replay: Optional["ReplayBuffer"] = None) -> None:
+        """Add a learner for a new class, fitted on the replay buffer first so it starts with the other classes as negatives."""
+        learner = SGDClassifier(loss="log_loss", alpha=self.alpha, random_state=self.seed)
+        if replay is not None and len(replay):
+            X, labels = replay.rows()
+            learner.partial_fit(X, (labels == label).astype(np.int8), classes=[0, 1])
+        self.learners[label] = learner
+        self.samples_seen[label] = 0
+        self.classes_ = np.array(list(self.learners), dtype=object)
+
+    def partial_fit_hashed(self, X: sp.csr_matrix, labels: np.ndarray, replay: Optional["ReplayBuffer"] = None) -> None:
+        """One pass of every learner over hashed rows, labels is an array of class names."""
+        for label in dict.fromkeys(labels.tolist()):
+            if label not in self.learners:
+                self.add_class(label, replay)
+            self.samples_seen[label] += int((labels == label).sum())
+        for label, learner in self.learners.items():
+            learner.partial_fit(X, (labels == label).astype(np.int8), classes=[0, 1])
+
+    def partial_fit(self, texts: list[str], labels: list[str]) -> "IncrementalTextClassifier":
+        self.partial_fit_hashed(self.transform(texts), np.array(labels, dtype=object))
+        return self
+
+    def decision_function(self, texts: list[str]) -> np.ndarray:
+        X = self.transform(texts)
+        return np.column_stack([self.learners[label].decision_function(X) for label in self.classes_])
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        probabilities = 1.0 / (1.0 + np.exp(-self.decision_function(texts)))
+        totals = probabilities.sum(axis=1, keepdims=True)
+        # every learner sure it is not its class, fall back to an even split rather than dividing by zero
+        return np.divide(probabilities, totals, out=np.full_like(probabilities, 1.0 / len(self.classes_)), where=totals > 0)
+
+    def predict(self, texts: list[str]) -> np.ndarray:
+        return self.classes_[self.predict_proba(texts).argmax(axis=1)]
+
+
+class ReplayBuffer:
+    """Reservoir sample of at most capacity hashed rows per class, every row seen so far is equally likely to be kept."""
+
+    def __init__(self, capacity: int = 1000, seed: int = 0):
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.samples: dict[str, list[sp.csr_matrix]] = {}
+        self.seen: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.samples.values())
+
+    def add(self, X: sp.csr_matrix, labels: np.ndarray) -> None:
+        for idx, label in enumerate(labels.tolist()):
+            rows = self.samples.setdefault(label, [])
+            seen = self.seen.get(label, 0)
+            self.seen[label] = seen + 1
+            if len(rows) < self.capacity:
+                rows.append(X[idx])
+            else:
+                slot = self.rng.randrange(seen + 1)
+                if slot < self.capacity:
+                    rows[slot] = X[idx]
+
+    def rows(self) -> tuple[sp.csr_matrix, np.ndarray]:
+        """Every row in the buffer and its label."""
+        labels = [label for label, rows in self.samples.items() for _ in rows]
+        return sp.vstack([row for rows in self.samples.values() for row in rows], format="csr"), np.array(labels, dtype=object)
+
+    def sample(self, count: int) -> tuple[Optional[sp.csr_matrix], np.ndarray]:
+        """count rows drawn at random from the buffer, (None, empty) when the buffer is empty."""
+        pool = [(label, row) for label, rows in self.samples.items() for row in rows]
+        if not pool or count <= 0:
+            return None, np.array([], dtype=object)
+        picked = self.rng.sample(pool, min(count, len(pool)))
+        return sp.vstack([row for _, row in picked], format="csr"), np.array([label for label, _ in picked], dtype=object)
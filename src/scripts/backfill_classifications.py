@@ -0,0 +1,333 @@
+"""
+(Re)classify File rows in bulk, e.g. when onboarding a customer or after shipping a new model.
+
+- rows are selected with keyset pagination (WHERE id > last_id ORDER BY id LIMIT n), so every page is an index
+  range scan however far into the table the run is
+- selection is unclassified rows (default), rows classified by another model version (--stale) or every row (--all),
+  optionally for a single customer
+- a page is served from the classification cache where possible, the rest is downloaded on a thread pool,
+  extracted and classified in chunks on a process pool (one batched predict_proba per chunk) and written back
+  with one bulk UPDATE, while the next page is already downloading
+- the last id written is checkpointed after every page so a killed run resumes where it stopped
+- --dry-run only counts the rows that would be processed
+
+Run from the root of the repo:
+    python -m src.scripts.backfill_classifications --customer-id 1 --workers 8 --checkpoint backfill.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from botocore.client import BaseClient
+from dotenv import load_dotenv
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from src.classifier import get_model_version
+from src.data_models.tables import File as FileModel
+from src.settings import CPU_EXECUTOR, CPU_WORKERS, IO_THREAD_WORKERS
+from src.utils.classification_cache import CachedClassification, classification_cache, hash_file_bytes
+from src.utils.executors import make_cpu_executor
+from src.utils.tasks import extract_and_classify_many_task
+from src.utils.utils import download_file_return_bytes
+
+logger = logging.getLogger(__name__)
+
+MODE_UNCLASSIFIED = "unclassified"
+MODE_STALE = "stale"
+MODE_ALL = "all"
+
+
+@dataclass
+class BackfillSelection:
+    mode: str = MODE_UNCLASSIFIED
+    customer_id: Optional[int] = None
+
+
+@dataclass
+class BackfillReport:
+    selection: dict
+    model_version: str
+    last_id: int = 0
+    processed: int = 0
+    classified: int = 0
+    cached: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    done: bool = False
+    failed_ids: list[int] = field(default_factory=list)
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+# next page of rows to backfill after last_id
+def select_page(db: Session, selection: BackfillSelection, model_version: str, last_id: int, limit: int) -> list:
+    query = (
+        select(FileModel.id, FileModel.filename, FileModel.s3Path, FileModel.contentHash)
+        .where(FileModel.id > last_id)
+        .order_by(FileModel.id)
+        .limit(limit)
+    )
+    if selection.mode == MODE_UNCLASSIFIED:
+        query = query.where(FileModel.fileClassification.is_(None))
+    elif selection.mode == MODE_STALE:
+        query = query.where(or_(FileModel.modelVersion.is_(None), FileModel.modelVersion != model_version))
+    if selection.customer_id is not None:
+        query = query.where(FileModel.customerId == selection.customer_id)
+    return db.execute(query).all()
+
+def load_checkpoint(path: Optional[str]) -> Optional[dict]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+# write to a temp file and rename so a kill mid write never leaves a corrupt checkpoint
+def save_checkpoint(path: Optional[str], report: BackfillReport) -> None:
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**asdict(report), "files_per_sec": report.files_per_sec}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class _PreparedPage:
+    """A page with its cache hits resolved and the downloads of the misses in flight."""
+
+    def __init__(self, rows: list, hits: dict, downloads: dict[int, Future]):
+        self.rows = rows
+        self.hits = hits  # file id -> (content hash, CachedClassification)
+        self.downloads = downloads  # file id -> future of the file bytes
+
+
+def run_backfill(
+    session_factory: Callable[[], Session],
+    s3_client: BaseClient,
+    bucket: str,
+    selection: BackfillSelection,
+    page_size: int = 500,
+    chunk_size: int = 16,
+    cpu_executor: Optional[Executor] = None,
+    workers: int = CPU_WORKERS,
+    io_workers: int = IO_THREAD_WORKERS,
+    checkpoint_path: Optional[str] = None,
+    restart: bool = False,
+    dry_run: bool = False,
+    limit: Optional[int] = None,
+) -> BackfillReport:
+    """
+    Backfills the classification of the selected File rows.
+
+    Args:
+        session_factory (Callable[[], Session]): creates db sessions.
+        s3_client (BaseClient): Boto3 S3 client used to download the files.
+        bucket (str): S3 bucket the files are stored in.
+        selection (BackfillSelection): which rows to (re)classify.
+        page_size (int): rows read, downloaded and written per page.
+        chunk_size (int): files per task sent to the CPU executor, classified with one predict_proba.
+        cpu_executor (Executor): executor for extraction and inference, by default a CPU_EXECUTOR pool of workers.
+        workers (int): size of the default CPU executor.
+        io_workers (int): threads downloading from S3.
+        checkpoint_path (str): json file the progress is saved to and resumed from.
+        restart (bool): ignore an existing checkpoint and start from the first row.
+        dry_run (bool): only count the selected rows, nothing is downloaded or written.
+        limit (int): stop after this many rows.
+
+    Returns:
+        BackfillReport: counts, throughput and the last id processed.
+    """
+    model_version = get_model_version()
+    report = BackfillReport(selection=asdict(selection), model_version=model_version)
+
+    checkpoint = None if restart or dry_run else load_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        if checkpoint["selection"] != report.selection:
+            raise ValueError(f"Checkpoint {checkpoint_path} is for selection {checkpoint['selection']}, use --restart to start over")
+        report.last_id = checkpoint["last_id"]
+        report.processed, report.classified = checkpoint["processed"], checkpoint["classified"]
+        report.cached, report.failed = checkpoint["cached"], checkpoint["failed"]
+        report.failed_ids = checkpoint["failed_ids"]
+        logger.info(f"Resuming backfill after file id {report.last_id}, {report.processed} files already processed")
+
+    started = time.perf_counter()
+    elapsed_before = checkpoint["elapsed"] if checkpoint else 0.0
+    run_processed = 0
+
+    # next page of rows, shortened so a run never goes past limit rows
+    def next_rows(last_id: int, consumed: int) -> list:
+        page_limit = page_size if limit is None else min(page_size, limit - consumed)
+        if page_limit <= 0:
+            return []
+        with session_factory() as db:
+            return select_page(db, selection, model_version, last_id, page_limit)
+
+    if dry_run:
+        last_id = report.last_id
+        while rows := next_rows(last_id, run_processed):
+            run_processed += len(rows)
+            last_id = rows[-1].id
+        report.processed = run_processed
+        report.elapsed = time.perf_counter() - started
+        return report
+
+    own_executor = cpu_executor is None
+    cpu_executor = cpu_executor or make_cpu_executor(CPU_EXECUTOR, workers)
+    io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="backfill-io")
+
+    def prepare(rows: list) -> _PreparedPage:
+        # rows whose hash is known and cached for this model version need no download
+        hashes = {row.id: row.contentHash for row in rows if row.contentHash}
+        with session_factory() as db:
+            cached = classification_cache.get_many(db, list(hashes.values()), model_version)
+        hits = {file_id: (content_hash, cached[content_hash]) for file_id, content_hash in hashes.items() if content_hash in cached}
+        downloads = {
+            row.id: io_executor.submit(lambda s3_path: download_file_return_bytes(s3_client, bucket, s3_path).getvalue(), row.s3Path)
+            for row in rows if row.id not in hits
+        }
+        return _PreparedPage(rows, hits, downloads)
+
+    try:
+        rows = next_rows(report.last_id, 0)
+        page = prepare(rows) if rows else None
+        while page is not None:
+            results = dict(page.hits)  # file id -> (content hash, CachedClassification)
+            failed = []
+
+            # gather the downloads, identical content in a page is only extracted once
+            contents = {}
+            owners = {}
+            for row in page.rows:
+                if row.id in page.hits:
+                    continue
+                try:
+                    file_content = page.downloads[row.id].result()
+                except Exception as e:
+                    logger.error(f"Error downloading file {row.id} ({row.s3Path}): {e}")
+                    failed.append(row.id)
+                    continue
+                content_hash = hash_file_bytes(file_content)
+                owners.setdefault(content_hash, []).append(row.id)
+                contents.setdefault(content_hash, (file_content, row.filename))
+
+            with session_factory() as db:
+                cached = classification_cache.get_many(db, list(contents.keys()), model_version)
+            to_extract = [content_hash for content_hash in contents if content_hash not in cached]
+            chunks = [to_extract[start:start + chunk_size] for start in range(0, len(to_extract), chunk_size)]
+            chunk_futures = [
+                cpu_executor.submit(extract_and_classify_many_task, [contents[content_hash] for content_hash in chunk])
+                for chunk in chunks
+            ]
+
+            # start on the next page while this one is extracted and classified
+            next_page_rows = next_rows(page.rows[-1].id, run_processed + len(page.rows))
+            next_page = prepare(next_page_rows) if next_page_rows else None
+
+            new_entries = {}
+            for chunk, future in zip(chunks, chunk_futures):
+                for content_hash, (text, file_class, _, error) in zip(chunk, future.result()):
+                    if error:
+                        logger.error(f"Error classifying files {owners[content_hash]}: {error}")
+                        failed.extend(owners[content_hash])
+                        continue
+                    new_entries[content_hash] = CachedClassification(extracted_text=text, file_class=file_class)
+            for content_hash, entry in {**cached, **new_entries}.items():
+                for file_id in owners[content_hash]:
+                    results[file_id] = (content_hash, entry)
+
+            # one executemany UPDATE for the page, the hash is stored too so later requests can use the cache
+            params = [
+                {"id": file_id, "fileClassification": entry.file_class, "modelVersion": model_version, "contentHash": content_hash}
+                for file_id, (content_hash, entry) in results.items()
+            ]
+            with session_factory() as db:
+                classification_cache.put_many(db, model_version, new_entries)
+                if params:
+                    db.execute(update(FileModel), params)
+                db.commit()
+
+            cached_count = len(results) - sum(len(owners[content_hash]) for content_hash in new_entries)
+            run_processed += len(page.rows)
+            report.processed += len(page.rows)
+            report.classified += len(results)
+            report.cached += cached_count
+            report.failed += len(failed)
+            report.failed_ids.extend(failed)
+            report.last_id = page.rows[-1].id
+            report.elapsed = elapsed_before + time.perf_counter() - started
+            save_checkpoint(checkpoint_path, report)
+            logger.info(
+                f"Backfilled up to file id {report.last_id}: {report.processed} processed, {report.cached} from cache, "
+                f"{report.failed} failed, {run_processed / (time.perf_counter() - started):.1f} files/sec"
+            )
+            page = next_page
+
+        # a run cut short by --limit is not done, the next run carries on from the checkpoint
+        report.done = limit is None or run_processed < limit
+        report.elapsed = elapsed_before + time.perf_counter() - started
+        save_checkpoint(checkpoint_path, report)
+        return report
+    finally:
+        io_executor.shutdown(wait=True, cancel_futures=True)
+        if own_executor:
+            cpu_executor.shutdown(wait=True, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify File rows in bulk")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--stale", action="store_const", dest="mode", const=MODE_STALE, help="rows classified by another model version")
+    mode.add_argument("--all", action="store_const", dest="mode", const=MODE_ALL, help="every row")
+    parser.add_argument("--customer-id", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=CPU_WORKERS, help="processes extracting and classifying")
+    parser.add_argument("--io-workers", type=int, default=IO_THREAD_WORKERS, help="threads downloading from S3")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first row")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+
+    from src.connectors.db_connector import SessionLocal, create_tables
+    from src.connectors.s3_connector import get_s3_client
+
+    create_tables()
+    selection = BackfillSelection(mode=args.mode or MODE_UNCLASSIFIED, customer_id=args.customer_id)
+    report = run_backfill(
+        SessionLocal,
+        get_s3_client(),
+        os.getenv("BUCKET_NAME"),
+        selection,
+        page_size=args.page_size,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        io_workers=args.io_workers,
+        checkpoint_path=args.checkpoint,
+        restart=args.restart,
+        dry_run=args.dry_run,
+        limit=args.limit,
+    )
+
+    if args.dry_run:
+        print(f"Dry run: {report.processed} files would be classified ({selection.mode}, customer {selection.customer_id or 'all'})")
+    else:
+        print(
+            f"Backfill {'finished' if report.done else 'stopped'}: {report.processed} processed, {report.classified} classified, "
+            f"{report.cached} from cache, {report.failed} failed in {report.elapsed:.1f}s ({report.files_per_sec:.1f} files/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Compile the pickled CountVectorizer + RandomForest pipeline into the flat array format read by
+src/compiled_model.py.
+
+Only n-grams used by at least one tree split are kept, every other n-gram cannot change a prediction.
+The compiled model is checked against the pickle on a set of sample texts before anything is written.
+
+Run from the root of the repo:
+    python -m src.scripts.compile_model --model text_classifier_pipeline.pkl --out text_classifier_compiled
+and serve it with MODEL_PATH=text_classifier_compiled
+"""
+
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import CountVectorizer
+
+from src.compiled_model import ARRAY_NAMES, CompiledTextClassifier
+
+# texts used to check the compiled model agrees with the pickle
+PARITY_TEXTS = [
+    "invoice number 1234 date 15 december 2023 item design 50",
+    "account holder john doe 1 account number xxxxxxxxxxxx6781 statement period 202301 direct deposit",
+    "any state driver license license no p99999999 expires 000000 joe a sample",
+    "",
+]
+
+
+def _check_supported(vectorizer: CountVectorizer) -> None:
+    unsupported = {
+        "analyzer": vectorizer.analyzer != "word",
+        "binary": vectorizer.binary,
+        "preprocessor": vectorizer.preprocessor is not None,
+        "tokenizer": vectorizer.tokenizer is not None,
+        "strip_accents": vectorizer.strip_accents is not None,
+    }
+    bad = [name for name, is_set in unsupported.items() if is_set]
+    if bad:
+        raise ValueError(f"CountVectorizer settings not supported by the compiled runtime: {bad}")
+
+
+def compile_pipeline(pipeline) -> tuple[dict, dict]:
+    """
+    Flatten a fitted CountVectorizer + RandomForestClassifier pipeline into NumPy arrays.
+
+    Args:
+        pipeline: fitted sklearn pipeline with exactly a CountVectorizer and a RandomForestClassifier step.
+
+    Returns:
+        tuple[dict, dict]: the arrays keyed by name and the json metadata.
+    """
+    vectorizer, forest = pipeline[0], pipeline[-1]
+    if len(pipeline) != 2 or not isinstance(vectorizer, CountVectorizer) or not isinstance(forest, RandomForestClassifier):
+        raise ValueError("Only CountVectorizer + RandomForestClassifier pipelines can be compiled")
+    _check_supported(vectorizer)
+
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+
+    # keep only the features some split actually tests, re-indexed in sorted n-gram order
+    used = np.unique(np.concatenate([tree.feature[tree.children_left != -1] for tree in trees]))
+    feature_names = vectorizer.get_feature_names_out()[used]
+    order = np.argsort(feature_names)
+    vocabulary = feature_names[order].astype(str)
+    remap = np.zeros(len(vectorizer.vocabulary_), dtype=np.int32)
+    remap[used[order]] = np.arange(len(used), dtype=np.int32)
+
+    left, right, feature, threshold, value, roots = [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        node_ids = np.arange(tree.node_count, dtype=np.int32)
+        is_leaf = tree.children_left == -1
+        # leaves loop back to themselves so traversal can run a fixed number of steps
+        left.append(np.where(is_leaf, node_ids, tree.children_left).astype(np.int32) + offset)
+        right.append(np.where(is_leaf, node_ids, tree.children_right).astype(np.int32) + offset)
+        feature.append(np.where(is_leaf, 0, remap[np.maximum(tree.feature, 0)]).astype(np.int32))
+        threshold.append(tree.threshold.astype(np.float64))
+        # normalise each node the same way DecisionTreeClassifier.predict_proba does
+        node_value = tree.value[:, 0, :].astype(np.float64)
+        normalizer = node_value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value.append(node_value / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+
+    stop_words = vectorizer.get_stop_words() or frozenset()
+    arrays = {
+        "vocabulary": vocabulary,
+        "stop_words": np.array(sorted(stop_words), dtype=str),
+        "classes": np.asarray(forest.classes_),
+        "left": np.concatenate(left),
+        "right": np.concatenate(right),
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    meta = {
+        "format_version": 1,
+        "lowercase": vectorizer.lowercase,
+        "token_pattern": vectorizer.token_pattern,
+        "ngram_range": list(vectorizer.ngram_range),
+        "max_depth": int(max(tree.max_depth for tree in trees)),
+        "n_estimators": len(trees),
+        "n_nodes": int(offset),
+        "n_features": int(len(vocabulary)),
+    }
+    return arrays, meta
+
+
+def save_compiled(arrays: dict, meta: dict, out_dir: str) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name], allow_pickle=False)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def check_parity(pipeline, compiled: CompiledTextClassifier, texts: list[str]) -> None:
+    expected = pipeline.predict_proba(texts)
+    actual = compiled.predict_proba(texts)
+    if not np.array_equal(pipeline.predict(texts), compiled.predict(texts)) or not np.allclose(expected, actual):
+        raise ValueError("Compiled model does not match the pickled pipeline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the pickled pipeline into flat NumPy arrays")
+    parser.add_argument("--model", default="text_classifier_pipeline.pkl")
+    parser.add_argument("--out", default="text_classifier_compiled")
+    args = parser.parse_args()
+
+    with open(args.model, "rb") as f:
+        pipeline = pickle.load(f)
+
+    arrays, meta = compile_pipeline(pipeline)
+    check_parity(pipeline, CompiledTextClassifier(arrays, meta), PARITY_TEXTS)
+    save_compiled(arrays, meta, args.out)
+    print(f"Compiled {meta['n_estimators']} trees, {meta['n_nodes']} nodes and {meta['n_features']} features to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
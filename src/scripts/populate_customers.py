@@ -32,15 +32,20 @@ def get_customers(session: Session) -> list[Customer]:
     customers = session.query(Customer).all()
     return customers
 
-def populate_customers(session: Session) -> None:
+def populate_customers(session: Session, name: str = "John Doe") -> Customer:
     """
-    Populates the database with a sample customer.
+    Populates the database with a sample customer, the existing customer is returned if it is already there
+    so this can be run any number of times.
 
     Args:
         session (Session): The SQLAlchemy session to interact with the database.
+        name (str): name of the sample customer.
 
     Returns:
-        None
+        Customer: the sample customer.
     """
+    customer = session.query(Customer).filter(Customer.name == name).order_by(Customer.id).first()
+    if customer is not None:
+        return customer
     # Add a new customer
-    new_customer = add_customer("John Doe", session)
+    return add_customer(name, session)
@@ -1,10 +1,16 @@
-import botocore.client
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
 from src.data_models.tables import Customer, File
+from src.settings import SEED_WORKERS
 import os
-from botocore.client import BaseClient
+from typing import TYPE_CHECKING
 
-def upload_to_s3(file_path: str, bucket_name: str, s3_key: str, s3_client) -> str: 
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+def upload_to_s3(file_path: str, bucket_name: str, s3_key: str, s3_client, metadata: dict = None) -> str: 
     """
     Uploads a file to the given S3 bucket.
 
@@ -12,11 +18,12 @@ def upload_to_s3(file_path: str, bucket_name: str, s3_key: str, s3_client) -> st
     - file_path (str): file path to upload.
     - bucket_name (str): S3 bucket name.
     - s3_key (str): key/path of the file in s3.
+    - metadata (dict): user metadata stored with the object.
 
     Returns:
     - str: The S3 path of the uploaded file.
     """
-    s3_client.upload_file(file_path, bucket_name, s3_key)
+    s3_client.upload_file(file_path, bucket_name, s3_key, ExtraArgs={"Metadata": metadata} if metadata else None)
     return f"s3://{bucket_name}/{s3_key}"  # Return the S3 path
 
 
@@ -43,42 +50,128 @@ def add_file(session: Session, customer_id: int, filename: str, file_path: str,
     # if not customer:
     #     raise ValueError(f"Customer with ID {customer_id} not found.")
 
-    # Step 3: Create a new file record in the database
-    new_file = File(filename=filename, s3Path=s3_key, customerId=customer_id)
+    # Step 3: Create (or update) the file record in the database, with the sha256 of the content so
+    # classification can be served from the cache without downloading the file
+    return add_file_record(session, customer_id, filename, s3_key, hash_local_file(file_path), os.path.getsize(file_path))
+
+
+# sha256 of a local file, read in 1MB chunks
+def hash_local_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# sha256 stored in the metadata of an S3 object by a previous seed, None if the object does not exist
+def get_s3_object_hash(s3_client: "BaseClient", bucket_name: str, s3_key: str) -> str:
+    from botocore.exceptions import ClientError
+
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return head.get("Metadata", {}).get("sha256")
 
-    # Step 4: Add and commit the file record to the database
-    session.add(new_file)
+
+def add_file_record(session: Session, customer_id: int, filename: str, s3_key: str, content_hash: str = None, size_bytes: int = None) -> File:
+    """
+    Adds a file record to the database for a file that is already in S3.
+
+    The S3 key is per (customer, filename), so uploading a file under a name the customer already used replaced
+    the object. The existing row is then updated with the new hash, size and upload time and its classification
+    is cleared, rather than adding a second row that lookups by filename would never see.
+
+    Args:
+    - session (Session): The SQLAlchemy session to interact with the DB.
+    - customer_id (int): customer ID
+    - filename (str): name of file.
+    - s3_key (str): key/path of the file in s3.
+    - content_hash (str): sha256 of the file bytes.
+    - size_bytes (int): size of the file in bytes.
+
+    Returns:
+    - File: The created or updated File object.
+    """
+    file_record = session.query(File).filter(File.customerId == customer_id, File.filename == filename).order_by(File.id).first()
+    if file_record is None:
+        file_record = File(filename=filename, s3Path=s3_key, customerId=customer_id, contentHash=content_hash, sizeBytes=size_bytes)
+        session.add(file_record)
+    else:
+        # the bytes were replaced, so the old classification no longer applies
+        file_record.s3Path, file_record.contentHash, file_record.sizeBytes = s3_key, content_hash, size_bytes
+        file_record.uploadedAt = datetime.now(timezone.utc)
+        file_record.fileClassification, file_record.modelVersion = None, None
+
+    # commit the file record to the database
     session.commit()
-    session.refresh(new_file)
+    session.refresh(file_record)
 
-    return new_file
+    return file_record
 
 
-def populate_files(session: Session, s3_client: BaseClient) -> None:
+def populate_files(session: Session, s3_client: "BaseClient", bucket_name: str = None, files_dir: str = "files", customer_id: int = 1, workers: int = SEED_WORKERS) -> dict:
     """
-    Function run on start up
     Will take all files from files folder and create items in the FILE table in the db with respective meta information
     This will create a base set of information in the DB to get started with.
 
+    Idempotent, so it can be rerun safely: a file whose row already has the same sha256 is skipped and an S3
+    object that already holds the same bytes (sha256 in its metadata) is not uploaded again.
+    Files are hashed and uploaded in parallel on `workers` threads and the rows are written in one commit.
+
     Args:
         session (Session): SQLAlchemy session to interact with the database.
         s3_client (boto3.client): Boto3 S3 client to interact with AWS S3 for file operations.
-    
+        bucket_name (str): S3 bucket name, BUCKET_NAME from the env by default.
+        files_dir (str): local folder of files to seed.
+        customer_id (int): customer the files belong to.
+        workers (int): threads hashing and uploading files.
+
     Returns:
-        None
+        dict: counts of files uploaded, skipped (already seeded) and rows created or updated.
     """
-    
+    bucket_name = bucket_name or os.getenv("BUCKET_NAME", "heron-data-test-bucket")
+
     # Local folder files to populate db with
-    files_list = os.listdir('files')
-
-    # Default to customer id 1 for initial upload
-    customer_id = 1
-
-    # Define parameters
-    for f in files_list:
-        filename = f
-        file_path = "files/" + f
-        bucket_name = "heron-data-test-bucket"
-        
-        # Call the function to add the file
-        new_file = add_file(session, customer_id, filename, file_path, bucket_name, s3_client)
\ No newline at end of file
+    files_list = sorted(f for f in os.listdir(files_dir) if os.path.isfile(os.path.join(files_dir, f)))
+    existing = {
+        f.filename: f
+        for f in session.query(File).filter(File.customerId == customer_id, File.filename.in_(files_list)).all()
+    }
+
+    def sync_file(filename: str) -> tuple[str, str, int, bool]:
+        file_path = os.path.join(files_dir, filename)
+        content_hash = hash_local_file(file_path)
+        record = existing.get(filename)
+        if record is not None and record.contentHash == content_hash:
+            return filename, content_hash, os.path.getsize(file_path), False
+        # upload to folder based on customer_id
+        s3_key = f"{customer_id}/{filename}"
+        uploaded = False
+        if get_s3_object_hash(s3_client, bucket_name, s3_key) != content_hash:
+            upload_to_s3(file_path, bucket_name, s3_key, s3_client, metadata={"sha256": content_hash})
+            uploaded = True
+        return filename, content_hash, os.path.getsize(file_path), uploaded
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        synced = list(executor.map(sync_file, files_list))
+
+    counts = {"uploaded": 0, "skipped": 0, "records": 0}
+    for filename, content_hash, size_bytes, uploaded in synced:
+        counts["uploaded"] += uploaded
+        record = existing.get(filename)
+        if record is not None and record.contentHash == content_hash:
+            counts["skipped"] += 1
+            continue
+        if record is None:
+            session.add(File(filename=filename, s3Path=f"{customer_id}/{filename}", customerId=customer_id, contentHash=content_hash, sizeBytes=size_bytes))
+        else:
+            # the local file changed, so the old classification no longer applies
+            record.contentHash, record.sizeBytes = content_hash, size_bytes
+            record.fileClassification, record.modelVersion = None, None
+        counts["records"] += 1
+    session.commit()
+    return counts
@@ -0,0 +1,38 @@
+"""
+Delete classification cache rows written by any model version other than the one on disk.
+
+Processes only purge the table when they see the model change while running, so after a deploy with a new
+model the rows of the old version stay until this is run, once every worker serves the new model. Run from
+the root of the repo:
+    python -m src.scripts.purge_classification_cache
+"""
+
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from src.classifier import get_model_version
+from src.connectors.db_connector import SessionLocal, create_tables
+from src.settings import MODEL_PATH
+from src.utils.classification_cache import classification_cache
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete classification cache rows of other model versions")
+    parser.add_argument("--model-path", default=MODEL_PATH, help="model whose rows are kept")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    create_tables()
+    model_version = get_model_version(args.model_path)
+    with SessionLocal() as db:
+        deleted = classification_cache.purge_stale(db, model_version)
+    logger.info(f"Deleted {deleted} classification cache rows not written by model {model_version[:12]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Run classification job workers outside the API process.
+
+Uses the sqlite queue backend so the workers see the jobs the API puts in the app db, start the API with
+JOB_WORKERS=0 to leave all the jobs to these workers. Run from the root of the repo:
+    python -m src.scripts.run_job_workers --workers 8
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from src.connectors.db_connector import SessionLocal, create_tables
+from src.connectors.s3_connector import get_s3_client
+from src.settings import JOB_WORKERS
+from src.utils.executors import start_executors, shutdown_executors
+from src.utils.job_queue import SQLiteQueueBackend
+from src.utils.jobs import JobWorkerPool
+from src.utils.write_behind import classification_writer
+
+
+async def run(workers: int) -> None:
+    load_dotenv()
+    create_tables()
+    start_executors()
+    classification_writer.start()
+    pool = JobWorkerPool(SQLiteQueueBackend(SessionLocal), SessionLocal, get_s3_client, os.getenv("BUCKET_NAME"), workers=workers)
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        shutdown_executors()
+        classification_writer.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run classification job workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS or 4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run(args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Seed the db and S3 with the sample customer and the files in ./files.
+
+Seeding is an explicit step rather than something every replica does on boot. It is idempotent (files already
+seeded with the same content are skipped) and uploads in parallel. Run from the root of the repo:
+    python -m src.scripts.seed --workers 8
+--reset drops and recreates every table first, existing tables are otherwise migrated in place (create_tables).
+Set SEED_ON_STARTUP=true to run the same seed when the app starts (the default for local runs in .env).
+"""
+
+import argparse
+import logging
+import os
+import time
+from typing import Callable
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from src.settings import SEED_WORKERS
+from src.scripts.populate_customers import populate_customers
+from src.scripts.populate_files import populate_files
+
+logger = logging.getLogger(__name__)
+
+
+def seed(session_factory: Callable[[], Session], s3_client, bucket_name: str = None, files_dir: str = "files", workers: int = SEED_WORKERS) -> dict:
+    """
+    Creates the sample customer and seeds its files, safe to run any number of times.
+
+    Returns:
+        dict: counts of files uploaded, skipped and rows written, and the time taken.
+    """
+    started = time.perf_counter()
+    with session_factory() as session:
+        customer_id = populate_customers(session).id
+        counts = populate_files(session, s3_client, bucket_name, files_dir=files_dir, customer_id=customer_id, workers=workers)
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Seeded customer {customer_id}: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the db and S3 with the sample files")
+    parser.add_argument("--files-dir", default="files")
+    parser.add_argument("--workers", type=int, default=SEED_WORKERS)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate every table first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+
+    from src.connectors.db_connector import SessionLocal, create_tables, engine
+    from src.connectors.s3_connector import get_s3_client
+    from src.data_models.tables import Base
+
+    if args.reset:
+        Base.metadata.drop_all(bind=engine)
+    create_tables()
+    counts = seed(SessionLocal, get_s3_client(), os.getenv("BUCKET_NAME"), files_dir=args.files_dir, workers=args.workers)
+    print(f"Seeded: {counts['uploaded']} uploaded, {counts['skipped']} already seeded, {counts['records']} rows written in {counts['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
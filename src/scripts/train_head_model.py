@@ -0,0 +1,78 @@
+"""
+Train the tier 0 head model of the classification cascade (src/head_model.py).
+
+Documents come from a corpus written by src/benchmarks/corpus.py (--corpus, labels from its manifest.json)
+or are generated in memory. Real uploads are rarely named after their class, so filenames are rewritten:
+a share of them (--anonymise) become a neutral name like "scan_0042.pdf" and the rest get one of several
+spellings of their class ("inv_0042.pdf", "Statement-0042.pdf", "DL_0042.jpg"), which keeps the model from
+trusting the filename more than the text.
+
+Run from the root of the repo:
+    python -m src.scripts.train_head_model --count 900 --out head_model.json
+    python -m src.scripts.train_head_model --corpus bench_corpus --out head_model.json
+"""
+
+import argparse
+import json
+import os
+import random
+from io import BytesIO
+
+from src.benchmarks.corpus import FORMATS, generate_documents
+from src.head_model import HeadClassifier
+from src.settings import CASCADE_HEAD_CHARS
+from src.utils.extract_text import get_text_extractor
+
+FILENAME_WORDS = {
+    "bank_statement": ["bank_statement", "statement", "Statement", "bank-stmt", "eStatement", "account_statement"],
+    "invoice": ["invoice", "Invoice", "inv", "INV", "tax_invoice", "bill"],
+    "driver_license": ["drivers_license", "driver_licence", "DL", "license", "licence", "id_card"],
+}
+NEUTRAL_NAMES = ["scan", "document", "upload", "file", "IMG", "doc", "attachment"]
+
+
+def training_filename(rng: random.Random, label: str, extension: str, index: int, anonymise: float) -> str:
+    words = NEUTRAL_NAMES if rng.random() < anonymise else FILENAME_WORDS.get(label, [label])
+    return f"{rng.choice(words)}{rng.choice(['_', '-', ' '])}{index:04d}.{extension}"
+
+def _corpus_documents(corpus_dir: str):
+    with open(os.path.join(corpus_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    for document in manifest["documents"]:
+        with open(os.path.join(corpus_dir, document["filename"]), "rb") as f:
+            yield document["filename"], document["label"], f.read()
+
+def _generated_documents(count: int, formats: list[str], seed: int):
+    for document, content in generate_documents(count, formats, seed, max_pages=2):
+        yield document.filename, document.label, content
+
+def train(documents, head_chars: int = CASCADE_HEAD_CHARS, anonymise: float = 0.5, seed: int = 0) -> HeadClassifier:
+    rng = random.Random(seed)
+    examples, labels = [], []
+    for index, (filename, label, content) in enumerate(documents):
+        head = get_text_extractor(filename).extract_head(BytesIO(content), head_chars)
+        extension = filename.rsplit(".", 1)[-1]
+        examples.append((training_filename(rng, label, extension, index, anonymise), head))
+        labels.append(label)
+    return HeadClassifier.fit(examples, labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the tier 0 head model of the classification cascade")
+    parser.add_argument("--corpus", default=None, help="corpus directory with a manifest.json, generated in memory when not set")
+    parser.add_argument("--count", type=int, default=900, help="documents to generate when --corpus is not set")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--anonymise", type=float, default=0.5, help="share of training filenames replaced by a neutral name")
+    parser.add_argument("--head-chars", type=int, default=CASCADE_HEAD_CHARS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="head_model.json")
+    args = parser.parse_args()
+
+    documents = _corpus_documents(args.corpus) if args.corpus else _generated_documents(args.count, args.formats, args.seed)
+    model = train(documents, args.head_chars, args.anonymise, args.seed)
+    model.save(args.out)
+    print(f"Wrote head model with {len(model.token_log_probs)} tokens and classes {model.classes_} to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Train the incremental text classifier (src/incremental_model.py) out of core, a mini batch at a time.
+
+Labelled documents are streamed from one source, never held whole:
+- --corpus: a corpus written by src/benchmarks/corpus.py (labels from its manifest.json) or a directory with one
+  sub directory of files per class, e.g. new_industry/insurance_claim/*.pdf
+- --db: the classified rows of the files table (fileClassification is the label), read with keyset pagination
+  and downloaded from S3 a batch at a time
+- --synthetic: texts generated from the corpus templates, no files or extraction, for training at scale
+
+Files are downloaded on a thread pool and extracted on the CPU executor a batch at a time. Texts are cleaned
+with clean_text as they are at serving time, every --holdout-every th document is kept back (up to
+--holdout-max) to score the model at the end, and the rest is fitted in batches of --batch-size.
+
+--resume continues from an earlier artifact: its learners carry on from where they stopped and any class it
+has not seen gets a new learner, so a new industry is added by training on its documents only (plus the
+replay buffer) rather than retraining from scratch.
+
+Every run writes a new version to --out-dir: <name>_v<N>.pkl (the model, serve it with MODEL_PATH), <name>_v<N>.json
+(classes, documents per class, the parent version and the training report) and <name>_v<N>.replay.pkl (the
+replay buffer, only read by --resume). The report has the throughput and the peak resident memory of the run.
+
+Run from the root of the repo:
+    python -m src.scripts.train_incremental_model --synthetic 100000 --out-dir models
+    python -m src.scripts.train_incremental_model --corpus new_industry --resume models/text_classifier_incremental_v1.pkl
+    python -m src.scripts.train_incremental_model --db --customer-id 1 --resume models/text_classifier_incremental_v2.pkl
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import random
+import re
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.benchmarks.corpus import LABELS, TEMPLATES
+from src.classifier import clean_text, get_model_version
+from src.incremental_model import DEFAULT_N_FEATURES, IncrementalTextClassifier, ReplayBuffer
+from src.settings import CPU_EXECUTOR, CPU_WORKERS, IO_THREAD_WORKERS
+from src.utils.executors import make_cpu_executor
+from src.utils.tasks import extract_text_task
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAME = "text_classifier_incremental"
+
+# (label, filename, function returning the file bytes), the bytes are only read when the batch is extracted
+LabelledFile = tuple[str, str, Callable[[], bytes]]
+
+
+@dataclass
+class TrainingReport:
+    documents: int = 0
+    chars: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    fit_seconds: float = 0.0
+    class_counts: dict[str, int] = field(default_factory=dict)
+    new_classes: list[str] = field(default_factory=list)
+    holdout_documents: int = 0
+    holdout_accuracy: Optional[float] = None
+    peak_rss_mb: float = 0.0
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.documents / self.seconds if self.seconds else 0.0
+
+
+# VmHWM is the high water mark of this process's resident memory (Linux), 0 elsewhere
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # reset VmHWM to the current resident memory
+    except OSError:
+        pass
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def corpus_files(corpus_dir: str) -> Iterator[LabelledFile]:
+    """Files of a corpus directory, labelled by its manifest.json or by the sub directory they are in."""
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for document in manifest["documents"]:
+            path = os.path.join(corpus_dir, document["filename"])
+            yield document["label"], document["filename"], lambda path=path: _read_file(path)
+        return
+    for label in sorted(os.listdir(corpus_dir)):
+        label_dir = os.path.join(corpus_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for filename in sorted(os.listdir(label_dir)):
+            path = os.path.join(label_dir, filename)
+            yield label, filename, lambda path=path: _read_file(path)
+
+def db_files(session_factory, s3_client, bucket: str, customer_id: Optional[int] = None, page_size: int = 500) -> Iterator[LabelledFile]:
+    """Classified rows of the files table in id order, one page of rows in memory at a time."""
+    from sqlalchemy import select
+
+    from src.data_models.tables import File as FileModel
+    from src.utils.utils import download_file_return_bytes
+
+    last_id = 0
+    while True:
+        query = (
+            select(FileModel.id, FileModel.filename, FileModel.s3Path, FileModel.fileClassification)
+            .where(FileModel.id > last_id, FileModel.fileClassification.is_not(None))
+            .order_by(FileModel.id)
+            .limit(page_size)
+        )
+        if customer_id is not None:
+            query = query.where(FileModel.customerId == customer_id)
+        with session_factory() as db:
+            rows = db.execute(query).all()
+        for row in rows:
+            yield row.fileClassification, row.filename, lambda s3_path=row.s3Path: download_file_return_bytes(s3_client, bucket, s3_path).getvalue()
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+def extracted_documents(files: Iterable[LabelledFile], cpu_executor: Executor, io_workers: int = IO_THREAD_WORKERS, chunk_size: int = 64) -> Iterator[tuple[str, str]]:
+    """(label, text) per file, chunk_size files are read on a thread pool and extracted on the CPU executor at a time."""
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="train-io") as io_executor:
+        while chunk := [file for _, file in zip(range(chunk_size), files)]:
+            downloads = [io_executor.submit(read) for _, _, read in chunk]
+            extractions = []
+            for (label, filename, _), download in zip(chunk, downloads):
+                try:
+                    extractions.append((label, filename, cpu_executor.submit(extract_text_task, download.result(), filename)))
+                except Exception as e:
+                    logger.error(f"Error reading {filename}: {e}")
+            for label, filename, extraction in extractions:
+                try:
+                    yield label, extraction.result()
+                except Exception as e:
+                    logger.error(f"Error extracting the text of {filename}: {e}")
+
+def synthetic_documents(count: int, seed: int = 0, labels: list[str] = LABELS, max_pages: int = 3) -> Iterator[tuple[str, str]]:
+    """count (label, text) pairs from the corpus templates, labels rotate so the mix is even."""
+    rng = random.Random(seed)
+    for index in range(count):
+        label = labels[index % len(labels)]
+        yield label, TEMPLATES[label](rng, rng.randint(1, max_pages))
+
+
+def _fit_batch(model: IncrementalTextClassifier, replay: ReplayBuffer, texts: list[str], labels: list[str], replay_ratio: float) -> None:
+    X = model.transform(texts)
+    labels = np.array(labels, dtype=object)
+    # rows of earlier batches (and runs) go in with the new ones so the learners keep seeing every class
+    replay_X, replay_labels = replay.sample(int(len(texts) * replay_ratio))
+    if replay_X is not None:
+        model.partial_fit_hashed(sp.vstack([X, replay_X], format="csr"), np.concatenate([labels, replay_labels]), replay)
+    else:
+        model.partial_fit_hashed(X, labels, replay)
+    replay.add(X, labels)
+
+def train(
+    documents: Iterable[tuple[str, str]],
+    model: Optional[IncrementalTextClassifier] = None,
+    replay: Optional[ReplayBuffer] = None,
+    batch_size: int = 1000,
+    replay_ratio: float = 0.25,
+    holdout_every: int = 10,
+    holdout_max: int = 2000,
+) -> tuple[IncrementalTextClassifier, ReplayBuffer, TrainingReport]:
+    """
+    Fits the model on a stream of labelled texts, one batch in memory at a time.
+
+    Args:
+        documents (Iterable[tuple[str, str]]): (label, raw text) pairs.
+        model (IncrementalTextClassifier): model to carry on training, a new one when None.
+        replay (ReplayBuffer): replay buffer of the model, a new one when None.
+        batch_size (int): documents per partial_fit.
+        replay_ratio (float): rows from the replay buffer added to each batch, as a share of the batch.
+        holdout_every (int): keep every n th document back for scoring, 0 for none.
+        holdout_max (int): most documents kept back.
+
+    Returns:
+        tuple: the model, the replay buffer and the training report.
+    """
+    model = IncrementalTextClassifier() if model is None else model
+    replay = ReplayBuffer() if replay is None else replay
+    known_classes = set(model.classes_.tolist())
+    report = TrainingReport()
+    holdout_texts, holdout_labels = [], []
+    texts, labels = [], []
+
+    def fit() -> None:
+        start = time.perf_counter()
+        _fit_batch(model, replay, texts, labels, replay_ratio)
+        report.fit_seconds += time.perf_counter() - start
+        report.batches += 1
+        texts.clear()
+        labels.clear()
+
+    started = time.perf_counter()
+    for index, (label, text) in enumerate(documents):
+        text = clean_text(text)
+        report.documents += 1
+        report.chars += len(text)
+        report.class_counts[label] = report.class_counts.get(label, 0) + 1
+        if holdout_every and index % holdout_every == holdout_every - 1 and len(holdout_texts) < holdout_max:
+            holdout_texts.append(text)
+            holdout_labels.append(label)
+            continue
+        texts.append(text)
+        labels.append(label)
+        if len(texts) >= batch_size:
+            fit()
+    if texts:
+        fit()
+    report.seconds = time.perf_counter() - started
+
+    report.new_classes = [label for label in model.classes_.tolist() if label not in known_classes]
+    if holdout_texts:
+        report.holdout_documents = len(holdout_texts)
+        report.holdout_accuracy = round(float(np.mean(model.predict(holdout_texts) == np.array(holdout_labels, dtype=object))), 4)
+    report.peak_rss_mb = round(peak_rss_mb(), 1)
+    return model, replay, report
+
+
+def _artifact_base(model_path: str) -> str:
+    return model_path[:-len(".pkl")] if model_path.endswith(".pkl") else model_path
+
+def next_version(out_dir: str, name: str = DEFAULT_NAME) -> int:
+    pattern = re.compile(rf"{re.escape(name)}_v(\d+)\.pkl$")
+    versions = [int(match.group(1)) for filename in os.listdir(out_dir) if (match := pattern.match(filename))] if os.path.isdir(out_dir) else []
+    return max(versions, default=0) + 1
+
+# write to a temp file and rename so a server reading MODEL_PATH never sees half a file
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def write_artifact(
+    model: IncrementalTextClassifier,
+    replay: ReplayBuffer,
+    report: TrainingReport,
+    out_dir: str,
+    name: str = DEFAULT_NAME,
+    parent: Optional[dict] = None,
+) -> str:
+    """Writes the next version of the model, its replay buffer and metadata to out_dir, returns the model path."""
+    os.makedirs(out_dir, exist_ok=True)
+    version = next_version(out_dir, name)
+    model_path = os.path.join(out_dir, f"{name}_v{version}.pkl")
+    base = _artifact_base(model_path)
+    _write_atomic(f"{base}.replay.pkl", pickle.dumps(replay, protocol=pickle.HIGHEST_PROTOCOL))
+    _write_atomic(model_path, pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+    documents = dict((parent or {}).get("documents", {}))
+    for label, count in report.class_counts.items():
+        documents[label] = documents.get(label, 0) + count
+    metadata = {
+        "version": version,
+        "model_version": get_model_version(model_path),
+        "parent": {"version": parent["version"], "model_version": parent["model_version"]} if parent else None,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "classes": model.classes_.tolist(),
+        "documents": documents,
+        "n_features": model.n_features,
+        "ngram_range": list(model.ngram_range),
+        "alpha": model.alpha,
+        "training": {**asdict(report), "docs_per_sec": round(report.docs_per_sec, 1)},
+    }
+    _write_atomic(f"{base}.json", json.dumps(metadata, indent=2).encode())
+    return model_path
+
+def load_artifact(model_path: str) -> tuple[IncrementalTextClassifier, ReplayBuffer, Optional[dict]]:
+    """The model of an artifact with its replay buffer (empty if it was not kept) and metadata (None if missing)."""
+    base = _artifact_base(model_path)
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    if not isinstance(model, IncrementalTextClassifier):
+        raise ValueError(f"{model_path} is not an incremental model, train one without --resume first")
+    replay = ReplayBuffer(seed=model.seed)
+    if os.path.exists(f"{base}.replay.pkl"):
+        with open(f"{base}.replay.pkl", "rb") as f:
+            replay = pickle.load(f)
+    else:
+        logger.warning(f"No replay buffer next to {model_path}, new classes start without negatives from the earlier ones")
+    metadata = None
+    if os.path.exists(f"{base}.json"):
+        with open(f"{base}.json") as f:
+            metadata = json.load(f)
+    return model, replay, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the incremental text classifier out of core")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--corpus", default=None, help="corpus directory, a manifest.json or one sub directory per class")
+    source.add_argument("--db", action="store_true", help="the classified rows of the files table, downloaded from S3")
+    source.add_argument("--synthetic", type=int, default=None, help="documents to generate from the corpus templates")
+    parser.add_argument("--customer-id", type=int, default=None, help="only this customer's files with --db")
+    parser.add_argument("--resume", default=None, help="model artifact (.pkl) to carry on training")
+    parser.add_argument("--out-dir", default="models")
+    parser.add_argument("--name", default=DEFAULT_NAME)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--n-features", type=int, default=DEFAULT_N_FEATURES, help="hashed feature columns, fixes the model size")
+    parser.add_argument("--alpha", type=float, default=1e-5, help="regularisation of the learners")
+    parser.add_argument("--replay-size", type=int, default=1000, help="rows kept per class in the replay buffer")
+    parser.add_argument("--replay-ratio", type=float, default=0.25)
+    parser.add_argument("--holdout-every", type=int, default=10)
+    parser.add_argument("--holdout-max", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=CPU_WORKERS, help="processes extracting text from files")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.resume:
+        model, replay, parent = load_artifact(args.resume)
+    else:
+        model = IncrementalTextClassifier(n_features=args.n_features, alpha=args.alpha, seed=args.seed)
+        replay, parent = ReplayBuffer(args.replay_size, args.seed), None
+
+    cpu_executor = None
+    if args.synthetic is not None:
+        documents = synthetic_documents(args.synthetic, args.seed)
+    else:
+        if args.db:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            from src.connectors.db_connector import SessionLocal
+            from src.connectors.s3_connector import get_s3_client
+
+            files = db_files(SessionLocal, get_s3_client(), os.getenv("BUCKET_NAME"), args.customer_id)
+        else:
+            files = corpus_files(args.corpus)
+        cpu_executor = make_cpu_executor(CPU_EXECUTOR, args.workers)
+        documents = extracted_documents(files, cpu_executor)
+
+    reset_peak_rss()
+    try:
+        model, replay, report = train(documents, model, replay, args.batch_size, args.replay_ratio, args.holdout_every, args.holdout_max)
+    finally:
+        if cpu_executor is not None:
+            cpu_executor.shutdown(wait=True, cancel_futures=True)
+
+    model_path = write_artifact(model, replay, report, args.out_dir, args.name, parent)
+    print(json.dumps({**asdict(report), "docs_per_sec": round(report.docs_per_sec, 1), "model_mb": round(os.path.getsize(model_path) / 2 ** 20, 1)}, indent=2))
+    print(f"Wrote {model_path} with classes {model.classes_.tolist()}, serve it with MODEL_PATH={model_path}")
+
+
+if __name__ == "__main__":
+    main()
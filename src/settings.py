@@ -1,3 +1,232 @@
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# Load in env vars so settings can be overridden per deployment
+load_dotenv()
+
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'txt', 'docx'}
-# Define the upload directory
-UPLOAD_DIRECTORY = "./uploads"
\ No newline at end of file
+# first bytes of a stored file fetched with a ranged GET and checked against its extension before the whole
+# file is downloaded, so a mislabelled file is rejected without downloading it. 0 turns the check off
+FILE_SNIFF_BYTES = int(os.getenv("FILE_SNIFF_BYTES", 1024))
+
+# path to the pickled sklearn pipeline served by the app
+MODEL_PATH = os.getenv("MODEL_PATH", "text_classifier_pipeline.pkl")
+
+# Batch classification
+# max number of (customer_id, filename) pairs accepted by /classify_batch in one call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 100))
+
+# File listing and lookup
+# rows fetched per query while streaming a customer's files, the listing holds one page in memory at a time
+FILE_LIST_PAGE_SIZE = int(os.getenv("FILE_LIST_PAGE_SIZE", 1000))
+# max filenames accepted by the bulk lookup in one call
+FILE_LOOKUP_MAX_FILENAMES = int(os.getenv("FILE_LOOKUP_MAX_FILENAMES", 10000))
+
+# cores this process may run on, the default for the settings sized by the machine
+AVAILABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# OCR
+# number of EasyOCR readers kept alive in the process, each reader holds its own copy of the networks
+# readers are built on first use, so the pool only grows to the number of images OCR'd at the same time
+# defaults to PDF_OCR_WORKERS so every page of a parallel run of scanned pages gets its own reader
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", os.getenv("PDF_OCR_WORKERS", AVAILABLE_CORES)))
+# build the readers when the app starts rather than on the first image
+OCR_WARM_ON_STARTUP = os.getenv("OCR_WARM_ON_STARTUP", "false").lower() == "true"
+# images are downscaled so their longest side is at most this many pixels before OCR
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", 1600))
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "en").split(",")
+OCR_USE_GPU = os.getenv("OCR_USE_GPU", "false").lower() == "true"
+
+# Execution
+# threads used for blocking I/O (S3 and DB calls) so they do not stall the event loop
+IO_THREAD_WORKERS = int(os.getenv("IO_THREAD_WORKERS", 16))
+# where CPU bound extraction and classification run
+# process: a ProcessPoolExecutor so one uvicorn process can use every core (default)
+# thread: a thread pool, useful when processes are not available
+# inline: run on the event loop, only for debugging
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "process").lower()
+# uvicorn worker processes on the host, uvicorn reads the same variable for its --workers default
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+# every uvicorn worker starts its own pool, so by default the cores are split between them (at least one each)
+# rather than every worker starting one process per core with its own copy of the models
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+# forkserver (default where available): workers are forked from a single threaded server process, which is safe
+# unlike forking the app itself (it already runs threads) and lets the workers share preloaded models
+# spawn starts every worker from scratch, each with its own copy of the models
+CPU_MP_START_METHOD = os.getenv("CPU_MP_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+# load the models (and the OCR readers with OCR_WARM_ON_STARTUP) once before the CPU workers are forked so they share
+# the weights copy on write instead of holding a copy each, needs CPU_MP_START_METHOD=forkserver
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+# memory map compiled models (src/scripts/compile_model.py) read only, every process on the node shares one copy
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+
+# Classification cache
+# results are cached by sha256 of the file bytes plus the model version
+CLASSIFICATION_CACHE_ENABLED = os.getenv("CLASSIFICATION_CACHE_ENABLED", "true").lower() == "true"
+# in memory tier limits, entries are evicted least recently used first once either limit is hit
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", 10000))
+CLASSIFICATION_CACHE_MAX_BYTES = int(os.getenv("CLASSIFICATION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CLASSIFICATION_CACHE_TTL_SECONDS = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", 3600))
+# also keep entries in the classification_cache table so they survive restarts and are shared across workers
+CLASSIFICATION_CACHE_PERSISTENT = os.getenv("CLASSIFICATION_CACHE_PERSISTENT", "true").lower() == "true"
+
+# PDF extraction
+# stop reading a PDF after this many pages / characters, 0 means no limit
+PDF_PAGE_BUDGET = int(os.getenv("PDF_PAGE_BUDGET", 20))
+PDF_CHAR_BUDGET = int(os.getenv("PDF_CHAR_BUDGET", 100000))
+# pages whose text layer has fewer characters than this are treated as scans and their page images are OCR'd
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", 10))
+# OCR the pages of a PDF that have no text layer, false turns the OCR fallback off
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "true").lower() == "true"
+# max pages OCR'd per PDF, 0 means no limit
+PDF_OCR_PAGE_CAP = int(os.getenv("PDF_OCR_PAGE_CAP", 10))
+# scanned pages OCR'd at the same time, one per available core by default. Each needs its own reader, the
+# reader pool (OCR_POOL_SIZE) is the same size unless it is set separately
+PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", AVAILABLE_CORES))
+# classify after pages 1, 2, 4, 8 ... and stop reading once the model is at least this confident, 0 disables early exit
+EARLY_EXIT_CONFIDENCE = float(os.getenv("EARLY_EXIT_CONFIDENCE", 0.8))
+
+# DOCX extraction
+# "stream" parses the document, header and footer XML straight from the zip (tables included), "python-docx" is
+# the previous engine which loads the whole document and only reads the body paragraphs
+DOCX_ENGINE = os.getenv("DOCX_ENGINE", "stream")
+# stop reading a DOCX after this many characters, 0 means no limit
+DOCX_CHAR_BUDGET = int(os.getenv("DOCX_CHAR_BUDGET", PDF_CHAR_BUDGET))
+# stop decoding a TXT after this many characters, 0 means no limit
+TXT_CHAR_BUDGET = int(os.getenv("TXT_CHAR_BUDGET", PDF_CHAR_BUDGET))
+
+# Memory budgets for downloaded files (see src/utils/buffers.py)
+# file content one request keeps in memory, files past it are spooled to a temp file and memory mapped by the reader
+REQUEST_MEMORY_BUDGET_BYTES = int(os.getenv("REQUEST_MEMORY_BUDGET_BYTES", 32 * 1024 * 1024))
+# bytes of in flight files (in memory or spooled) across every request of a process, a file waits up to
+# MEMORY_BUDGET_WAIT_SECONDS for room and is then rejected with a 503, a file larger than the budget gets a 413
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", 512 * 1024 * 1024))
+MEMORY_BUDGET_WAIT_SECONDS = float(os.getenv("MEMORY_BUDGET_WAIT_SECONDS", 10))
+# directory for spooled files, the system temp directory when unset
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None
+# size of the reads from S3 when spooling
+SPOOL_CHUNK_BYTES = int(os.getenv("SPOOL_CHUNK_BYTES", 1024 * 1024))
+
+# Classification cascade
+# classify with the cheapest tier first and only escalate while the confidence is below the class's threshold:
+# tier 0 head model on the filename and the head of the text, tier 1 the main model on the text layer, tier 2 OCR
+# opt in: the shipped head_model.json is trained on synthetic documents, turn the cascade on once a head model
+# trained on real documents is in place
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+# tier 0 model (see src/head_model.py), tier 0 is skipped when the file does not exist
+HEAD_MODEL_PATH = os.getenv("HEAD_MODEL_PATH", "head_model.json")
+# characters of the text layer read by tier 0
+CASCADE_HEAD_CHARS = int(os.getenv("CASCADE_HEAD_CHARS", 1000))
+# confidence a tier needs to decide, per predicted class, e.g. "bank_statement=0.8,invoice=0.9"
+# classes not listed use CASCADE_DEFAULT_THRESHOLD, tune them with python -m src.benchmarks.cascade_evaluation
+CASCADE_THRESHOLDS = os.getenv("CASCADE_THRESHOLDS", "")
+CASCADE_DEFAULT_THRESHOLD = float(os.getenv("CASCADE_DEFAULT_THRESHOLD", 0.9))
+
+# Micro batching of model inference (see src/utils/inference_scheduler.py), used by /classify_file and the jobs
+# for the main model, with the cascade off and for the cascade's tier 1: texts of concurrent requests are
+# collected for up to INFERENCE_BATCH_WINDOW_MS, or until INFERENCE_BATCH_MAX_SIZE are waiting, and classified
+# with one predict_proba. false classifies page by page with early exit inside the CPU worker instead
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() == "true"
+# the most a text waits for others to join its batch, the latency batching adds
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", 5))
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", 32))
+
+# S3
+# set to point the app at a local S3 stand-in (moto, minio, localstack), unset for AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# size of the shared client's HTTP connection pool, should be at least IO_THREAD_WORKERS
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 5))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 30))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")
+# uploads are streamed to S3 in parts of this size, S3 needs at least 5MB for every part but the last
+S3_MULTIPART_PART_SIZE = max(int(os.getenv("S3_MULTIPART_PART_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+# number of parts uploaded at the same time by a streaming upload
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", 4))
+
+# Write behind persistence of classification results
+# results are queued and written to the db in bulk by a background flusher instead of a commit per file
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+# flush when this many results are queued or the oldest queued result is this old
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.5))
+# max results waiting to be written, callers block (backpressure) when the queue is full
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10000))
+# how long a caller waits for space in a full queue before the request fails
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", 5))
+
+# Coalescing of concurrent duplicate classifications (see src/utils/single_flight.py)
+# concurrent /classify_file calls and jobs for the same customer and filename share one classification
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# also coalesce across worker processes through a lease table in the app db, the holder classifies and
+# the others wait for it to finish, then read the result from the classification cache
+SINGLE_FLIGHT_LEASES = os.getenv("SINGLE_FLIGHT_LEASES", "false").lower() == "true"
+# seconds a lease is held without being renewed, the holder renews it every third of this while it works
+SINGLE_FLIGHT_LEASE_TTL = float(os.getenv("SINGLE_FLIGHT_LEASE_TTL", 30))
+# how often a waiting worker checks whether the lease was released
+SINGLE_FLIGHT_LEASE_POLL_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_POLL_SECONDS", 0.2))
+# a worker waits this long for another worker's lease, then classifies the file itself
+SINGLE_FLIGHT_LEASE_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_WAIT_SECONDS", 120))
+
+# Admission control of /classify_file and /classify_batch (see src/utils/admission.py)
+# every request gets an estimated cost and waits in the cheap or the expensive lane for room, a full queue or a
+# wait past ADMISSION_WAIT_SECONDS gets a 429 with Retry-After instead of an ever longer response time
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# estimated cost per file type in units of a small TXT, e.g. "txt=1,docx=2,pdf=5,jpg=100" (OCR costs about 100x a TXT)
+ADMISSION_COSTS = os.getenv("ADMISSION_COSTS", "txt=1,docx=2,pdf=5,jpg=100")
+# the cost of a file is multiplied by its size in these units when it is larger than one
+ADMISSION_COST_SIZE_UNIT_BYTES = int(os.getenv("ADMISSION_COST_SIZE_UNIT_BYTES", 1024 * 1024))
+# requests costing at least this go in the expensive lane so OCR never queues in front of cheap files
+ADMISSION_EXPENSIVE_COST = float(os.getenv("ADMISSION_EXPENSIVE_COST", 20))
+# cost in flight per lane, by default 64 TXTs at once and one image per CPU worker
+ADMISSION_CHEAP_CAPACITY = float(os.getenv("ADMISSION_CHEAP_CAPACITY", 64))
+ADMISSION_EXPENSIVE_CAPACITY = float(os.getenv("ADMISSION_EXPENSIVE_CAPACITY", 100 * CPU_WORKERS))
+# requests waiting per lane, and per customer in a lane so one customer's bulk upload cannot fill the queue
+ADMISSION_CHEAP_QUEUE = int(os.getenv("ADMISSION_CHEAP_QUEUE", 256))
+ADMISSION_EXPENSIVE_QUEUE = int(os.getenv("ADMISSION_EXPENSIVE_QUEUE", 32))
+ADMISSION_CUSTOMER_QUEUE = int(os.getenv("ADMISSION_CUSTOMER_QUEUE", 16))
+# longest a request waits for admission before it is rejected
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", 5))
+# upper bound of the Retry-After header on a 429
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", 60))
+
+# Asynchronous classification jobs
+# queue backend, "sqlite" (queue table in the app db, shared by every process using that db) or "memory" (in process only)
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite").lower()
+JOB_QUEUE_NAME = os.getenv("JOB_QUEUE_NAME", "classification-jobs")
+# number of job workers started with the app, 0 leaves the jobs to python -m src.scripts.run_job_workers
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# seconds a received job is hidden from other workers, it is retried if not finished by then (e.g. worker crashed)
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+# a job is dead lettered after this many attempts
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# delay before retrying a failed job, doubled on every attempt
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 5))
+# how long an idle worker sleeps before polling the queue again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+# timeout for the POST to a job's callback url
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", 5))
+# comma separated hosts callback urls may point at (a leading dot allows the subdomains), empty allows any host
+JOB_CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+# allow callbacks to private, loopback and link-local addresses, only for local development
+JOB_CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "false").lower() == "true"
+
+# Startup
+# seed the db and S3 with the sample customer and the files in ./files when the app starts, off by default so
+# replicas boot without touching S3, seed explicitly with python -m src.scripts.seed instead. Seeding is idempotent.
+SEED_ON_STARTUP = os.getenv("SEED_ON_STARTUP", "false").lower() == "true"
+# threads hashing and uploading files while seeding
+SEED_WORKERS = int(os.getenv("SEED_WORKERS", 8))
+
+# Metrics
+# per stage timings, counters and the Server-Timing header, /metrics serves them in the Prometheus text format
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# with several uvicorn workers point this at a directory shared by the workers (emptied on deploy) so /metrics
+# reports the totals of every worker, unset for a single process
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+# how often each worker writes its metrics snapshot to METRICS_MULTIPROC_DIR
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", 5))
+# requests slower than this are logged with their per stage timings
+SLOW_REQUEST_LOG_SECONDS = float(os.getenv("SLOW_REQUEST_LOG_SECONDS", 1.0))
@@ -0,0 +1,268 @@
+"""
+Admission control of classification requests, per process.
+
+An OCR'd image costs about a hundred times as much as a TXT and nothing else bounds how much work the app
+takes on, so one customer's bulk upload could fill the CPU workers and every other request would wait behind
+it. Every /classify_file and /classify_batch request is admitted here first:
+
+- its cost is estimated from the file type (ADMISSION_COSTS, in units of a small TXT) times its size in
+  ADMISSION_COST_SIZE_UNIT_BYTES units, a batch costs the sum of its files
+- requests costing ADMISSION_EXPENSIVE_COST or more go in the expensive lane, the rest in the cheap lane, so a
+  queue of images never delays the cheap files. Each lane admits requests while the cost in flight is within
+  its capacity, a request costing more than the whole capacity runs alone
+- the others wait in a bounded queue per lane, one FIFO per customer. When room frees up the customer with the
+  least cost in flight goes next, so a customer with a backlog gets its share and no more, and a customer
+  may only have ADMISSION_CUSTOMER_QUEUE requests waiting in a lane
+- a full queue, a full customer queue or a wait longer than ADMISSION_WAIT_SECONDS raises AdmissionRejected,
+  a 429 whose Retry-After is how long the queued cost takes to drain at the lane's recent request times
+
+Waiters are woken through their own event loop, as in MemoryBudget (src/utils/buffers.py), so the lanes work
+across loops and threads. classify_admission_total, classify_admission_queue_depth,
+classify_admission_in_flight_cost and classify_admission_wait_seconds (src/utils/metrics.py) expose the
+decisions, queue depths, cost in flight and waits per lane.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Hashable, Optional
+
+from src.errors import AdmissionRejected
+from src.settings import (
+    ADMISSION_CHEAP_CAPACITY, ADMISSION_CHEAP_QUEUE, ADMISSION_COST_SIZE_UNIT_BYTES, ADMISSION_COSTS,
+    ADMISSION_CUSTOMER_QUEUE, ADMISSION_ENABLED, ADMISSION_EXPENSIVE_CAPACITY, ADMISSION_EXPENSIVE_COST,
+    ADMISSION_EXPENSIVE_QUEUE, ADMISSION_MAX_RETRY_AFTER, ADMISSION_WAIT_SECONDS,
+)
+from src.utils.metrics import ADMISSION_DECISIONS, ADMISSION_IN_FLIGHT_COST, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS as WAIT_SECONDS, file_type_of
+
+CHEAP = "cheap"
+EXPENSIVE = "expensive"
+# weight of the latest request in the moving average of request times used for Retry-After
+_HOLD_SECONDS_WEIGHT = 0.2
+
+
+def parse_costs(spec: str) -> dict[str, float]:
+    costs = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        file_type, _, value = item.partition("=")
+        costs[file_type.strip().lower()] = float(value)
+    return costs
+
+
+@dataclass
+class _Waiter:
+    customer_id: Hashable
+    cost: float
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.perf_counter)
+    granted: bool = False
+
+
+def _grant(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Lane:
+    """Cost in flight for one kind of work, with a bounded queue shared fairly between customers."""
+
+    def __init__(
+        self,
+        name: str,
+        capacity: float,
+        max_queue: int,
+        max_queue_per_customer: int = ADMISSION_CUSTOMER_QUEUE,
+        wait_seconds: float = ADMISSION_WAIT_SECONDS,
+        max_retry_after: int = ADMISSION_MAX_RETRY_AFTER,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_queue_per_customer = max_queue_per_customer
+        self.wait_seconds = wait_seconds
+        self.max_retry_after = max_retry_after
+        self.used = 0.0
+        self.customer_cost: dict[Hashable, float] = {}
+        self.queued = 0
+        self.queued_cost = 0.0
+        # moving average of how long admitted requests held their cost, None until one finished
+        self.hold_seconds: Optional[float] = None
+        self._queues: dict[Hashable, deque[_Waiter]] = {}
+        self._lock = threading.Lock()
+
+    def _fits(self, cost: float) -> bool:
+        return self.used + cost <= self.capacity
+
+    # called with the lock held
+    def _take(self, customer_id: Hashable, cost: float) -> None:
+        self.used += cost
+        self.customer_cost[customer_id] = self.customer_cost.get(customer_id, 0.0) + cost
+        ADMISSION_IN_FLIGHT_COST.set(self.used, lane=self.name)
+
+    def retry_after(self, cost: float) -> int:
+        """Seconds until the queued cost plus cost has drained, at the recent request times."""
+        hold_seconds = self.hold_seconds if self.hold_seconds is not None else self.wait_seconds
+        seconds = hold_seconds * (self.queued_cost + cost) / self.capacity
+        return max(1, min(self.max_retry_after, math.ceil(seconds)))
+
+    def _reject(self, result: str, cost: float, msg: str) -> AdmissionRejected:
+        ADMISSION_DECISIONS.inc(lane=self.name, result=result)
+        return AdmissionRejected(msg, retry_after=self.retry_after(cost))
+
+    async def acquire(self, customer_id: Hashable, cost: float) -> float:
+        """
+        Wait for room for cost, raises AdmissionRejected when the queue is full or the wait times out.
+
+        Returns:
+            float: the cost reserved, pass it to release. Capped at the capacity so a huge request runs alone.
+        """
+        cost = min(cost, self.capacity)
+        with self._lock:
+            # first come first served, a request does not overtake the ones already waiting
+            if not self.queued and self._fits(cost):
+                self._take(customer_id, cost)
+                ADMISSION_DECISIONS.inc(lane=self.name, result="admitted")
+                return cost
+            queue = self._queues.get(customer_id)
+            if queue is not None and len(queue) >= self.max_queue_per_customer:
+                raise self._reject("rejected_customer_queue_full", cost, f"Too many {self.name} requests queued for this customer, retry later")
+            if self.queued >= self.max_queue:
+                raise self._reject("rejected_queue_full", cost, f"Too many {self.name} requests queued, retry later")
+            waiter = _Waiter(customer_id, cost, asyncio.get_running_loop().create_future())
+            self._queues.setdefault(customer_id, deque()).append(waiter)
+            self.queued += 1
+            self.queued_cost += cost
+            ADMISSION_QUEUE_DEPTH.set(self.queued, lane=self.name)
+            ADMISSION_DECISIONS.inc(lane=self.name, result="queued")
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.wait_seconds)
+        except BaseException as e:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._dequeue(waiter)
+                    waiter.future.cancel()
+                    self._wake()
+            if granted and isinstance(e, asyncio.TimeoutError):
+                # granted just as the wait timed out, keep it
+                return cost
+            if granted:
+                self.release(customer_id, cost)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("timed_out", cost, f"Timed out waiting for {self.name} capacity, retry later") from None
+            raise
+        return cost
+
+    def release(self, customer_id: Hashable, cost: float, held_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self.used = max(0.0, self.used - cost)
+            remaining = self.customer_cost.get(customer_id, 0.0) - cost
+            if remaining > 1e-9:
+                self.customer_cost[customer_id] = remaining
+            else:
+                self.customer_cost.pop(customer_id, None)
+            if held_seconds is not None:
+                self.hold_seconds = held_seconds if self.hold_seconds is None else (
+                    _HOLD_SECONDS_WEIGHT * held_seconds + (1 - _HOLD_SECONDS_WEIGHT) * self.hold_seconds
+                )
+            ADMISSION_IN_FLIGHT_COST.set(self.used, lane=self.name)
+            self._wake()
+
+    # called with the lock held
+    def _dequeue(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.customer_id]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.customer_id]
+        self.queued -= 1
+        self.queued_cost -= waiter.cost
+        ADMISSION_QUEUE_DEPTH.set(self.queued, lane=self.name)
+
+    # hand the room to the next waiters, the customer with the least cost in flight first (oldest request on a tie),
+    # called with the lock held
+    def _wake(self) -> None:
+        while self._queues:
+            customer_id = min(self._queues, key=lambda customer: (self.customer_cost.get(customer, 0.0), self._queues[customer][0].enqueued))
+            waiter = self._queues[customer_id][0]
+            if not self._fits(waiter.cost):
+                return
+            self._dequeue(waiter)
+            waiter.granted = True
+            self._take(customer_id, waiter.cost)
+            waiter.future.get_loop().call_soon_threadsafe(_grant, waiter.future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight_cost": self.used,
+                "queued": self.queued,
+                "queued_cost": self.queued_cost,
+                "customers_in_flight": len(self.customer_cost),
+                "customers_queued": len(self._queues),
+            }
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        enabled: bool = ADMISSION_ENABLED,
+        costs: Optional[dict[str, float]] = None,
+        expensive_cost: float = ADMISSION_EXPENSIVE_COST,
+        size_unit_bytes: int = ADMISSION_COST_SIZE_UNIT_BYTES,
+        lanes: Optional[dict[str, Lane]] = None,
+    ):
+        self.enabled = enabled
+        self.costs = costs if costs is not None else parse_costs(ADMISSION_COSTS)
+        self.expensive_cost = expensive_cost
+        self.size_unit_bytes = size_unit_bytes
+        self.lanes = lanes or {
+            CHEAP: Lane(CHEAP, ADMISSION_CHEAP_CAPACITY, ADMISSION_CHEAP_QUEUE),
+            EXPENSIVE: Lane(EXPENSIVE, ADMISSION_EXPENSIVE_CAPACITY, ADMISSION_EXPENSIVE_QUEUE),
+        }
+
+    def estimate_cost(self, filename: str, size_bytes: Optional[int] = None) -> float:
+        """Estimated cost of classifying the file, the cost of its type times its size in size units (at least one)."""
+        cost = self.costs.get(file_type_of(filename), 1.0)
+        if size_bytes:
+            cost *= max(1.0, size_bytes / self.size_unit_bytes)
+        return cost
+
+    def lane_for(self, costs: list[float]) -> Lane:
+        return self.lanes[EXPENSIVE if max(costs) >= self.expensive_cost else CHEAP]
+
+    @asynccontextmanager
+    async def admit(self, customer_id: Hashable, costs: list[float]) -> AsyncIterator[Optional[str]]:
+        """
+        Hold room for a request of one or more files while the block runs, raises AdmissionRejected when there is none.
+
+        Args:
+            customer_id (Hashable): customer the request is charged to for fair sharing.
+            costs (list[float]): estimated cost of every file of the request (see estimate_cost).
+
+        Returns:
+            the name of the lane the request was admitted to, None when admission control is off.
+        """
+        if not self.enabled or not costs:
+            yield None
+            return
+        lane = self.lane_for(costs)
+        start = time.perf_counter()
+        cost = await lane.acquire(customer_id, sum(costs))
+        admitted = time.perf_counter()
+        WAIT_SECONDS.observe(admitted - start, lane=lane.name)
+        try:
+            yield lane.name
+        finally:
+            lane.release(customer_id, cost, time.perf_counter() - admitted)
+
+    def stats(self) -> dict:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,162 @@
+"""
+Helpers to classify many files in one go.
+
+The batch path looks up all the file metadata with one query, downloads and hashes the files in parallel
+on the I/O thread pool and checks the classification cache for every hash at once. Only the cache misses
+are extracted (in parallel on the CPU executor) and then classified with one batched predict_proba.
+Each item carries its own error so that one bad file does not fail the whole batch.
+
+The files of a batch share one request memory budget (src/utils/buffers.py): once the batch holds
+REQUEST_MEMORY_BUDGET_BYTES in memory the rest are spooled to temp files, and files that do not fit in the
+process budget fail with a retryable error rather than the batch waiting on itself.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from sqlalchemy.orm import Session
+
+from src.classifier import classify_files_ml, get_model_version
+from src.data_models.tables import File as FileModel
+from src.errors import FileContentMismatch, FileExtensionNotSupported, MemoryBudgetExceeded
+from src.utils.buffers import FileBuffer, RequestMemory
+from src.utils.classification_cache import CachedClassification, classification_cache
+from src.utils.executors import run_io, run_cpu
+from src.settings import WRITE_BEHIND_ENABLED
+from src.utils.tasks import extract_text_task
+from src.utils.utils import download_file_buffer, get_files_metadata, update_files_classification
+from src.validation.file_type_validation import allowed_file
+from src.utils.write_behind import classification_writer
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger(__name__)
+
+# download a single file from s3 within the batch's memory budget and hash it on the I/O pool
+async def download_and_hash(s3_client: "BaseClient", bucket: str, file_metadata: FileModel, request_memory: RequestMemory) -> tuple[FileBuffer, str]:
+    file_buffer = await download_file_buffer(s3_client, bucket, file_metadata.s3Path, request_memory, file_metadata.filename)
+    if not isinstance(file_buffer, FileBuffer):
+        raise ValueError(f"Could not read bytes for file {file_metadata.filename}")
+    try:
+        return file_buffer, await run_io(file_buffer.sha256)
+    except BaseException:
+        file_buffer.close()
+        raise
+
+async def classify_batch(db: Session, s3_client: "BaseClient", bucket: str, items: list[tuple[int, str]]) -> list[dict]:
+    """
+    Classifies a batch of files and writes the classifications back to the db in bulk.
+
+    Args:
+        db (Session): SQLAlchemy session to interact with the database.
+        s3_client (BaseClient): Boto3 S3 client used to download the files.
+        bucket (str): S3 bucket the files are stored in.
+        items (list[tuple[int, str]]): (customer_id, filename) pairs to classify.
+
+    Returns:
+        list[dict]: one result per input item, in input order, with either a file_class or an error.
+    """
+    results = [
+        {"customer_id": customer_id, "filename": filename, "file_class": None, "confidence": None, "cached": False, "error": None}
+        for customer_id, filename in items
+    ]
+
+    # validate extensions up front, unsupported files never hit the db or s3
+    valid_items = {}
+    for idx, (customer_id, filename) in enumerate(items):
+        try:
+            allowed_file(filename)
+        except FileExtensionNotSupported:
+            results[idx]["error"] = "File type not supported"
+            continue
+        valid_items.setdefault((customer_id, filename), []).append(idx)
+
+    def fail(key, error):
+        for idx in valid_items[key]:
+            results[idx]["error"] = error
+
+    # one query for all the metadata
+    files_metadata = await run_io(get_files_metadata, db, list(valid_items.keys()))
+
+    # download and hash every distinct file in parallel, the buffers are closed (temp files deleted) and the
+    # memory released once the cache misses have been extracted
+    async with RequestMemory() as request_memory:
+        pending = {}
+        for key in valid_items:
+            file_metadata = files_metadata.get(key)
+            if file_metadata is None:
+                fail(key, f"File {key[1]} not found for customer {key[0]}")
+                continue
+            pending[key] = download_and_hash(s3_client, bucket, file_metadata, request_memory)
+
+        downloads = {}
+        download_outcomes = await asyncio.gather(*pending.values(), return_exceptions=True)
+        try:
+            for key, outcome in zip(pending.keys(), download_outcomes):
+                if isinstance(outcome, MemoryBudgetExceeded):
+                    logger.error(f"No memory for file {key[1]} for customer {key[0]}: {outcome.msg}")
+                    fail(key, outcome.msg)
+                    continue
+                if isinstance(outcome, FileContentMismatch):
+                    logger.error(outcome.msg)
+                    fail(key, outcome.msg)
+                    continue
+                if isinstance(outcome, Exception):
+                    logger.error(f"Error processing file {key[1]} for customer {key[0]}: {outcome}")
+                    fail(key, "Error processing")
+                    continue
+                downloads[key] = outcome
+
+            # one cache lookup for every hash in the batch
+            model_version = await run_io(get_model_version)
+            cached = await run_io(classification_cache.get_many, db, [content_hash for _, content_hash in downloads.values()], model_version)
+
+            # extract the cache misses in parallel, identical documents are only extracted once
+            to_extract = {}
+            for key, (file_buffer, content_hash) in downloads.items():
+                if content_hash not in cached and content_hash not in to_extract:
+                    to_extract[content_hash] = run_cpu(extract_text_task, file_buffer, key[1])
+
+            texts = {}
+            outcomes = await asyncio.gather(*to_extract.values(), return_exceptions=True)
+            for content_hash, outcome in zip(to_extract.keys(), outcomes):
+                if isinstance(outcome, Exception):
+                    logger.error(f"Error extracting text for file with hash {content_hash}: {outcome}")
+                    continue
+                texts[content_hash] = outcome
+        finally:
+            for outcome in download_outcomes:
+                if not isinstance(outcome, BaseException):
+                    outcome[0].close()
+
+    # single vectorised inference over every text that was extracted
+    hashes = list(texts.keys())
+    predictions = await run_cpu(classify_files_ml, [texts[content_hash] for content_hash in hashes])
+    new_entries = {}
+    confidences = {}
+    for content_hash, (file_class, confidence) in zip(hashes, predictions):
+        new_entries[content_hash] = CachedClassification(extracted_text=texts[content_hash], file_class=str(file_class))
+        confidences[content_hash] = confidence
+
+    classifications = []
+    for key, (_, content_hash) in downloads.items():
+        entry = cached.get(content_hash) or new_entries.get(content_hash)
+        if entry is None:
+            fail(key, "Error processing")
+            continue
+        classifications.append((files_metadata[key], entry.file_class))
+        for idx in valid_items[key]:
+            results[idx]["file_class"] = entry.file_class
+            results[idx]["confidence"] = confidences.get(content_hash)
+            results[idx]["cached"] = content_hash in cached
+
+    await run_io(classification_cache.put_many, db, model_version, new_entries)
+    if WRITE_BEHIND_ENABLED:
+        # queued for the background flusher, submitted off the event loop as it blocks when the queue is full
+        await run_io(classification_writer.submit_many, [(file_metadata.id, file_class) for file_metadata, file_class in classifications], model_version)
+    else:
+        await run_io(update_files_classification, db, classifications, model_version)
+
+    return results
@@ -0,0 +1,255 @@
+"""
+Bounded memory handling of downloaded files.
+
+FileBuffer holds the content of one file without extra copies:
+- in memory: the single bytes object read from S3, readers get a BytesIO over it (CPython shares the bytes
+  until the BytesIO is written to) or a memoryview
+- spooled: the S3 body is copied chunk by chunk into a temp file and never held whole, readers get a read only
+  mmap of the file. A spooled buffer pickles as its path, so a CPU worker process maps the same file rather
+  than being sent a pickled copy of the content. The CPU tasks close the mapping they read through as soon as they
+  are done, close() closes any that are still open
+
+Two budgets decide where a file goes:
+- per request (RequestMemory): a request keeps at most REQUEST_MEMORY_BUDGET_BYTES of file content in memory,
+  files that do not fit in what is left are spooled
+- per process (MemoryBudget): every in flight file, in memory or spooled, reserves its size before its body is
+  read. When the budget is used up the file waits up to MEMORY_BUDGET_WAIT_SECONDS for room, then it is rejected
+  with MemoryBudgetExceeded (503). A request that already holds a reservation does not wait, as requests waiting
+  on each other's reservations could deadlock, it is rejected straight away
+
+Files are downloaded into a FileBuffer by download_file_buffer in src/utils/utils.py.
+"""
+
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from io import BytesIO
+from typing import BinaryIO, Optional, Union
+
+from src.errors import MemoryBudgetExceeded
+from src.settings import MEMORY_BUDGET_BYTES, MEMORY_BUDGET_WAIT_SECONDS, REQUEST_MEMORY_BUDGET_BYTES, SPOOL_CHUNK_BYTES, SPOOL_DIR
+logger = logging.getLogger(__name__)
+
+
+class FileBuffer:
+    """Content of one file, in memory or spooled to a temp file. Close it to delete the temp file."""
+
+    def __init__(self, data: Optional[bytes] = None, path: Optional[str] = None, size: int = 0, owner: bool = True):
+        self.data = data
+        self.path = path
+        self.size = len(data) if data is not None else size
+        # only the process that spooled the file deletes it, copies unpickled in a worker never do
+        self._owner = owner
+        # memory maps handed out by open() and view() and the views over them, closed by close()
+        self._mappings: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+
+    @property
+    def spooled(self) -> bool:
+        return self.path is not None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FileBuffer":
+        return cls(data=data)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, spool: bool, spool_dir: Optional[str] = SPOOL_DIR, chunk_size: int = SPOOL_CHUNK_BYTES) -> "FileBuffer":
+        """Read a stream into memory, or chunk by chunk into a temp file when spool is set."""
+        if not spool:
+            return cls(data=stream.read())
+        fd, path = tempfile.mkstemp(prefix="classify-", suffix=".spool", dir=spool_dir)
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := stream.read(chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+        if not size:
+            # an empty file cannot be memory mapped
+            os.unlink(path)
+            return cls(data=b"")
+        return cls(path=path, size=size)
+
+    def _map(self) -> mmap.mmap:
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mappings.append(mapped)
+        return mapped
+
+    def open(self) -> BinaryIO:
+        """
+        New file like reader positioned at the start, each call has its own position.
+        Use it as a context manager to close a spooled file's mapping early, close() closes any left open.
+        """
+        return BytesIO(self.data) if self.data is not None else self._map()
+
+    def view(self) -> memoryview:
+        """Read only memoryview of the whole content, no copy. Released by close() for a spooled file."""
+        if self.data is not None:
+            return memoryview(self.data)
+        view = memoryview(self._map())
+        self._views.append(view)
+        return view
+
+    def getvalue(self) -> bytes:
+        """The content as bytes, copies a spooled file into memory."""
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def sha256(self) -> str:
+        # hashlib reads the buffer in place and releases the GIL, a spooled file is hashed through its mapping
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+    def _close_mappings(self) -> None:
+        views, self._views = self._views, []
+        mappings, self._mappings = self._mappings, []
+        for view in views:
+            try:
+                view.release()
+            except BufferError:
+                pass  # the mapping below reports it
+        for mapped in mappings:
+            try:
+                mapped.close()
+            except BufferError:
+                # something still holds a buffer over the mapping, it is unmapped when that is garbage collected
+                logger.warning(f"Memory map of {self.path} is still in use, it is closed when it is released")
+
+    def close(self) -> None:
+        """Close the memory maps handed out by open() and view(), and delete the temp file if this process spooled it."""
+        self._close_mappings()
+        if self.path is not None and self._owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self._owner = False
+
+    def __enter__(self) -> "FileBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        return {"data": self.data, "path": self.path, "size": self.size, "_owner": False, "_mappings": [], "_views": []}
+
+
+# file like reader over raw bytes or a FileBuffer, for the CPU tasks which accept either
+def open_content(content: Union[bytes, FileBuffer]) -> BinaryIO:
+    return content.open() if isinstance(content, FileBuffer) else BytesIO(content)
+
+
+class MemoryBudget:
+    """
+    Bytes reserved by in flight files, shared by every request of a process.
+    Waiters are woken in order through their own event loop so the budget works across loops and threads.
+    """
+
+    def __init__(self, limit_bytes: int = MEMORY_BUDGET_BYTES, wait_seconds: float = MEMORY_BUDGET_WAIT_SECONDS):
+        self.limit_bytes = limit_bytes
+        self.wait_seconds = wait_seconds
+        self.used = 0
+        self._waiters: list[tuple[int, asyncio.Future]] = []
+        self._lock = threading.Lock()
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.used + nbytes <= self.limit_bytes
+
+    async def acquire(self, nbytes: int, wait: bool = True) -> None:
+        """Reserve nbytes, waiting up to wait_seconds for room, raises MemoryBudgetExceeded otherwise."""
+        if nbytes > self.limit_bytes:
+            raise MemoryBudgetExceeded(f"File of {nbytes} bytes is larger than the memory budget of {self.limit_bytes} bytes", status_code=413)
+        with self._lock:
+            # first come first served, a small file does not overtake a large one that is already waiting
+            if not self._waiters and self._fits(nbytes):
+                self.used += nbytes
+                return
+            if not wait or self.wait_seconds <= 0:
+                raise MemoryBudgetExceeded()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((nbytes, waiter))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.wait_seconds)
+        except BaseException as e:
+            # timed out or cancelled, a waiter still queued was not granted the room
+            with self._lock:
+                granted = (nbytes, waiter) not in self._waiters
+                if not granted:
+                    self._waiters.remove((nbytes, waiter))
+                    waiter.cancel()
+                    self._wake()
+            if granted and isinstance(e, asyncio.TimeoutError):
+                # granted just as the wait timed out, keep the reservation
+                return
+            if granted:
+                self.release(nbytes)
+            if isinstance(e, asyncio.TimeoutError):
+                raise MemoryBudgetExceeded() from None
+            raise
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self.used -= nbytes
+            self._wake()
+
+    # hand room to the waiters at the front of the queue, called with the lock held
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            nbytes, waiter = self._waiters.pop(0)
+            self.used += nbytes
+            waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+
+
+def _grant(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+memory_budget = MemoryBudget()
+
+
+class RequestMemory:
+    """
+    Memory accounting of one request, use as an async context manager so its reservations are released.
+    admit() reserves a file's size in the process budget and says whether it can be kept in memory.
+    """
+
+    def __init__(self, limit_bytes: int = REQUEST_MEMORY_BUDGET_BYTES, budget: Optional[MemoryBudget] = None):
+        self.limit_bytes = limit_bytes
+        self.budget = budget or memory_budget
+        self.reserved = 0
+        self.in_memory = 0
+
+    async def admit(self, size: int) -> bool:
+        """Reserve size bytes, returns True when the file fits in memory and False when it should be spooled."""
+        await self.budget.acquire(size, wait=self.reserved == 0)
+        self.reserved += size
+        if self.in_memory + size <= self.limit_bytes:
+            self.in_memory += size
+            return True
+        return False
+
+    def release_all(self) -> None:
+        if self.reserved:
+            self.budget.release(self.reserved)
+        self.reserved = self.in_memory = 0
+
+    async def __aenter__(self) -> "RequestMemory":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release_all()
+
@@ -0,0 +1,205 @@
+"""
+Cheap first classification cascade.
+
+Each tier costs more than the one before it and only runs when the previous tier was not confident enough,
+i.e. its confidence is below the threshold of the class it predicted:
+
+- tier 0: head model (src/head_model.py) on the filename tokens and the first CASCADE_HEAD_CHARS of the text layer
+- tier 1: the main model on the text layer, page by page with early exit, never OCRs
+- tier 2: OCR, images and the scanned pages of PDFs
+
+Tiers that cannot add anything are skipped: tier 0 without a head model, tier 1 for images, tier 2 for
+DOCX/TXT and for PDFs whose pages all have a text layer. When no tier is confident enough the most
+confident answer of the tiers that ran is used. Runs inside a CPU worker (see cascade_classify_task in
+src/utils/tasks.py).
+
+With INFERENCE_BATCHING the pipeline runs the cascade in steps instead (see classify_pipeline): the worker runs
+tier 0 and only extracts the text layer (head_and_text_layer), tier 1 classifies that text through the
+inference scheduler with the texts of concurrent requests, and tier 2 runs in the worker when still needed.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Iterator, Optional, Union
+
+from src.classifier import classify_pages_ml
+from src.head_model import load_head_model
+from src.settings import CASCADE_DEFAULT_THRESHOLD, CASCADE_HEAD_CHARS, CASCADE_THRESHOLDS, EARLY_EXIT_CONFIDENCE, HEAD_MODEL_PATH
+from src.utils.buffers import FileBuffer, open_content
+from src.utils.extract_text import OCRTextExtractor, PDFTextExtractor, get_text_extractor
+
+TIER_HEAD = 0
+TIER_TEXT_LAYER = 1
+TIER_OCR = 2
+
+
+@dataclass
+class TierResult:
+    tier: int
+    file_class: str
+    confidence: float
+    text: str
+    pages_read: int
+
+
+# tier 0 and the text layer of a file, what the worker sends back when tier 1 is classified outside of it
+@dataclass
+class TextLayerStep:
+    results: list[TierResult]  # tiers that already ran (tier 0 when there is a head model)
+    decided: bool  # a tier was confident, nothing else needs to run
+    text: Optional[str]  # text layer for tier 1, None when there is none
+    pages_read: int
+    ocr_could_help: bool
+
+
+# "bank_statement=0.8,invoice=0.9" -> {"bank_statement": 0.8, "invoice": 0.9}
+def parse_thresholds(spec: str) -> dict[str, float]:
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        file_class, _, value = item.partition("=")
+        thresholds[file_class.strip()] = float(value)
+    return thresholds
+
+# yield the pages, adding the time spent producing each page to timings["extract"]
+def timed_pages(pages: Iterator[str], timings: dict) -> Iterator[str]:
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        timings["extract"] = timings.get("extract", 0.0) + time.perf_counter() - start
+        if page is None:
+            return
+        yield page
+
+
+class CascadeClassifier:
+    def __init__(
+        self,
+        thresholds: Optional[dict[str, float]] = None,
+        default_threshold: float = CASCADE_DEFAULT_THRESHOLD,
+        head_chars: int = CASCADE_HEAD_CHARS,
+        head_model_path: str = HEAD_MODEL_PATH,
+        early_exit_confidence: float = EARLY_EXIT_CONFIDENCE,
+    ):
+        self.thresholds = thresholds if thresholds is not None else parse_thresholds(CASCADE_THRESHOLDS)
+        self.default_threshold = default_threshold
+        self.head_chars = head_chars
+        self.head_model_path = head_model_path
+        self.early_exit_confidence = early_exit_confidence
+
+    def threshold(self, file_class: str) -> float:
+        return self.thresholds.get(str(file_class), self.default_threshold)
+
+    def is_confident(self, result: TierResult) -> bool:
+        return result.confidence >= self.threshold(result.file_class)
+
+    def _classify_pages(self, tier: int, extractor, file_content: Union[bytes, FileBuffer], timings: dict) -> TierResult:
+        with open_content(file_content) as file_bytes:
+            pages = timed_pages(extractor.iter_pages(file_bytes), timings)
+            file_class, confidence, pages_read, text = classify_pages_ml(pages, self.early_exit_confidence, timings)
+        return TierResult(tier, str(file_class), confidence, text, pages_read)
+
+    def head_tier(self, file_content: Union[bytes, FileBuffer], filename: str, timings: dict) -> Optional[TierResult]:
+        head_model = load_head_model(self.head_model_path)
+        if head_model is None:
+            return None
+        start = time.perf_counter()
+        with open_content(file_content) as file_bytes:
+            head = get_text_extractor(filename).extract_head(file_bytes, self.head_chars)
+        timings["extract"] = timings.get("extract", 0.0) + time.perf_counter() - start
+        file_class, confidence = head_model.classify(filename, head)
+        return TierResult(TIER_HEAD, file_class, confidence, head, 1 if head else 0)
+
+    # extractor of the text layer only, None for images which have none
+    def _text_layer_extractor(self, filename: str):
+        extractor = get_text_extractor(filename)
+        if isinstance(extractor, OCRTextExtractor):
+            return None
+        if isinstance(extractor, PDFTextExtractor):
+            extractor.ocr = False
+        return extractor
+
+    # OCR could change the answer for images and for PDFs with scanned pages
+    def _ocr_could_help(self, extractor) -> bool:
+        return extractor is None or (isinstance(extractor, PDFTextExtractor) and extractor.scanned_pages > 0)
+
+    # returns the result (None when there is no text layer at all) and whether OCR could change it
+    def text_layer_tier(self, file_content: Union[bytes, FileBuffer], filename: str, timings: dict) -> tuple[Optional[TierResult], bool]:
+        extractor = self._text_layer_extractor(filename)
+        if extractor is None:
+            return None, True
+        result = self._classify_pages(TIER_TEXT_LAYER, extractor, file_content, timings)
+        if not result.text.strip():
+            return None, self._ocr_could_help(extractor)
+        return result, self._ocr_could_help(extractor)
+
+    def head_and_text_layer(self, file_content: Union[bytes, FileBuffer], filename: str, timings: Optional[dict] = None) -> TextLayerStep:
+        """Run tier 0 and, unless it is confident, extract the text layer for tier 1 without classifying it."""
+        timings = {} if timings is None else timings
+        start = time.perf_counter()
+        head = self.head_tier(file_content, filename, timings)
+        timings["tier0"] = time.perf_counter() - start
+        results = [head] if head is not None else []
+        if head is not None and self.is_confident(head):
+            return TextLayerStep(results, True, None, 0, False)
+
+        start = time.perf_counter()
+        extractor = self._text_layer_extractor(filename)
+        text, pages_read = None, 0
+        if extractor is not None:
+            with open_content(file_content) as file_bytes:
+                pages = list(timed_pages(extractor.iter_pages(file_bytes), timings))
+            text, pages_read = "".join(pages), len(pages)
+        timings["tier1"] = time.perf_counter() - start
+        return TextLayerStep(results, False, text if text and text.strip() else None, pages_read, self._ocr_could_help(extractor))
+
+    def ocr_tier(self, file_content: Union[bytes, FileBuffer], filename: str, timings: dict) -> TierResult:
+        return self._classify_pages(TIER_OCR, get_text_extractor(filename), file_content, timings)
+
+    def iter_tiers(self, file_content: Union[bytes, FileBuffer], filename: str, timings: Optional[dict] = None) -> Iterator[TierResult]:
+        """Yield the result of every tier that applies to the file, cheapest first, each tier runs when it is asked for."""
+        timings = {} if timings is None else timings
+
+        start = time.perf_counter()
+        result = self.head_tier(file_content, filename, timings)
+        timings["tier0"] = time.perf_counter() - start
+        if result is not None:
+            yield result
+
+        start = time.perf_counter()
+        result, ocr_could_help = self.text_layer_tier(file_content, filename, timings)
+        timings["tier1"] = time.perf_counter() - start
+        if result is not None:
+            yield result
+        if not ocr_could_help:
+            return
+
+        start = time.perf_counter()
+        result = self.ocr_tier(file_content, filename, timings)
+        timings["tier2"] = time.perf_counter() - start
+        yield result
+
+    def decide(self, results: list[TierResult]) -> TierResult:
+        """First confident result, otherwise the most confident one."""
+        for result in results:
+            if self.is_confident(result):
+                return result
+        return max(results, key=lambda result: result.confidence)
+
+    def classify(self, file_content: Union[bytes, FileBuffer], filename: str, timings: Optional[dict] = None) -> TierResult:
+        """Escalate through the tiers until one is confident, timings gets the seconds spent per tier and stage."""
+        results = []
+        for result in self.iter_tiers(file_content, filename, timings):
+            results.append(result)
+            if self.is_confident(result):
+                break
+        return self.decide(results)
+
+
+_cascade = None
+
+# cascade configured from the settings, built once per process
+def get_cascade() -> CascadeClassifier:
+    global _cascade
+    if _cascade is None:
+        _cascade = CascadeClassifier()
+    return _cascade
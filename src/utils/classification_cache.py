@@ -0,0 +1,242 @@
+"""
+Content addressed classification cache.
+
+Files are keyed by the sha256 of their bytes plus the model version, so re-uploads of the same document
+under a different filename skip extraction and inference entirely. Two tiers:
+
+- memory: per process LRU with an entry limit, a byte limit (size of the cached text) and a TTL
+- persistent: the classification_cache table, shared by every worker and kept across restarts
+
+Entries written by an older model never match as the model version is part of the key. When a process sees
+the model change the memory tier is cleared and stale rows are deleted from the table, rows left by the
+previous version of a deploy are deleted with python -m src.scripts.purge_classification_cache.
+Cache errors are logged and treated as a miss, the cache must never fail a classification.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from src.classifier import get_model_version
+from src.data_models.tables import ClassificationCacheEntry
+from src.settings import (
+    CLASSIFICATION_CACHE_ENABLED,
+    CLASSIFICATION_CACHE_MAX_ENTRIES,
+    CLASSIFICATION_CACHE_MAX_BYTES,
+    CLASSIFICATION_CACHE_TTL_SECONDS,
+    CLASSIFICATION_CACHE_PERSISTENT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# sha256 of the raw file bytes, hashlib releases the GIL so this is fine to run on the I/O pool
+def hash_file_bytes(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+@dataclass
+class CachedClassification:
+    extracted_text: str
+    file_class: str
+
+
+class LRUTTLCache:
+    """Thread safe LRU cache bounded by number of entries, total text size in bytes and entry age."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, size, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size: int) -> None:
+        # an entry bigger than the whole budget would just evict everything else
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class ClassificationCache:
+    def __init__(
+        self,
+        enabled: bool = CLASSIFICATION_CACHE_ENABLED,
+        persistent: bool = CLASSIFICATION_CACHE_PERSISTENT,
+        max_entries: int = CLASSIFICATION_CACHE_MAX_ENTRIES,
+        max_bytes: int = CLASSIFICATION_CACHE_MAX_BYTES,
+        ttl_seconds: float = CLASSIFICATION_CACHE_TTL_SECONDS,
+    ):
+        self.enabled = enabled
+        self.persistent = persistent
+        self.memory = LRUTTLCache(max_entries, max_bytes, ttl_seconds)
+        self._model_version: Optional[str] = None
+        self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    # drop everything produced by an older model when this process sees the model change
+    # the first version a process sees is not a change: during a rolling deploy old and new workers run side by
+    # side and would otherwise delete each other's rows, leftovers are removed by purge_classification_cache
+    def _check_model_version(self, db: Optional[Session], model_version: str) -> None:
+        with self._lock:
+            if self._model_version == model_version:
+                return
+            previous, self._model_version = self._model_version, model_version
+        self.memory.clear()
+        if previous is None:
+            return
+        logger.info(f"Model version changed from {previous[:12]} to {model_version[:12]}, invalidating classification cache")
+        if self.persistent and db is not None:
+            self.purge_stale(db, model_version)
+
+    def get(self, db: Optional[Session], content_hash: str, model_version: str) -> Optional[CachedClassification]:
+        """Look the file up in memory then in the table, returns None on a miss."""
+        return self.get_many(db, [content_hash], model_version).get(content_hash)
+
+    def get_many(self, db: Optional[Session], content_hashes: list[str], model_version: str) -> dict[str, CachedClassification]:
+        """Look many files up at once, memory first then a single query for the rest. Misses are absent from the result."""
+        if not self.enabled or not content_hashes:
+            return {}
+        self._check_model_version(db, model_version)
+
+        found = {}
+        remaining = []
+        for content_hash in dict.fromkeys(content_hashes):
+            cached = self.memory.get((content_hash, model_version))
+            if cached is not None:
+                self._count("memory_hits")
+                found[content_hash] = cached
+            else:
+                remaining.append(content_hash)
+
+        if remaining and self.persistent and db is not None:
+            try:
+                rows = db.query(ClassificationCacheEntry).filter(
+                    ClassificationCacheEntry.modelVersion == model_version,
+                    ClassificationCacheEntry.contentHash.in_(remaining),
+                ).all()
+            except Exception as e:
+                logger.error(f"Error reading classification cache: {e}")
+                db.rollback()
+                rows = []
+                self._count("errors")
+            for row in rows:
+                cached = CachedClassification(extracted_text=row.extractedText, file_class=row.fileClassification)
+                self.memory.put((row.contentHash, model_version), cached, len(cached.extracted_text))
+                self._count("persistent_hits")
+                found[row.contentHash] = cached
+
+        for content_hash in remaining:
+            if content_hash not in found:
+                self._count("misses")
+        return found
+
+    def lookup(self, db: Optional[Session], file_content: bytes) -> tuple[str, str, Optional[CachedClassification]]:
+        """Hash the file bytes and look them up against the current model version."""
+        content_hash = hash_file_bytes(file_content)
+        model_version = get_model_version()
+        return content_hash, model_version, self.get(db, content_hash, model_version)
+
+    def lookup_hash(self, db: Optional[Session], content_hash: str) -> tuple[str, Optional[CachedClassification]]:
+        """Look up a hash computed elsewhere (e.g. at upload) against the current model version."""
+        model_version = get_model_version()
+        return model_version, self.get(db, content_hash, model_version)
+
+    def put(self, db: Optional[Session], content_hash: str, model_version: str, extracted_text: str, file_class: str) -> None:
+        """Store a classification in both tiers."""
+        self.put_many(db, model_version, {content_hash: CachedClassification(extracted_text=extracted_text, file_class=file_class)})
+
+    def put_many(self, db: Optional[Session], model_version: str, entries: dict[str, CachedClassification]) -> None:
+        """Store many classifications in both tiers with a single commit."""
+        if not self.enabled or not entries:
+            return
+        for content_hash, cached in entries.items():
+            self.memory.put((content_hash, model_version), cached, len(cached.extracted_text))
+
+        if self.persistent and db is not None:
+            try:
+                # merge so that two workers writing the same document do not clash on the primary key
+                for content_hash, cached in entries.items():
+                    db.merge(ClassificationCacheEntry(
+                        contentHash=content_hash,
+                        modelVersion=model_version,
+                        extractedText=cached.extracted_text,
+                        fileClassification=cached.file_class,
+                    ))
+                db.commit()
+            except Exception as e:
+                logger.error(f"Error writing classification cache: {e}")
+                db.rollback()
+                self._count("errors")
+
+    def purge_stale(self, db: Session, model_version: str) -> int:
+        """Delete rows written by any other model version, returns the number of rows removed."""
+        try:
+            deleted = db.query(ClassificationCacheEntry).filter(
+                ClassificationCacheEntry.modelVersion != model_version
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            logger.error(f"Error purging stale classification cache entries: {e}")
+            db.rollback()
+            self._count("errors")
+            return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["memory_bytes"] = self.memory.size_bytes
+        stats["model_version"] = self._model_version
+        return stats
+
+
+# process wide cache used by the endpoints
+classification_cache = ClassificationCache()
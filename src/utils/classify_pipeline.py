@@ -0,0 +1,201 @@
+"""
+Classification pipeline for a single stored file, shared by /classify_file and the job workers.
+
+cache lookup (by stored hash, or by the downloaded bytes) -> S3 download on a miss, after a ranged GET of the
+first bytes checked the file is what its extension says -> extraction and
+classification on the CPU executor (through the cascade when CASCADE_ENABLED, otherwise extraction then
+inference micro batched with concurrent requests when INFERENCE_BATCHING, the cascade's tier 1 is batched
+the same way) -> cache put -> write behind persistence of the class
+
+Downloads go into a FileBuffer within the memory budgets (src/utils/buffers.py): the file reserves its size
+before its body is read, large files are spooled to a temp file that the CPU worker memory maps, and the
+reservation and temp file are released as soon as the file is classified.
+
+Concurrent calls for the same customer and filename are coalesced (src/utils/single_flight.py): the first
+one classifies the file and the others get its result, so a retry storm costs one download, one extraction
+and one db write per file.
+
+Each stage is timed as a span (src/utils/metrics.py), extraction, cleaning and inference are timed in the
+CPU worker and recorded when the result comes back.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy.orm import Session
+
+from src.data_models.tables import File as FileModel
+from src.settings import CASCADE_ENABLED, INFERENCE_BATCHING, SINGLE_FLIGHT_ENABLED, WRITE_BEHIND_ENABLED
+from src.utils.buffers import FileBuffer, RequestMemory
+from src.utils.cascade import TIER_HEAD, TIER_TEXT_LAYER, TierResult, get_cascade
+from src.utils.classification_cache import classification_cache
+from src.utils.executors import run_io, run_cpu
+from src.utils.inference_scheduler import inference_scheduler
+from src.utils.metrics import CACHE_LOOKUPS, CASCADE_DECISIONS, CLASSIFICATIONS, file_type_of, record_span, span
+from src.utils.single_flight import single_flight
+from src.utils.tasks import (
+    cascade_classify_task, cascade_ocr_task, cascade_text_layer_task, extract_and_classify_timed_task, extract_text_timed_task,
+)
+from src.utils.utils import download_file_buffer, update_file_classification
+from src.utils.write_behind import classification_writer
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ClassificationOutcome:
+    file_class: str
+    pages_read: int  # 0 when the class came from the cache
+    cached: bool
+    tier: Optional[int] = None  # cascade tier that decided, None for cache hits or with the cascade off
+
+
+async def classify_stored_file(
+    db: Session,
+    s3_client: "BaseClient",
+    bucket: str,
+    file_metadata: FileModel,
+    wait_for_persistence: bool = False,
+) -> ClassificationOutcome:
+    """
+    Classifies a file that is already in S3 and records the class on its files row.
+    Concurrent calls for the same file share one classification and get the same outcome.
+
+    Args:
+        db (Session): SQLAlchemy session to interact with the database.
+        s3_client (BaseClient): Boto3 S3 client used to download the file.
+        bucket (str): S3 bucket the file is stored in.
+        file_metadata (FileModel): files row of the file to classify.
+        wait_for_persistence (bool): only return once the class is committed to the db.
+
+    Returns:
+        ClassificationOutcome: the class, the number of pages read and whether it was a cache hit.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return await _classify_stored_file(db, s3_client, bucket, file_metadata, wait_for_persistence)
+
+    lease_key = f"{file_metadata.customerId}/{file_metadata.filename}"
+    # a call that waits for the db commit does not join one that returns before it
+    return await single_flight.do(
+        (lease_key, wait_for_persistence),
+        lambda: _classify_stored_file(db, s3_client, bucket, file_metadata, wait_for_persistence),
+        lease_key=lease_key,
+    )
+
+async def _classify_stored_file(
+    db: Session,
+    s3_client: "BaseClient",
+    bucket: str,
+    file_metadata: FileModel,
+    wait_for_persistence: bool = False,
+) -> ClassificationOutcome:
+    """
+    Classifies a file that is already in S3 and records the class on its files row, without coalescing.
+
+    Args:
+        db (Session): SQLAlchemy session to interact with the database.
+        s3_client (BaseClient): Boto3 S3 client used to download the file.
+        bucket (str): S3 bucket the file is stored in.
+        file_metadata (FileModel): files row of the file to classify.
+        wait_for_persistence (bool): only return once the class is committed to the db.
+
+    Returns:
+        ClassificationOutcome: the class, the number of pages read and whether it was a cache hit.
+    """
+    file_type = file_type_of(file_metadata.filename)
+
+    # the same document is often re-uploaded under another name, a cache hit skips extraction and inference
+    file_buffer: Optional[FileBuffer] = None
+    tier = None
+    async with RequestMemory() as request_memory:
+        try:
+            # hash was stored at upload time, so a cache hit skips the S3 download as well
+            if not file_metadata.contentHash:
+                # Fetch the file from S3 using the s3_path
+                with span("download", file_type):
+                    file_buffer = await download_file_buffer(
+                        s3_client, bucket, file_metadata.s3Path, request_memory, file_metadata.filename
+                    )
+            with span("cache_lookup", file_type):
+                content_hash = file_metadata.contentHash or await run_io(file_buffer.sha256)
+                model_version, cached = await run_io(classification_cache.lookup_hash, db, content_hash)
+            CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+
+            if cached is not None:
+                file_class = cached.file_class
+                pages_read = 0
+            else:
+                if file_buffer is None:
+                    with span("download", file_type):
+                        file_buffer = await download_file_buffer(
+                            s3_client, bucket, file_metadata.s3Path, request_memory, file_metadata.filename
+                        )
+                # the buffer rather than an open file so the work can be sent to a worker process, a spooled
+                # file is sent as its path and memory mapped by the worker
+                # PDFs are read page by page and stop early once the classification is confident
+                with span("extract_and_classify", file_type):
+                    if CASCADE_ENABLED and INFERENCE_BATCHING:
+                        # cheapest tier first, tier 1 shares one predict_proba with the concurrent requests
+                        text, file_class, pages_read, timings, tier = await _cascade_classify_batched(file_buffer, file_metadata.filename)
+                        CASCADE_DECISIONS.inc(tier=tier, file_class=file_class)
+                    elif CASCADE_ENABLED:
+                        # cheapest tier first, OCR only when the cheaper tiers are not confident
+                        text, file_class, pages_read, timings, tier = await run_cpu(cascade_classify_task, file_buffer, file_metadata.filename)
+                        CASCADE_DECISIONS.inc(tier=tier, file_class=file_class)
+                    elif INFERENCE_BATCHING:
+                        # extraction in the worker, then one predict_proba shared with the concurrent requests
+                        text, pages_read, timings = await run_cpu(extract_text_timed_task, file_buffer, file_metadata.filename)
+                        (file_class, _), inference_timings = await inference_scheduler.classify(text)
+                        timings.update(inference_timings)
+                    else:
+                        text, file_class, pages_read, timings = await run_cpu(extract_and_classify_timed_task, file_buffer, file_metadata.filename)
+                for stage, seconds in timings.items():
+                    record_span(stage, seconds, file_type)
+                # the cache is keyed on the main model, a head model decision (tier 0) also depends on the head
+                # model and the thresholds and its text is only the head of the document, so it is not cached
+                if tier != TIER_HEAD:
+                    await run_io(classification_cache.put, db, content_hash, model_version, text, file_class)
+        finally:
+            if file_buffer is not None:
+                file_buffer.close()
+    CLASSIFICATIONS.inc(file_type=file_type, file_class=file_class, source="cache" if cached is not None else "model")
+
+    # with write behind enabled this is a push onto an in process queue, a background flusher writes
+    # the queued results in bulk updates. wait_for_persistence holds the caller until the row is committed
+    with span("db_write", file_type):
+        if WRITE_BEHIND_ENABLED:
+            await classification_writer.submit_async(file_metadata.id, file_class, model_version, wait=wait_for_persistence)
+        else:
+            await run_io(update_file_classification, db, file_metadata, file_class, model_version)
+
+    return ClassificationOutcome(file_class=file_class, pages_read=pages_read, cached=cached is not None, tier=tier)
+
+# the cascade with tier 1 classified through the inference scheduler: tier 0 and the text layer extraction run
+# in the CPU worker, the text layer is classified in a batch with the concurrent requests, then OCR (tier 2)
+# runs in the worker only when that was not confident. Returns what cascade_classify_task returns
+async def _cascade_classify_batched(file_buffer: FileBuffer, filename: str) -> tuple[str, str, int, dict[str, float], int]:
+    cascade = get_cascade()
+    step, timings = await run_cpu(cascade_text_layer_task, file_buffer, filename)
+    results = step.results
+    decided = step.decided
+    if not decided and step.text is not None:
+        start = time.perf_counter()
+        (file_class, confidence), inference_timings = await inference_scheduler.classify(step.text)
+        timings["tier1"] = timings.get("tier1", 0.0) + time.perf_counter() - start
+        for stage, seconds in inference_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        result = TierResult(TIER_TEXT_LAYER, file_class, confidence, step.text, step.pages_read)
+        results.append(result)
+        decided = cascade.is_confident(result)
+    if not decided and step.ocr_could_help:
+        result, ocr_timings = await run_cpu(cascade_ocr_task, file_buffer, filename)
+        for stage, seconds in ocr_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        results.append(result)
+    result = cascade.decide(results)
+    return result.text, result.file_class, result.pages_read, timings, result.tier
@@ -0,0 +1,118 @@
+"""
+Execution layer that keeps blocking work off the asyncio event loop.
+
+- run_io sends blocking I/O (S3 get_object, DB queries and commits) to a thread pool
+- run_cpu sends CPU bound work (PDF parsing, OCR, text cleaning, model inference) to a process pool
+  whose workers load the model (and optionally the OCR readers) once when they start
+
+Both pools are created lazily and shut down with the app.
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.settings import IO_THREAD_WORKERS, CPU_EXECUTOR, CPU_WORKERS, CPU_MP_START_METHOD, MODEL_PRELOAD, OCR_WARM_ON_STARTUP
+
+logger = logging.getLogger(__name__)
+
+_io_executor = None
+_cpu_executor = None
+_lock = threading.Lock()
+
+
+# runs once in every process pool worker so the model and OCR readers are loaded once per worker not per task
+# when the worker was forked from a preloaded forkserver these are already loaded and shared, so this is a cache hit
+def _init_cpu_worker() -> None:
+    from src.classifier import load_model
+    load_model()
+
+    if OCR_WARM_ON_STARTUP:
+        from src.utils.ocr_pool import get_ocr_pool
+        get_ocr_pool().warm()
+
+
+class InlineExecutor(Executor):
+    """Executor that runs the function in the calling thread, used when CPU_EXECUTOR=inline."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    with _lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=IO_THREAD_WORKERS, thread_name_prefix="io")
+        return _io_executor
+
+
+# build a CPU executor of the given kind, also used by the backfill which sizes its own pool
+# with the forkserver start method and preload on, the forkserver loads the models once (src/utils/preload.py)
+# and every worker is forked from it, so the workers share the weights rather than loading a copy each
+def make_cpu_executor(kind: str = CPU_EXECUTOR, workers: int = CPU_WORKERS, start_method: str = CPU_MP_START_METHOD, preload: bool = MODEL_PRELOAD) -> Executor:
+    if kind == "process":
+        mp_context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver" and preload:
+            # only takes effect if the forkserver of this process has not been started yet
+            mp_context.set_forkserver_preload(["src.utils.forkserver_preload"])
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_cpu_worker,
+        )
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+    if kind == "inline":
+        return InlineExecutor()
+    raise ValueError(f"Unknown CPU_EXECUTOR: {kind}")
+
+
+def get_cpu_executor() -> Executor:
+    global _cpu_executor
+    with _lock:
+        if _cpu_executor is None:
+            _cpu_executor = make_cpu_executor()
+            logger.info(f"Started {CPU_EXECUTOR} CPU executor with {CPU_WORKERS} workers")
+        return _cpu_executor
+
+
+async def run_io(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking I/O call on the I/O thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_cpu(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run a CPU bound call on the CPU executor and await its result.
+    With the process executor func and args must be picklable, so pass raw bytes rather than open files.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), func, *args)
+
+
+def start_executors() -> None:
+    """Create both pools up front so the first request does not pay for it."""
+    get_io_executor()
+    get_cpu_executor()
+
+
+def shutdown_executors() -> None:
+    global _io_executor, _cpu_executor
+    with _lock:
+        if _cpu_executor is not None:
+            _cpu_executor.shutdown(wait=True, cancel_futures=True)
+            _cpu_executor = None
+        if _io_executor is not None:
+            _io_executor.shutdown(wait=True, cancel_futures=True)
+            _io_executor = None
@@ -1,9 +1,23 @@
-import easyocr
-import PyPDF2
-from docx import Document
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from typing import IO, TYPE_CHECKING, Iterator, Optional
+import logging
 import os
+import re
+import zipfile
+
+from src.utils.ocr_pool import OCRReaderPool, get_ocr_pool, preprocess_image
+from src.settings import (
+    DOCX_CHAR_BUDGET, DOCX_ENGINE, TXT_CHAR_BUDGET, PDF_PAGE_BUDGET, PDF_CHAR_BUDGET, PDF_MIN_TEXT_CHARS, PDF_OCR_ENABLED, PDF_OCR_PAGE_CAP, PDF_OCR_WORKERS,
+)
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# the parsing libraries (PyPDF2, python-docx, PIL and easyocr through the OCR pool) are imported inside the
+# extractors, so a library is only loaded the first time its file type is seen and importing the app stays cheap
 
 # Factory Base class for extracting text from different file types. 
 # Each Subclasses should override the `extract_text` method for respetive file format
@@ -13,39 +27,274 @@ class TextExtractor:
         """Extract text from the file bytes. This method should be overridden by subclasses."""
         raise NotImplementedError("Subclasses should implement this method.")
 
+    def iter_pages(self, file_bytes: BytesIO) -> Iterator[str]:
+        """
+        Yield the text a page at a time so callers can stop early.
+        File types without pages yield the whole text as a single page.
+        """
+        yield self.extract_text(file_bytes)
+
+    def extract_head(self, file_bytes: BytesIO, max_chars: int) -> str:
+        """
+        Cheap look at the start of the document for the first tier of the classification cascade.
+        Never runs OCR, file types whose text needs OCR return an empty head.
+        """
+        return self.extract_text(file_bytes)[:max_chars]
+
+# OCR an image with a reader borrowed from the pool, shared by image files and scanned PDF pages
+def ocr_image(image: "Image.Image", ocr_pool: Optional[OCRReaderPool] = None) -> str:
+    image = preprocess_image(image)  # grayscale and downscale before OCR
+
+    # borrow a long lived reader rather than loading the networks for every image
+    with (ocr_pool or get_ocr_pool()).reader() as reader:
+        result = reader.readtext(image)  # Perform OCR
+
+    # Extract the text from the OCR result
+    return " ".join([item[1] for item in result])
+
 class PDFTextExtractor(TextExtractor):
+    def __init__(
+        self,
+        max_pages: Optional[int] = PDF_PAGE_BUDGET,
+        max_chars: Optional[int] = PDF_CHAR_BUDGET,
+        ocr_page_cap: Optional[int] = PDF_OCR_PAGE_CAP,
+        ocr: bool = PDF_OCR_ENABLED,
+        ocr_workers: int = PDF_OCR_WORKERS,
+        min_text_chars: int = PDF_MIN_TEXT_CHARS,
+        ocr_pool: Optional[OCRReaderPool] = None,
+    ):
+        # budgets bound latency and memory by the budget rather than the size of the document, 0/None means no limit
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        # scanned pages (no text layer) are OCR'd unless ocr is False, at most ocr_page_cap of them (0/None means
+        # no limit, as for the budgets), ocr_workers at a time
+        self.ocr_page_cap = ocr_page_cap
+        self.ocr = ocr
+        self.ocr_workers = max(1, ocr_workers)
+        self.min_text_chars = min_text_chars
+        self.ocr_pool = ocr_pool
+        # pages of the last document read that had no usable text layer, whether or not they were OCR'd
+        self.scanned_pages = 0
+
+    def _needs_ocr(self, page_text: str) -> bool:
+        return len(page_text.strip()) < self.min_text_chars
+
+    # OCR the images on a page and merge them with whatever text layer the page has
+    # a scan is usually one image covering the page, the images are decoded from the PDF rather than
+    # rendering the page, so no rasterizer is needed
+    def _ocr_page(self, page, page_text: str) -> str:
+        from PIL import Image
+
+        try:
+            images = page.images
+        except Exception as e:
+            logger.warning(f"Could not read the images of a PDF page: {e}")
+            return page_text
+        ocr_texts = []
+        for image_file in images:
+            try:
+                ocr_texts.append(ocr_image(Image.open(BytesIO(image_file.data)), self.ocr_pool))
+            except Exception as e:
+                logger.warning(f"Could not OCR PDF page image {image_file.name}: {e}")
+        # newline terminated so words do not run together when the pages are joined
+        return "".join(f"{text}\n" for text in [page_text.strip(), *ocr_texts] if text)
+
+    # OCR a run of scanned pages, in parallel when there is more than one
+    def _ocr_pages(self, run: list[tuple[object, str]]) -> list[str]:
+        if len(run) == 1:
+            return [self._ocr_page(*run[0])]
+        with ThreadPoolExecutor(max_workers=min(self.ocr_workers, len(run)), thread_name_prefix="pdf-ocr") as executor:
+            return list(executor.map(lambda item: self._ocr_page(*item), run))
+
+    def _text_layer(self, file_bytes: BytesIO) -> Iterator[tuple[object, str]]:
+        import PyPDF2
+
+        pdf_reader = PyPDF2.PdfReader(file_bytes)  # pages are parsed lazily as they are accessed
+        for page_number, page in enumerate(pdf_reader.pages):
+            if self.max_pages and page_number >= self.max_pages:
+                return
+            yield page, page.extract_text() or ""
+
+    def _merged_pages(self, file_bytes: BytesIO) -> Iterator[str]:
+        """
+        Yield the text of each page, OCR'ing pages without a text layer.
+        Consecutive scanned pages are collected into runs of up to ocr_workers pages and OCR'd in parallel,
+        pages with a text layer never look at their images so digital PDFs cost what they did before.
+        """
+        pages = self._text_layer(file_bytes)
+        ocr_pages_left = self.ocr_page_cap or None  # None when there is no cap
+        self.scanned_pages = 0
+        carry = None
+        while True:
+            item = carry or next(pages, None)
+            carry = None
+            if item is None:
+                return
+            page, page_text = item
+            if not self._needs_ocr(page_text):
+                yield page_text
+                continue
+            self.scanned_pages += 1
+            if not self.ocr or ocr_pages_left == 0:
+                yield page_text
+                continue
+
+            run = [item]
+            run_size = self.ocr_workers if ocr_pages_left is None else min(self.ocr_workers, ocr_pages_left)
+            while len(run) < run_size:
+                item = next(pages, None)
+                if item is None:
+                    break
+                if not self._needs_ocr(item[1]):
+                    carry = item  # a digital page ends the run, it is yielded after the OCR'd pages
+                    break
+                self.scanned_pages += 1
+                run.append(item)
+            if ocr_pages_left is not None:
+                ocr_pages_left -= len(run)
+            yield from self._ocr_pages(run)
+
+    def iter_pages(self, file_bytes: BytesIO) -> Iterator[str]:
+        """Yield the text of each PDF page, stopping once the page or character budget is used up."""
+        chars = 0
+        for page_text in self._merged_pages(file_bytes):
+            if self.max_chars and chars + len(page_text) >= self.max_chars:
+                yield page_text[:self.max_chars - chars]
+                return
+            chars += len(page_text)
+            yield page_text
+
+    def extract_head(self, file_bytes: BytesIO, max_chars: int) -> str:
+        """Text layer of the first page only, no OCR."""
+        return PDFTextExtractor(max_pages=1, max_chars=max_chars, ocr=False).extract_text(file_bytes)
+
     def extract_text(self, file_bytes: BytesIO) -> str:
         """Extract text from a PDF file."""
-        text = ""
-        pdf_reader = PyPDF2.PdfReader(file_bytes)
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-        return text
+        # join once at the end rather than text += page which copies the string for every page
+        return "".join(self.iter_pages(file_bytes))
+
+# WordprocessingML elements read by the streaming DOCX engine
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_TEXT, _W_TAB, _W_RUN, _W_PARAGRAPH, _W_CELL, _W_ROW = (_W + tag for tag in ("t", "tab", "r", "p", "tc", "tr"))
+_W_BREAKS = {_W + "br", _W + "cr"}
+_W_TAGS = [_W_TEXT, _W_TAB, _W_PARAGRAPH, _W_CELL, _W_ROW, *_W_BREAKS]
+_HEADER_PART = re.compile(r"word/header(\d*)\.xml")
+_FOOTER_PART = re.compile(r"word/footer(\d*)\.xml")
+
+# header1.xml, header2.xml ... header10.xml in number order
+def _numbered_parts(names: list[str], pattern: re.Pattern) -> list[str]:
+    numbered = [(int(match.group(1) or 0), name) for name in names if (match := pattern.fullmatch(name))]
+    return [name for _, name in sorted(numbered)]
 
 class DocxTextExtractor(TextExtractor):
-    def extract_text(self, file_bytes: BytesIO) -> str:
-        """Extract text from a DOCX file."""
+    def __init__(self, engine: str = DOCX_ENGINE, max_chars: Optional[int] = DOCX_CHAR_BUDGET):
+        self.engine = engine
+        # stop reading once this many characters are extracted, 0/None means no limit
+        self.max_chars = max_chars
+
+    def _python_docx_text(self, file_bytes: BytesIO) -> str:
+        from docx import Document
+
         file_bytes.seek(0)
         doc = Document(file_bytes)
         return "\n".join([para.text for para in doc.paragraphs])
 
+    # text of one XML part, fragment by fragment as the parser reaches it
+    # paragraphs end with a newline, table cells with a tab and rows with a newline, so line items keep their columns
+    def _part_fragments(self, part: IO[bytes]) -> Iterator[str]:
+        # lxml comes with python-docx, it filters the elements in C so only the ones below reach Python
+        from lxml import etree
+
+        for _, element in etree.iterparse(part, events=("end",), tag=_W_TAGS, resolve_entities=False):
+            tag = element.tag
+            if tag == _W_TEXT:
+                if element.text:
+                    yield element.text
+                continue
+            if tag == _W_TAB or tag in _W_BREAKS:
+                if element.getparent().tag == _W_RUN:  # a w:tab outside a run is a tab stop definition
+                    yield "\t" if tag == _W_TAB else "\n"
+                continue
+
+            if tag == _W_CELL:
+                yield "\t"
+                continue
+            if tag == _W_PARAGRAPH:
+                yield " " if element.getparent().tag == _W_CELL else "\n"
+            else:  # end of a table row
+                yield "\n"
+            # drop finished paragraphs and rows so memory stays flat however long the document or table is
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def iter_fragments(self, file_bytes: BytesIO) -> Iterator[str]:
+        """
+        Stream the text of the headers, the body (tables included) and the footers straight from the zip.
+        Nothing is decompressed or parsed past the point where the caller stops iterating.
+        """
+        file_bytes.seek(0)
+        with zipfile.ZipFile(file_bytes) as archive:
+            names = archive.namelist()
+            parts = _numbered_parts(names, _HEADER_PART) + ["word/document.xml"] + _numbered_parts(names, _FOOTER_PART)
+            for name in parts:
+                with archive.open(name) as part:
+                    yield from self._part_fragments(part)
+
+    def _stream_text(self, file_bytes: BytesIO, max_chars: Optional[int]) -> str:
+        fragments, chars = [], 0
+        for fragment in self.iter_fragments(file_bytes):
+            if max_chars and chars + len(fragment) >= max_chars:
+                fragments.append(fragment[:max_chars - chars])
+                break
+            chars += len(fragment)
+            fragments.append(fragment)
+        return "".join(fragments)
+
+    def extract_text(self, file_bytes: BytesIO) -> str:
+        """Extract text from a DOCX file, up to the character budget."""
+        if self.engine == "python-docx":
+            text = self._python_docx_text(file_bytes)
+            return text[:self.max_chars] if self.max_chars else text
+        return self._stream_text(file_bytes, self.max_chars)
+
+    def extract_head(self, file_bytes: BytesIO, max_chars: int) -> str:
+        """Parse only as far as the first max_chars characters."""
+        if self.engine == "python-docx":
+            return self._python_docx_text(file_bytes)[:max_chars]
+        return self._stream_text(file_bytes, min(max_chars, self.max_chars or max_chars))
+
 class OCRTextExtractor(TextExtractor):
     def extract_text(self, file_bytes: BytesIO) -> str:
         """Extract text from an image file using OCR."""
-        reader = easyocr.Reader(['en'])
+        from PIL import Image
+
         image = Image.open(file_bytes)  # Open the image from bytes
-        result = reader.readtext(image)  # Perform OCR
+        return ocr_image(image)
 
-        # Extract the text from the OCR result
-        text = " ".join([item[1] for item in result])
-        return text
+    def extract_head(self, file_bytes: BytesIO, max_chars: int) -> str:
+        """Images have no text without OCR."""
+        return ""
 
 class TxtTextExtractor(TextExtractor):
-    def extract_text(self, file_bytes: BytesIO) -> str:
-        """Extract text from a TXT file."""
+    def __init__(self, max_chars: Optional[int] = TXT_CHAR_BUDGET):
+        # stop decoding once this many characters are read, 0/None means no limit
+        self.max_chars = max_chars
+
+    def _decode(self, file_bytes: BytesIO, max_chars: Optional[int]) -> str:
         file_bytes.seek(0)  # Ensure we're at the beginning of the file
-        text = file_bytes.read().decode('utf-8', errors='ignore')  # Decode the bytes to a string
-        return text
+        # a utf-8 character is at most 4 bytes, so only the bytes that can hold max_chars characters are read
+        data = file_bytes.read(max_chars * 4) if max_chars else file_bytes.read()
+        text = data.decode('utf-8', errors='ignore')  # Decode the bytes to a string
+        return text[:max_chars] if max_chars else text
+
+    def extract_text(self, file_bytes: BytesIO) -> str:
+        """Extract text from a TXT file, up to the character budget."""
+        return self._decode(file_bytes, self.max_chars)
+
+    def extract_head(self, file_bytes: BytesIO, max_chars: int) -> str:
+        """Decode only the first bytes."""
+        return self._decode(file_bytes, min(max_chars, self.max_chars or max_chars))
 
 # will need to extend each time new file type comes along etc
 def get_text_extractor(filename: str) -> TextExtractor:
@@ -0,0 +1,129 @@
+"""
+Listing and bulk lookup of a customer's files.
+
+- iter_files streams the files of one customer filtered by classification status, class and upload time, in id
+  order. It pages with a keyset (WHERE id > last id seen ORDER BY id LIMIT page size) rather than an offset, so
+  every page is a range scan of the (customerId, ..., id) indexes on the files table whatever its depth, and
+  each page is read in its own short session so a long listing never holds a transaction open
+- lookup_files matches many filenames of one customer with a few IN queries instead of one call per file
+
+Rows are read as plain column tuples, not ORM objects, and turned into dicts by file_to_dict.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.data_models.tables import File as FileModel
+from src.settings import FILE_LIST_PAGE_SIZE
+
+CLASSIFIED = "classified"
+UNCLASSIFIED = "unclassified"
+
+# filenames per IN query of the bulk lookup, well below the bound parameter limits of sqlite and postgres
+LOOKUP_CHUNK_SIZE = 500
+
+_COLUMNS = (
+    FileModel.id,
+    FileModel.filename,
+    FileModel.fileClassification,
+    FileModel.modelVersion,
+    FileModel.contentHash,
+    FileModel.sizeBytes,
+    FileModel.uploadedAt,
+)
+
+
+@dataclass
+class FileFilter:
+    status: Optional[str] = None  # CLASSIFIED, UNCLASSIFIED or None for both
+    file_class: Optional[str] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def apply(self, query):
+        if self.status == CLASSIFIED:
+            query = query.where(FileModel.fileClassification.is_not(None))
+        elif self.status == UNCLASSIFIED:
+            query = query.where(FileModel.fileClassification.is_(None))
+        if self.file_class is not None:
+            query = query.where(FileModel.fileClassification == self.file_class)
+        if self.uploaded_after is not None:
+            query = query.where(FileModel.uploadedAt >= self.uploaded_after)
+        if self.uploaded_before is not None:
+            query = query.where(FileModel.uploadedAt < self.uploaded_before)
+        return query
+
+
+def file_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "filename": row.filename,
+        "file_class": row.fileClassification,
+        "model_version": row.modelVersion,
+        "content_hash": row.contentHash,
+        "size_bytes": row.sizeBytes,
+        "uploaded_at": row.uploadedAt.isoformat() if row.uploadedAt else None,
+    }
+
+# one page of a customer's files with an id above after_id, in id order
+def files_page_query(customer_id: int, file_filter: FileFilter, after_id: int = 0, page_size: int = FILE_LIST_PAGE_SIZE):
+    query = select(*_COLUMNS).where(FileModel.customerId == customer_id, FileModel.id > after_id)
+    return file_filter.apply(query).order_by(FileModel.id).limit(page_size)
+
+def list_files_page(db: Session, customer_id: int, file_filter: FileFilter, after_id: int = 0, page_size: int = FILE_LIST_PAGE_SIZE) -> list:
+    return db.execute(files_page_query(customer_id, file_filter, after_id, page_size)).all()
+
+def iter_files(
+    session_factory: Callable[[], Session],
+    customer_id: int,
+    file_filter: FileFilter,
+    after_id: int = 0,
+    limit: Optional[int] = None,
+    page_size: int = FILE_LIST_PAGE_SIZE,
+) -> Iterator[dict]:
+    """
+    Yield the customer's files matching the filter in id order, one page in memory at a time.
+
+    Args:
+        session_factory (Callable): creates the session each page is read with.
+        customer_id (int): customer whose files are listed.
+        file_filter (FileFilter): classification status, class and upload time filters.
+        after_id (int): only files with a larger id, the id of the last file of a previous listing resumes it.
+        limit (int): stop after this many files, None for all of them.
+        page_size (int): rows read per query.
+
+    Returns:
+        Iterator[dict]: one dict per file (see file_to_dict).
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        with session_factory() as db:
+            rows = list_files_page(db, customer_id, file_filter, after_id, size)
+        for row in rows:
+            yield file_to_dict(row)
+        if len(rows) < size:
+            return
+        after_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+
+def lookup_files(db: Session, customer_id: int, filenames: list[str]) -> dict[str, dict]:
+    """Files of the customer with one of the filenames, keyed by filename. Filenames with no file are absent."""
+    found = {}
+    unique_filenames = list(dict.fromkeys(filenames))
+    for start in range(0, len(unique_filenames), LOOKUP_CHUNK_SIZE):
+        chunk = unique_filenames[start:start + LOOKUP_CHUNK_SIZE]
+        rows = db.execute(
+            select(*_COLUMNS)
+            .where(FileModel.customerId == customer_id, FileModel.filename.in_(chunk))
+            .order_by(FileModel.id)
+        ).all()
+        # keep the first row per filename to match get_file_metadata's .first() behaviour
+        for row in rows:
+            found.setdefault(row.filename, file_to_dict(row))
+    return found
@@ -0,0 +1,14 @@
+"""
+Imported once by the multiprocessing forkserver (see make_cpu_executor in src/utils/executors.py) so the models
+are loaded before any CPU worker is forked and every worker shares the loaded weights.
+"""
+
+import logging
+
+from src.utils.preload import preload_models
+
+try:
+    preload_models()
+except Exception as e:
+    # the forkserver must still start, the workers then load the models themselves
+    logging.getLogger(__name__).error(f"Error preloading models in the forkserver: {e}")
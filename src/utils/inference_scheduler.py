@@ -0,0 +1,126 @@
+"""
+Dynamic micro batching of model inference across concurrent requests.
+
+One predict_proba per request spends most of its time in the per call overhead of the model (vectorising and
+walking every tree of the forest for a single row), a batch of rows costs little more than one. The scheduler
+sits between the pipeline and the model:
+
+- classify(text) adds the text to the pending batch of the caller's event loop and awaits its result
+- when no batch is running the pending batch is flushed on the next turn of the loop, it only picks up the
+  texts that arrived at the same time, so an idle service adds no latency
+- while a batch is running texts collect for the next one, which is flushed when the running batch finishes,
+  when INFERENCE_BATCH_MAX_SIZE texts are waiting or INFERENCE_BATCH_WINDOW_MS after its first text arrived,
+  whichever comes first, so batching never adds more than the window to a request's latency
+- a flushed batch is classified with one classify_texts_task on the CPU executor and every caller's future
+  is resolved with its own row, an error fails every text of the batch
+
+The pipeline sends the text of every file through the scheduler, with the cascade off and for the cascade's
+tier 1 (the text layer), so both configurations batch their main model calls.
+
+classify_inference_batch_size and classify_inference_queue_wait_seconds (src/utils/metrics.py) record the
+size of every batch and how long each text waited for its batch to start.
+"""
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from src.settings import INFERENCE_BATCH_MAX_SIZE, INFERENCE_BATCH_WINDOW_MS
+from src.utils.executors import run_cpu
+from src.utils.metrics import INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_WAIT_SECONDS
+from src.utils.tasks import classify_texts_task
+
+# classifies a batch of texts, returns a (file class, confidence) per text and the timings of the batch
+BatchInference = Callable[[list[str]], Awaitable[tuple[list[tuple[str, float]], dict[str, float]]]]
+
+
+async def _classify_texts_on_cpu(texts: list[str]) -> tuple[list[tuple[str, float]], dict[str, float]]:
+    return await run_cpu(classify_texts_task, texts)
+
+
+@dataclass
+class _PendingText:
+    text: str
+    future: asyncio.Future
+    enqueued: float
+
+
+class InferenceScheduler:
+    """Collects texts from concurrent callers into batches, one batch being filled per event loop."""
+
+    def __init__(
+        self,
+        window_seconds: float = INFERENCE_BATCH_WINDOW_MS / 1000,
+        max_batch_size: int = INFERENCE_BATCH_MAX_SIZE,
+        infer: Optional[BatchInference] = None,
+    ):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self.infer = infer or _classify_texts_on_cpu
+        self._pending: dict[asyncio.AbstractEventLoop, list[_PendingText]] = {}
+        self._timers: dict[asyncio.AbstractEventLoop, asyncio.TimerHandle] = {}
+        self._running: dict[asyncio.AbstractEventLoop, int] = {}
+        self._lock = threading.Lock()
+
+    async def classify(self, text: str) -> tuple[tuple[str, float], dict[str, float]]:
+        """
+        Classify one text as part of a batch.
+
+        Returns:
+            ((file class, confidence), timings of the batch the text was classified in)
+        """
+        loop = asyncio.get_running_loop()
+        pending = _PendingText(text, loop.create_future(), time.perf_counter())
+        with self._lock:
+            batch = self._pending.setdefault(loop, [])
+            batch.append(pending)
+            full = len(batch) >= self.max_batch_size
+            if not full and len(batch) == 1:
+                delay = self.window_seconds if self._running.get(loop) else 0
+                self._timers[loop] = loop.call_later(delay, self._flush, loop)
+        if full:
+            self._flush(loop)
+        return await pending.future
+
+    # runs on the loop the batch belongs to: from its timer, from the caller that filled it or once the running batch finished
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            batch = self._pending.pop(loop, [])
+            timer = self._timers.pop(loop, None)
+            if batch:
+                self._running[loop] = self._running.get(loop, 0) + 1
+        if timer is not None:
+            timer.cancel()
+        if batch:
+            loop.create_task(self._run(loop, batch))
+
+    async def _run(self, loop: asyncio.AbstractEventLoop, batch: list[_PendingText]) -> None:
+        started = time.perf_counter()
+        INFERENCE_BATCH_SIZE.observe(len(batch))
+        for pending in batch:
+            INFERENCE_QUEUE_WAIT_SECONDS.observe(started - pending.enqueued)
+        try:
+            results, timings = await self.infer([pending.text for pending in batch])
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            for pending, result in zip(batch, results):
+                # a caller that gave up has a cancelled future
+                if not pending.future.done():
+                    pending.future.set_result((result, timings))
+        finally:
+            with self._lock:
+                self._running[loop] -= 1
+                if not self._running[loop]:
+                    del self._running[loop]
+                waiting = loop in self._pending
+            # the texts that collected while this batch ran go next
+            if waiting:
+                self._flush(loop)
+
+
+inference_scheduler = InferenceScheduler()
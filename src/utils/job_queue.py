@@ -0,0 +1,218 @@
+"""
+Pluggable queue backends for the asynchronous classification jobs.
+
+The interface follows SQS so an SQS backend can be dropped in later:
+- send puts a message on the queue
+- receive hands out up to max_messages visible messages with a fresh receipt handle and hides them for
+  visibility_timeout seconds, a message that is not deleted in that time is received again
+- delete acknowledges a message, change_visibility re-schedules it (used to retry with a backoff)
+- dead_letter moves a poison message to the dead letter queue
+
+Two backends ship with the app:
+- SQLiteQueueBackend keeps the messages in the queue_messages table of the app db so API processes and
+  standalone workers (python -m src.scripts.run_job_workers) share one queue
+- InMemoryQueueBackend keeps them in process, for tests and single process setups
+"""
+
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from src.data_models.tables import QueueMessage as QueueMessageModel
+from src.settings import JOB_QUEUE_BACKEND, JOB_QUEUE_NAME
+
+
+@dataclass
+class QueueMessage:
+    message_id: str
+    body: dict
+    receipt_handle: str
+    receive_count: int  # 1 on the first delivery
+
+
+class QueueBackend:
+    # Base class for queue backends, subclasses implement every method
+    def send(self, body: dict, delay_seconds: float = 0) -> str:
+        """Put a message on the queue, returns its message id."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    def receive(self, max_messages: int, visibility_timeout: float) -> list[QueueMessage]:
+        """Receive up to max_messages visible messages and hide them for visibility_timeout seconds."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    def delete(self, receipt_handle: str) -> None:
+        """Acknowledge a received message so it is never delivered again."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    def change_visibility(self, receipt_handle: str, visibility_timeout: float) -> None:
+        """Make a received message visible again after visibility_timeout seconds."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    def dead_letter(self, receipt_handle: str) -> None:
+        """Move a received message to the dead letter queue."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    def dead_letters(self) -> list[dict]:
+        """Bodies of the messages on the dead letter queue."""
+        raise NotImplementedError("Subclasses should implement this method.")
+
+
+class InMemoryQueueBackend(QueueBackend):
+    def __init__(self):
+        self._messages: dict[str, dict] = {}
+        self._dead: list[dict] = []
+        self._lock = threading.Lock()
+
+    def send(self, body: dict, delay_seconds: float = 0) -> str:
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self._messages[message_id] = {
+                "body": body, "visible_at": time.time() + delay_seconds, "receive_count": 0, "receipt_handle": None
+            }
+        return message_id
+
+    def receive(self, max_messages: int, visibility_timeout: float) -> list[QueueMessage]:
+        now = time.time()
+        received = []
+        with self._lock:
+            # dicts keep insertion order, so this is roughly first in first out
+            for message_id, message in self._messages.items():
+                if len(received) >= max_messages:
+                    break
+                if message["visible_at"] > now:
+                    continue
+                message["visible_at"] = now + visibility_timeout
+                message["receive_count"] += 1
+                message["receipt_handle"] = str(uuid.uuid4())
+                received.append(QueueMessage(message_id, message["body"], message["receipt_handle"], message["receive_count"]))
+        return received
+
+    def _find(self, receipt_handle: str) -> Optional[str]:
+        for message_id, message in self._messages.items():
+            if message["receipt_handle"] == receipt_handle:
+                return message_id
+        return None
+
+    def delete(self, receipt_handle: str) -> None:
+        with self._lock:
+            message_id = self._find(receipt_handle)
+            if message_id is not None:
+                del self._messages[message_id]
+
+    def change_visibility(self, receipt_handle: str, visibility_timeout: float) -> None:
+        with self._lock:
+            message_id = self._find(receipt_handle)
+            if message_id is not None:
+                self._messages[message_id]["visible_at"] = time.time() + visibility_timeout
+
+    def dead_letter(self, receipt_handle: str) -> None:
+        with self._lock:
+            message_id = self._find(receipt_handle)
+            if message_id is not None:
+                self._dead.append(self._messages.pop(message_id)["body"])
+
+    def dead_letters(self) -> list[dict]:
+        with self._lock:
+            return list(self._dead)
+
+
+class SQLiteQueueBackend(QueueBackend):
+    def __init__(self, session_factory: Callable[[], Session], queue_name: str = JOB_QUEUE_NAME):
+        self.session_factory = session_factory
+        self.queue_name = queue_name
+        self.dead_letter_queue_name = f"{queue_name}-dlq"
+
+    def send(self, body: dict, delay_seconds: float = 0) -> str:
+        with self.session_factory() as session:
+            message = QueueMessageModel(
+                queueName=self.queue_name, body=json.dumps(body), visibleAt=time.time() + delay_seconds, receiveCount=0
+            )
+            session.add(message)
+            session.commit()
+            return str(message.id)
+
+    def receive(self, max_messages: int, visibility_timeout: float) -> list[QueueMessage]:
+        now = time.time()
+        received = []
+        with self.session_factory() as session:
+            candidates = session.execute(
+                select(QueueMessageModel.id)
+                .where(QueueMessageModel.queueName == self.queue_name, QueueMessageModel.visibleAt <= now)
+                .order_by(QueueMessageModel.id)
+                .limit(max_messages)
+            ).scalars().all()
+            for message_id in candidates:
+                receipt_handle = str(uuid.uuid4())
+                # conditional update so two consumers (threads or processes) never claim the same message
+                claimed = session.execute(
+                    update(QueueMessageModel)
+                    .where(QueueMessageModel.id == message_id, QueueMessageModel.visibleAt <= now)
+                    .values(
+                        visibleAt=now + visibility_timeout,
+                        receiveCount=QueueMessageModel.receiveCount + 1,
+                        receiptHandle=receipt_handle,
+                    )
+                ).rowcount
+                session.commit()
+                if not claimed:
+                    continue
+                message = session.get(QueueMessageModel, message_id, populate_existing=True)
+                received.append(QueueMessage(str(message.id), json.loads(message.body), receipt_handle, message.receiveCount))
+        return received
+
+    def delete(self, receipt_handle: str) -> None:
+        with self.session_factory() as session:
+            session.execute(delete(QueueMessageModel).where(QueueMessageModel.receiptHandle == receipt_handle))
+            session.commit()
+
+    def change_visibility(self, receipt_handle: str, visibility_timeout: float) -> None:
+        with self.session_factory() as session:
+            session.execute(
+                update(QueueMessageModel)
+                .where(QueueMessageModel.receiptHandle == receipt_handle)
+                .values(visibleAt=time.time() + visibility_timeout)
+            )
+            session.commit()
+
+    def dead_letter(self, receipt_handle: str) -> None:
+        with self.session_factory() as session:
+            session.execute(
+                update(QueueMessageModel)
+                .where(QueueMessageModel.receiptHandle == receipt_handle)
+                .values(queueName=self.dead_letter_queue_name, receiptHandle=None)
+            )
+            session.commit()
+
+    def dead_letters(self) -> list[dict]:
+        with self.session_factory() as session:
+            bodies = session.execute(
+                select(QueueMessageModel.body)
+                .where(QueueMessageModel.queueName == self.dead_letter_queue_name)
+                .order_by(QueueMessageModel.id)
+            ).scalars().all()
+        return [json.loads(body) for body in bodies]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+# process wide queue backend picked by JOB_QUEUE_BACKEND
+def get_queue_backend() -> QueueBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if JOB_QUEUE_BACKEND == "memory":
+                    _backend = InMemoryQueueBackend()
+                elif JOB_QUEUE_BACKEND == "sqlite":
+                    from src.connectors.db_connector import SessionLocal
+                    _backend = SQLiteQueueBackend(SessionLocal)
+                else:
+                    raise ValueError(f"Unknown JOB_QUEUE_BACKEND {JOB_QUEUE_BACKEND}")
+    return _backend
@@ -0,0 +1,196 @@
+"""
+Asynchronous classification jobs.
+
+POST /classify_jobs stores a job row and puts a message on the job queue (see src/utils/job_queue.py) and
+returns the job id straight away. A JobWorkerPool pulls the messages and runs the same pipeline as
+/classify_file (classify_stored_file), clients poll GET /classify_jobs/{job_id} or give a callback_url that
+is POSTed the finished job.
+
+- a failed attempt is retried after JOB_RETRY_BACKOFF seconds (doubled per attempt) by pushing out the message visibility
+- a job whose worker dies is received again once JOB_VISIBILITY_TIMEOUT passes
+- after JOB_MAX_ATTEMPTS attempts the message is dead lettered and the job marked dead, so a poison file cannot
+  keep the workers busy
+- failures retrying cannot fix (file not in the db) fail the job straight away
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import TYPE_CHECKING, Callable, Optional
+
+import httpx
+from sqlalchemy.orm import Session
+
+from src.data_models.tables import ClassificationJob
+from src.errors import FileContentMismatch, JobNotRetryable
+from src.settings import (
+    JOB_CALLBACK_TIMEOUT,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETRY_BACKOFF,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_WORKERS,
+)
+from src.utils.classify_pipeline import classify_stored_file
+from src.utils.executors import run_io
+from src.utils.job_queue import QueueBackend, QueueMessage
+from src.utils.utils import get_file_metadata
+from src.validation.callback_url_validation import check_callback_host_addresses, check_callback_url
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_RETRYING = "retrying"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_DEAD = "dead"
+FINISHED_JOB_STATUSES = {JOB_SUCCEEDED, JOB_FAILED, JOB_DEAD}
+
+
+# store the job and enqueue it, the row is committed first so a worker never receives a job it cannot find
+def submit_job(db: Session, backend: QueueBackend, customer_id: int, filename: str, callback_url: Optional[str] = None) -> ClassificationJob:
+    job = ClassificationJob(
+        id=str(uuid.uuid4()), customerId=customer_id, filename=filename, status=JOB_QUEUED, attempts=0, callbackUrl=callback_url
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    backend.send({"job_id": job.id})
+    return job
+
+def get_job(db: Session, job_id: str) -> Optional[ClassificationJob]:
+    return db.get(ClassificationJob, job_id)
+
+def job_to_dict(job: ClassificationJob) -> dict:
+    return {
+        "job_id": job.id,
+        "customer_id": job.customerId,
+        "filename": job.filename,
+        "status": job.status,
+        "attempts": job.attempts,
+        "file_class": job.fileClassification,
+        "error": job.error,
+        "created_at": job.createdAt.isoformat() if job.createdAt else None,
+        "updated_at": job.updatedAt.isoformat() if job.updatedAt else None,
+    }
+
+# best effort POST of the finished job to its callback url, failures are logged and not retried
+# the url is checked again and its host resolved first (see src/validation/callback_url_validation.py), httpx
+# only speaks http(s) and redirects are not followed, so a callback cannot be bounced to another host
+def send_callback(callback_url: str, payload: dict, timeout: float = JOB_CALLBACK_TIMEOUT) -> None:
+    try:
+        check_callback_url(callback_url)
+        check_callback_host_addresses(callback_url)
+        response = httpx.post(callback_url, json=payload, timeout=timeout, follow_redirects=False)
+        response.raise_for_status()
+    except Exception as e:
+        logger.error(f"Error sending job callback to {callback_url}: {e}")
+
+
+class JobWorkerPool:
+    def __init__(
+        self,
+        backend: QueueBackend,
+        session_factory: Callable[[], Session],
+        s3_client_factory: Callable[[], "BaseClient"],
+        bucket: str,
+        workers: int = JOB_WORKERS,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_backoff: float = JOB_RETRY_BACKOFF,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.backend = backend
+        self.session_factory = session_factory
+        self.s3_client_factory = s3_client_factory
+        self.bucket = bucket
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self._tasks: list[asyncio.Task] = []
+
+    # workers are asyncio tasks, the blocking parts of a job run on the I/O and CPU executors
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker_loop(n)) for n in range(self.workers)]
+
+    # jobs cut short here are received again by a worker once their visibility timeout passes
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker_loop(self, worker_number: int) -> None:
+        while True:
+            try:
+                messages = await run_io(self.backend.receive, 1, self.visibility_timeout)
+                if not messages:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                for message in messages:
+                    await self.process(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_number} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, message: QueueMessage) -> None:
+        job_id = message.body["job_id"]
+        with self.session_factory() as db:
+            job = await run_io(get_job, db, job_id)
+            if job is None:
+                logger.error(f"Dropping message for unknown job {job_id}")
+                await run_io(self.backend.delete, message.receipt_handle)
+                return
+
+            # received again after its worker died max_attempts times, most likely the file kills the worker
+            if message.receive_count > self.max_attempts:
+                await self._finish(db, job, message, JOB_DEAD, error=job.error or "Job did not finish before its visibility timeout")
+                return
+
+            await run_io(self._update, db, job, status=JOB_RUNNING, attempts=message.receive_count)
+            try:
+                file_metadata = await run_io(get_file_metadata, db, job.customerId, job.filename)
+                if not file_metadata:
+                    raise JobNotRetryable(f"File {job.filename} not found for customer {job.customerId}")
+                # wait for the write behind so a succeeded job means the class is on the files row
+                outcome = await classify_stored_file(
+                    db, self.s3_client_factory(), self.bucket, file_metadata, wait_for_persistence=True
+                )
+            except (JobNotRetryable, FileContentMismatch) as e:
+                await self._finish(db, job, message, JOB_FAILED, error=e.msg)
+            except Exception as e:
+                logger.error(f"Error processing job {job_id} attempt {message.receive_count}: {e}")
+                db.rollback()
+                if message.receive_count >= self.max_attempts:
+                    await self._finish(db, job, message, JOB_DEAD, error=str(e))
+                else:
+                    await run_io(self._update, db, job, status=JOB_RETRYING, error=str(e))
+                    delay = self.retry_backoff * 2 ** (message.receive_count - 1)
+                    await run_io(self.backend.change_visibility, message.receipt_handle, delay)
+            else:
+                await self._finish(db, job, message, JOB_SUCCEEDED, file_class=outcome.file_class)
+
+    async def _finish(self, db: Session, job: ClassificationJob, message: QueueMessage, status: str, file_class: Optional[str] = None, error: Optional[str] = None) -> None:
+        await run_io(self._update, db, job, status=status, fileClassification=file_class, error=error)
+        if status == JOB_DEAD:
+            await run_io(self.backend.dead_letter, message.receipt_handle)
+        else:
+            await run_io(self.backend.delete, message.receipt_handle)
+        if job.callbackUrl:
+            await run_io(send_callback, job.callbackUrl, job_to_dict(job))
+
+    @staticmethod
+    def _update(db: Session, job: ClassificationJob, **values) -> None:
+        for key, value in values.items():
+            setattr(job, key, value)
+        db.commit()
+        db.refresh(job)
@@ -0,0 +1,353 @@
+"""
+Request timing spans and in process metrics, exposed in the Prometheus text format on /metrics.
+
+- Counter, Gauge and Histogram keep their values in plain dicts behind a lock, an observation is a dict lookup,
+  a bisect over the bucket bounds and two additions, so instrumenting the hot path costs microseconds
+- span("download") times a block of work into the classify_stage_seconds histogram and, inside a request,
+  adds it to the request's Server-Timing header (see TimingMiddleware)
+- record_span is for timings measured somewhere else, e.g. extraction and inference timed in a CPU worker
+  process and sent back with the result
+
+Each uvicorn worker process has its own registry. With METRICS_MULTIPROC_DIR set every process writes a
+snapshot of its registry to <dir>/metrics_<pid>.json every METRICS_SNAPSHOT_INTERVAL seconds and /metrics
+sums the snapshots of every process, so whichever worker answers the scrape reports the totals. Empty the
+directory when the deployment starts, snapshots of exited processes are kept so counters never go backwards.
+"""
+
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from src.settings import METRICS_ENABLED, METRICS_MULTIPROC_DIR, METRICS_SNAPSHOT_INTERVAL, SLOW_REQUEST_LOG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# latency buckets in seconds, from sub millisecond cache hits up to long OCR jobs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# label values are joined with this to key the JSON snapshots
+_KEY_SEP = "\x1f"
+
+
+def _label_key(label_names: tuple[str, ...], labels: dict) -> tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(label_names: tuple[str, ...], key: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_KEY_SEP.join(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(snapshots: list[dict]) -> dict:
+        merged = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values: dict) -> list[str]:
+        lines = []
+        for key, value in sorted(values.items()):
+            label_values = tuple(key.split(_KEY_SEP)) if self.label_names else ()
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. a queue depth. Summed over processes like a counter, a process that
+    exited keeps reporting its last value until its snapshot is removed."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative bucket histogram with a count and sum per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label key: [count per bucket (last one is +Inf), total count, sum]
+        self._values: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(_label_key(self.label_names, labels))
+            return entry[1] if entry else 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_KEY_SEP.join(key): [list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(snapshots: list[dict]) -> dict:
+        merged = {}
+        for snapshot in snapshots:
+            for key, (bucket_counts, count, total) in snapshot.items():
+                if key not in merged:
+                    merged[key] = [list(bucket_counts), count, total]
+                    continue
+                entry = merged[key]
+                entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+                entry[1] += count
+                entry[2] += total
+        return merged
+
+    def render(self, values: dict) -> list[str]:
+        lines = []
+        for key, (bucket_counts, count, total) in sorted(values.items()):
+            label_values = tuple(key.split(_KEY_SEP)) if self.label_names else ()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_value(total)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, multiproc_dir: Optional[str] = None, snapshot_interval: float = METRICS_SNAPSHOT_INTERVAL):
+        self.multiproc_dir = multiproc_dir
+        self.snapshot_interval = snapshot_interval
+        self._metrics: dict[str, object] = {}
+        self._snapshot_thread = None
+        self._stop = threading.Event()
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        return self._metrics.setdefault(name, Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, label_names, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics_{pid}.json")
+
+    # written to a temp file and renamed so a scrape never reads a half written snapshot
+    def write_snapshot(self) -> None:
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _read_snapshots(self) -> list[dict]:
+        # this process is read live, every other process from its last snapshot
+        snapshots = [self.snapshot()]
+        if not self.multiproc_dir:
+            return snapshots
+        own_path = self._snapshot_path(os.getpid())
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics_*.json")):
+            if path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+        return snapshots
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format, summed over all processes."""
+        snapshots = self._read_snapshots()
+        lines = []
+        for name, metric in self._metrics.items():
+            values = metric.merge([snapshot.get(name, {}) for snapshot in snapshots])
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Error writing metrics snapshot: {e}")
+
+    def start(self) -> None:
+        if not self.multiproc_dir or self._snapshot_thread is not None:
+            return
+        self._stop.clear()
+        self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def stop(self) -> None:
+        if self._snapshot_thread is None:
+            return
+        self._stop.set()
+        self._snapshot_thread.join()
+        self._snapshot_thread = None
+        self.write_snapshot()
+
+
+registry = MetricsRegistry(METRICS_MULTIPROC_DIR)
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+STAGE_SECONDS = registry.histogram("classify_stage_seconds", "Time spent in each classification stage", ("stage", "file_type"))
+STAGE_ERRORS = registry.counter("classify_stage_errors_total", "Errors raised in a classification stage", ("stage", "file_type", "kind"))
+CLASSIFICATIONS = registry.counter("classifications_total", "Files classified by file type, class and source (model or cache)", ("file_type", "file_class", "source"))
+CASCADE_DECISIONS = registry.counter("classify_cascade_decisions_total", "Classifications by the cascade tier that decided them", ("tier", "file_class"))
+CACHE_LOOKUPS = registry.counter("classification_cache_lookups_total", "Classification cache lookups by result", ("result",))
+SINGLE_FLIGHT_CALLS = registry.counter("classify_single_flight_total", "Classifications by single flight role: leader, coalesced (joined an in flight call) or lease_wait (waited on another worker)", ("role",))
+INFERENCE_BATCH_SIZE = registry.histogram("classify_inference_batch_size", "Texts per batched model call", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+INFERENCE_QUEUE_WAIT_SECONDS = registry.histogram("classify_inference_queue_wait_seconds", "Time a text waited for its inference batch to start")
+ADMISSION_DECISIONS = registry.counter("classify_admission_total", "Admission decisions by lane: admitted, queued, rejected_queue_full, rejected_customer_queue_full or timed_out", ("lane", "result"))
+ADMISSION_QUEUE_DEPTH = registry.gauge("classify_admission_queue_depth", "Requests waiting for admission by lane", ("lane",))
+ADMISSION_IN_FLIGHT_COST = registry.gauge("classify_admission_in_flight_cost", "Estimated cost of the admitted requests in flight by lane", ("lane",))
+ADMISSION_WAIT_SECONDS = registry.histogram("classify_admission_wait_seconds", "Time an admitted request waited in the admission queue", ("lane",))
+
+
+# timings of the request being served, None outside a request (e.g. job workers)
+_request_spans: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_spans", default=None)
+
+def file_type_of(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+def record_span(stage: str, seconds: float, file_type: str = "") -> None:
+    """Record a stage timing measured elsewhere, into the stage histogram and the current request's spans."""
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage, file_type=file_type)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage: str, file_type: str = "") -> Iterator[None]:
+    """Time the block as a stage, errors raised in it are counted by exception type and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if METRICS_ENABLED:
+            STAGE_ERRORS.inc(stage=stage, file_type=file_type, kind=type(e).__name__)
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - start, file_type)
+
+def server_timing_header(spans: list[tuple[str, float]], total: float) -> str:
+    # stages that run more than once in a request (e.g. per file in a batch) are summed
+    durations = {}
+    for stage, seconds in spans:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware timing every HTTP request.
+    Counts requests and observes their latency by route template (so /classify_jobs/{job_id} is one series),
+    collects the spans recorded while serving the request into a Server-Timing response header and logs
+    the spans of requests slower than SLOW_REQUEST_LOG_SECONDS.
+    """
+
+    def __init__(self, app, slow_request_seconds: float = SLOW_REQUEST_LOG_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                header = server_timing_header(spans, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_spans.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"  # raw paths would give a series per unknown url
+            HTTP_REQUESTS.inc(method=scope["method"], route=route_path, status=status_code)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route_path)
+            if elapsed >= self.slow_request_seconds:
+                logger.info(
+                    f"Slow request {scope['method']} {route_path} took {elapsed * 1000:.0f}ms",
+                    extra={"route": route_path, "duration_ms": elapsed * 1000, "spans": {stage: seconds * 1000 for stage, seconds in spans}},
+                )
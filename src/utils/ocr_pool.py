@@ -0,0 +1,87 @@
+"""
+Process wide pool of EasyOCR readers.
+
+Building an easyocr.Reader loads the detection and recognition networks from disk which takes seconds
+and hundreds of MB, so readers are built once and reused for every image.
+A reader is not safe to share between threads while it is running, so the pool hands out one reader
+per caller and blocks when all of them are busy. The pool size is set by OCR_POOL_SIZE.
+
+easyocr (and torch with it), numpy and PIL are imported on first use so importing the app stays cheap.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from queue import Queue
+from typing import TYPE_CHECKING, Iterator
+
+from src.settings import OCR_POOL_SIZE, OCR_MAX_DIMENSION, OCR_LANGUAGES, OCR_USE_GPU
+
+if TYPE_CHECKING:
+    import easyocr
+    import numpy as np
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class OCRReaderPool:
+    def __init__(self, size: int = OCR_POOL_SIZE, languages: list[str] = OCR_LANGUAGES, gpu: bool = OCR_USE_GPU):
+        if size < 1:
+            raise ValueError("OCR reader pool size must be at least 1")
+        self.size = size
+        self.languages = languages
+        self.gpu = gpu
+        self._readers: Queue = Queue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_reader(self) -> "easyocr.Reader":
+        import easyocr
+
+        logger.info(f"Loading EasyOCR reader {self._created + 1}/{self.size}")
+        return easyocr.Reader(self.languages, gpu=self.gpu)
+
+    def warm(self) -> None:
+        """Build every reader in the pool up front so no request pays the load cost."""
+        with self._lock:
+            while self._created < self.size:
+                self._readers.put(self._create_reader())
+                self._created += 1
+
+    @contextmanager
+    def reader(self) -> Iterator["easyocr.Reader"]:
+        """Borrow a reader from the pool, readers are built lazily up to the pool size."""
+        with self._lock:
+            if self._readers.empty() and self._created < self.size:
+                self._readers.put(self._create_reader())
+                self._created += 1
+        reader = self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put(reader)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# get the process wide pool, created on first use
+def get_ocr_pool() -> OCRReaderPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OCRReaderPool()
+    return _pool
+
+# convert to grayscale and shrink so the longest side is at most max_dimension
+# large phone photos are 4000px+ and OCR time grows with pixel count, text stays legible well below that
+def preprocess_image(image: "Image.Image", max_dimension: int = OCR_MAX_DIMENSION) -> "np.ndarray":
+    import numpy as np
+    from PIL import Image
+
+    image = image.convert("L")
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return np.asarray(image)
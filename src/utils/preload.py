@@ -0,0 +1,60 @@
+"""
+Load the model artifacts once in a parent process so the processes forked from it share the memory.
+
+Forked children share their parent's pages until either side writes to them (copy on write). The weights
+themselves (numpy arrays of the forest, torch tensors of the OCR networks) are never written after load,
+but the garbage collector writes to the header of every object it scans, which would copy the pages
+holding the Python objects into each child. gc.freeze() after loading moves everything loaded so far into
+a permanent generation the collector no longer scans, so those pages stay shared too.
+
+The CPU process pool uses this through the multiprocessing forkserver (see make_cpu_executor): the forkserver
+imports src.utils.forkserver_preload, which calls preload_models, and every CPU worker is forked from it.
+Compiled models (src/compiled_model.py) are also memory mapped read only (MODEL_MMAP), so their arrays are
+backed by the page cache and shared by every process on the node, however it was started.
+"""
+
+import gc
+import logging
+import os
+from typing import Optional
+
+from src.settings import HEAD_MODEL_PATH, OCR_WARM_ON_STARTUP
+
+logger = logging.getLogger(__name__)
+
+
+def preload_models(ocr: bool = OCR_WARM_ON_STARTUP) -> None:
+    """Load the main model, the cascade head model and optionally the OCR readers, then freeze the heap."""
+    from src.classifier import load_model
+    from src.head_model import load_head_model
+
+    load_model()
+    load_head_model(HEAD_MODEL_PATH)
+    if ocr:
+        from src.utils.ocr_pool import get_ocr_pool
+        get_ocr_pool().warm()
+
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded models in process {os.getpid()}, {gc.get_freeze_count()} objects frozen")
+
+# memory of a process in MB from /proc/<pid>/smaps_rollup (Linux)
+# rss counts shared pages in full, pss splits them between the processes sharing them and uss only counts
+# the pages private to the process, i.e. what the process costs on top of the others. Empty elsewhere.
+def process_memory(pid: Optional[int] = None) -> dict[str, float]:
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    kb = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):  # skips the address range header line
+                    kb[name.strip()] = int(value.split()[0])
+    except OSError:
+        return {}
+    private = kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)
+    return {
+        "rss_mb": round(kb.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(kb.get("Pss", 0) / 1024, 1),
+        "uss_mb": round(private / 1024, 1),
+    }
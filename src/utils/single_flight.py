@@ -0,0 +1,176 @@
+"""
+Coalescing of concurrent duplicate classifications (single flight).
+
+Clients retrying a slow /classify_file, or a retry storm after an outage, send the same file again while it
+is still being classified. Rather than running the download, OCR and db write once per request:
+
+- in process: the first call for a key starts the work as a task, calls for the same key made while it runs
+  await that task and get the same result (or the same error). The task is shielded, so a caller that gives up
+  does not cancel the work the others are waiting on, and a client retrying after a timeout joins the call
+  that is still running instead of starting another one
+- across worker processes (SINGLE_FLIGHT_LEASES): before doing the work the leader takes a lease on the key in
+  the classification_leases table and renews it while it works. A leader in another process that finds the
+  lease held polls until it is released (or SINGLE_FLIGHT_LEASE_WAIT_SECONDS pass) and then does the work,
+  which the holder's classification cache entry turns into a cache hit. A lease whose holder died expires after
+  SINGLE_FLIGHT_LEASE_TTL seconds and is taken over
+
+Calls only coalesce while one is in flight, nothing is kept once it finishes (the classification cache does that).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from src.connectors.db_connector import SessionLocal
+from src.data_models.tables import ClassificationLease
+from src.settings import (
+    SINGLE_FLIGHT_LEASE_POLL_SECONDS,
+    SINGLE_FLIGHT_LEASE_TTL,
+    SINGLE_FLIGHT_LEASE_WAIT_SECONDS,
+    SINGLE_FLIGHT_LEASES,
+)
+from src.utils.executors import run_io
+from src.utils.metrics import SINGLE_FLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LeaseTable:
+    """Expiring leases on keys in the classification_leases table, shared by every process using the db."""
+
+    def __init__(self, session_factory: Callable[[], Session], ttl: float = SINGLE_FLIGHT_LEASE_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+
+    def acquire(self, key: str, owner: str) -> bool:
+        now = time.time()
+        with self.session_factory() as session:
+            try:
+                session.add(ClassificationLease(key=key, owner=owner, expiresAt=now + self.ttl))
+                session.commit()
+                return True
+            except IntegrityError:
+                session.rollback()
+            # take over a lease its holder stopped renewing, e.g. the worker died
+            result = session.execute(
+                update(ClassificationLease)
+                .where(ClassificationLease.key == key, ClassificationLease.expiresAt < now)
+                .values(owner=owner, expiresAt=now + self.ttl)
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def renew(self, key: str, owner: str) -> bool:
+        with self.session_factory() as session:
+            result = session.execute(
+                update(ClassificationLease)
+                .where(ClassificationLease.key == key, ClassificationLease.owner == owner)
+                .values(expiresAt=time.time() + self.ttl)
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def release(self, key: str, owner: str) -> None:
+        with self.session_factory() as session:
+            session.execute(delete(ClassificationLease).where(ClassificationLease.key == key, ClassificationLease.owner == owner))
+            session.commit()
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time, concurrent calls with the same key share its result.
+    Calls are coalesced per event loop, a call from another loop runs on its own.
+    """
+
+    def __init__(
+        self,
+        leases: Optional[LeaseTable] = None,
+        poll_seconds: float = SINGLE_FLIGHT_LEASE_POLL_SECONDS,
+        wait_seconds: float = SINGLE_FLIGHT_LEASE_WAIT_SECONDS,
+    ):
+        self.leases = leases
+        self.poll_seconds = poll_seconds
+        self.wait_seconds = wait_seconds
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]], lease_key: Optional[str] = None) -> T:
+        """
+        Await func(), or the call already in flight for key.
+
+        Args:
+            key (Hashable): calls with equal keys are coalesced.
+            func (Callable): starts the work, only called by the leader.
+            lease_key (str): key of the cross process lease, no lease is taken when None or without a LeaseTable.
+
+        Returns:
+            the result of the call, shared by every caller.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._calls.get(key)
+            coalesced = task is not None and task.get_loop() is loop
+            if not coalesced:
+                task = loop.create_task(self._lead(func, lease_key))
+                self._calls[key] = task
+                task.add_done_callback(partial(self._forget, key))
+        SINGLE_FLIGHT_CALLS.inc(role="coalesced" if coalesced else "leader")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._calls.get(key) is task:
+                del self._calls[key]
+        # mark the error as retrieved, every caller may have given up on it
+        if not task.cancelled():
+            task.exception()
+
+    async def _lead(self, func: Callable[[], Awaitable[T]], lease_key: Optional[str]) -> T:
+        if self.leases is None or lease_key is None:
+            return await func()
+
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while not await run_io(self.leases.acquire, lease_key, owner):
+            if not waited:
+                SINGLE_FLIGHT_CALLS.inc(role="lease_wait")
+                waited = True
+            if time.monotonic() >= deadline:
+                # better to classify twice than to fail the request
+                logger.warning(f"Lease {lease_key} still held after {self.wait_seconds}s, classifying without it")
+                return await func()
+            await asyncio.sleep(self.poll_seconds)
+
+        renewer = asyncio.ensure_future(self._renew(lease_key, owner))
+        try:
+            return await func()
+        finally:
+            renewer.cancel()
+            await run_io(self.leases.release, lease_key, owner)
+
+    async def _renew(self, lease_key: str, owner: str) -> None:
+        while True:
+            await asyncio.sleep(self.leases.ttl / 3)
+            if not await run_io(self.leases.renew, lease_key, owner):
+                logger.warning(f"Lease {lease_key} was taken over by another worker")
+                return
+
+
+single_flight = SingleFlight(LeaseTable(SessionLocal) if SINGLE_FLIGHT_LEASES else None)
@@ -0,0 +1,242 @@
+"""
+Stream uploads straight into S3 without writing them to local disk.
+
+Chunks are appended to an in memory part buffer, each full part is sent with UploadPart on the I/O pool
+while the next part is being read. At most S3_MULTIPART_CONCURRENCY parts are in flight, so memory is
+bounded to (concurrency + 1) parts whatever the file size.
+The sha256 of the content is computed in the same pass. Files smaller than one part are sent with a single
+PutObject, and a failed multipart upload is aborted so no orphaned parts are left behind in the bucket.
+
+Multipart form uploads are parsed as the body arrives (MultipartFileReader) rather than through starlette's
+UploadFile, which spools anything past 1MB to a local temp file before the endpoint sees it.
+"""
+
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from src.errors import MultipartUploadError
+from src.settings import S3_MULTIPART_PART_SIZE, S3_MULTIPART_CONCURRENCY
+from src.utils.executors import run_io
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UploadResult:
+    s3_key: str
+    size: int
+    content_hash: str
+    parts: int
+
+
+class S3StreamingUploader:
+    def __init__(self, s3_client: "BaseClient", bucket: str, s3_key: str, part_size: int = S3_MULTIPART_PART_SIZE, concurrency: int = S3_MULTIPART_CONCURRENCY):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.s3_key = s3_key
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: list[dict] = []
+        self._in_flight: dict[int, asyncio.Future] = {}
+
+    async def write(self, chunk: bytes) -> None:
+        """Add a chunk of the file, sends a part to S3 each time a full part has been buffered."""
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        self._buffer += chunk
+        while len(self._buffer) >= self.part_size:
+            # copy the part out through a memoryview, slicing the bytearray first would copy it twice
+            with memoryview(self._buffer) as view:
+                part = bytes(view[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._send_part(part)
+
+    async def _send_part(self, part: bytes) -> None:
+        if self._upload_id is None:
+            response = await run_io(self.s3_client.create_multipart_upload, Bucket=self.bucket, Key=self.s3_key)
+            self._upload_id = response["UploadId"]
+        # backpressure, wait for a slot before reading any more of the stream
+        if len(self._in_flight) >= self.concurrency:
+            await self._wait_in_flight(first_only=True)
+        part_number = len(self._parts) + 1
+        self._parts.append({"PartNumber": part_number})
+        self._in_flight[part_number] = asyncio.ensure_future(run_io(
+            self.s3_client.upload_part,
+            Bucket=self.bucket, Key=self.s3_key, UploadId=self._upload_id, PartNumber=part_number, Body=part,
+        ))
+
+    async def _wait_in_flight(self, first_only: bool = False) -> None:
+        if not self._in_flight:
+            return
+        done, _ = await asyncio.wait(
+            self._in_flight.values(), return_when=asyncio.FIRST_COMPLETED if first_only else asyncio.ALL_COMPLETED
+        )
+        for part_number, future in list(self._in_flight.items()):
+            if future in done:
+                del self._in_flight[part_number]
+                self._parts[part_number - 1]["ETag"] = future.result()["ETag"]
+
+    async def complete(self) -> UploadResult:
+        """Flush the last part and finish the upload."""
+        if self._upload_id is None:
+            # the whole file fits in one part, a single PUT is cheaper than a multipart upload
+            await run_io(self.s3_client.put_object, Bucket=self.bucket, Key=self.s3_key, Body=bytes(self._buffer))
+            parts = 1
+        else:
+            if self._buffer:
+                await self._send_part(bytes(self._buffer))
+            await self._wait_in_flight()
+            await run_io(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket, Key=self.s3_key, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts},
+            )
+            parts = len(self._parts)
+        self._buffer = bytearray()
+        return UploadResult(s3_key=self.s3_key, size=self.size, content_hash=self._hash.hexdigest(), parts=parts)
+
+    async def abort(self) -> None:
+        """Abort the multipart upload so S3 drops the parts already sent."""
+        self._buffer = bytearray()
+        if self._in_flight:
+            await asyncio.wait(self._in_flight.values())
+            self._in_flight = {}
+        if self._upload_id is not None:
+            try:
+                await run_io(self.s3_client.abort_multipart_upload, Bucket=self.bucket, Key=self.s3_key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload {self._upload_id} for {self.s3_key}: {e}")
+
+
+async def stream_upload_to_s3(chunks: AsyncIterator[bytes], s3_client: "BaseClient", bucket: str, s3_key: str, part_size: int = S3_MULTIPART_PART_SIZE) -> UploadResult:
+    """
+    Upload an async stream of chunks to S3, aborting the upload if anything fails.
+
+    Args:
+        chunks (AsyncIterator[bytes]): the file content, e.g. request.stream() or MultipartFileReader.iter_file().
+        s3_client (BaseClient): Boto3 S3 client.
+        bucket (str): S3 bucket name.
+        s3_key (str): key/path of the file in s3.
+        part_size (int): size of each multipart part.
+
+    Returns:
+        UploadResult: key, size, sha256 of the content and number of parts.
+    """
+    uploader = S3StreamingUploader(s3_client, bucket, s3_key, part_size=part_size)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await uploader.write(chunk)
+        return await uploader.complete()
+    except BaseException:
+        await uploader.abort()
+        raise
+
+
+class MultipartFileReader:
+    """
+    Reads the file field of a multipart/form-data body chunk by chunk as the body arrives.
+    read_filename() parses up to the end of the file part's headers, iter_file() then yields its content,
+    only the chunk being parsed is held in memory. Other fields of the form are skipped.
+    """
+
+    def __init__(self, content_type: str, body: AsyncIterator[bytes], field_name: str = "file"):
+        media_type, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if media_type != b"multipart/form-data" or not boundary:
+            raise MultipartUploadError("Expected a multipart/form-data body")
+        self.field_name = field_name.encode()
+        self.filename: Optional[str] = None
+        self._body = body.__aiter__()
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_done = False
+        self._ended = False
+        self._pending: list[bytes] = []
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_end": self._on_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    # the first part with the field name and a filename is the file, the rest of the form is skipped
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        if self.filename is None and options.get(b"name") == self.field_name and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    def _on_end(self) -> None:
+        self._ended = True
+
+    # parse the next chunk of the body
+    async def _feed(self) -> None:
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            raise MultipartUploadError("Multipart body ended early") from None
+        try:
+            self._parser.write(chunk)
+        except FormParserError as e:
+            raise MultipartUploadError(f"Invalid multipart body: {e}") from None
+
+    async def read_filename(self) -> str:
+        """Parse the body up to the file part's headers and return its filename."""
+        while self.filename is None:
+            if self._ended:
+                raise MultipartUploadError(f"No file in form field '{self.field_name.decode()}'")
+            await self._feed()
+        return self.filename
+
+    async def iter_file(self) -> AsyncIterator[bytes]:
+        """Yield the content of the file part as it is parsed."""
+        await self.read_filename()
+        while True:
+            pending, self._pending = self._pending, []
+            for chunk in pending:
+                yield chunk
+            if self._file_done:
+                return
+            await self._feed()
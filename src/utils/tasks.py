@@ -0,0 +1,102 @@
+"""
+CPU bound tasks that run on the CPU executor (see src/utils/executors.py).
+
+Everything here takes and returns plain picklable values (bytes, str, lists) so the same functions
+can run in a process pool worker, a thread or inline. File content is raw bytes or a FileBuffer
+(src/utils/buffers.py), a spooled FileBuffer reaches a worker process as a path and is memory mapped there.
+"""
+
+import os
+import time
+from typing import Optional, Union
+
+from src.classifier import classify_files_ml, classify_pages_ml, load_model
+from src.settings import EARLY_EXIT_CONFIDENCE
+from src.utils.buffers import FileBuffer, open_content
+from src.utils.cascade import TextLayerStep, TierResult, get_cascade, timed_pages
+from src.utils.extract_text import extract_text_from_file, get_text_extractor
+from src.utils.preload import process_memory
+
+
+# extract the text from the raw file content
+def extract_text_task(file_content: Union[bytes, FileBuffer], filename: str) -> str:
+    with open_content(file_content) as file_bytes:
+        return extract_text_from_file(file_bytes, filename)
+
+# extract the text and classify it in one round trip to the worker
+# pages are classified as they are read and extraction stops once the model passes EARLY_EXIT_CONFIDENCE
+# the worker times its own stages, the seconds spent in extract, clean and inference are sent back with the result
+# returns (text read, file class, pages read, timings)
+def extract_and_classify_timed_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[str, str, int, dict[str, float]]:
+    timings = {}
+    start = time.perf_counter()
+    extractor = get_text_extractor(filename)
+    with open_content(file_content) as file_bytes:
+        pages = extractor.iter_pages(file_bytes)
+        timings["extract"] = time.perf_counter() - start
+        file_class, _, pages_read, text = classify_pages_ml(timed_pages(pages, timings), EARLY_EXIT_CONFIDENCE, timings)
+    return text, str(file_class), pages_read, timings
+
+# classify through the cascade (src/utils/cascade.py), cheapest tier first
+# returns (text read by the deciding tier, file class, pages read, timings, tier that decided)
+def cascade_classify_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[str, str, int, dict[str, float], int]:
+    timings = {}
+    result = get_cascade().classify(file_content, filename, timings)
+    return result.text, result.file_class, result.pages_read, timings, result.tier
+
+# tier 0 of the cascade and the text layer for tier 1, which the pipeline classifies through the batching scheduler
+# returns the TextLayerStep and timings
+def cascade_text_layer_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[TextLayerStep, dict[str, float]]:
+    timings = {}
+    return get_cascade().head_and_text_layer(file_content, filename, timings), timings
+
+# tier 2 of the cascade (OCR), returns the TierResult and timings
+def cascade_ocr_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[TierResult, dict[str, float]]:
+    timings = {}
+    start = time.perf_counter()
+    result = get_cascade().ocr_tier(file_content, filename, timings)
+    timings["tier2"] = time.perf_counter() - start
+    return result, timings
+
+# extract the text within the extraction budgets without classifying it, for inference through the batching
+# scheduler (src/utils/inference_scheduler.py). Returns (text, pages read, timings)
+def extract_text_timed_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[str, int, dict[str, float]]:
+    start = time.perf_counter()
+    with open_content(file_content) as file_bytes:
+        pages = list(get_text_extractor(filename).iter_pages(file_bytes))
+    return "".join(pages), len(pages), {"extract": time.perf_counter() - start}
+
+# classify a batch of texts with one predict_proba, returns a (file class, confidence) per text and the timings of the batch
+def classify_texts_task(texts: list[str]) -> tuple[list[tuple[str, float]], dict[str, float]]:
+    timings = {}
+    results = classify_files_ml(texts, timings)
+    return [(str(file_class), confidence) for file_class, confidence in results], timings
+
+# returns (text read, file class, pages read)
+def extract_and_classify_task(file_content: Union[bytes, FileBuffer], filename: str) -> tuple[str, str, int]:
+    text, file_class, pages_read, _ = extract_and_classify_timed_task(file_content, filename)
+    return text, file_class, pages_read
+
+# extract a chunk of files and classify them with one batched predict_proba, used by the backfill
+# a file that fails to extract gets an error instead of a class so one bad file does not fail the chunk
+# returns (text, file class, confidence, error) per file, in order
+def extract_and_classify_many_task(files: list[tuple[bytes, str]]) -> list[tuple[Optional[str], Optional[str], Optional[float], Optional[str]]]:
+    results = [(None, None, None, None)] * len(files)
+    texts = {}
+    for idx, (file_content, filename) in enumerate(files):
+        try:
+            texts[idx] = extract_text_task(file_content, filename)
+        except Exception as e:
+            results[idx] = (None, None, None, f"Error extracting text: {e}")
+
+    for idx, (file_class, confidence) in zip(texts.keys(), classify_files_ml(list(texts.values()))):
+        results[idx] = (texts[idx], str(file_class), confidence, None)
+    return results
+
+# load the model in the worker running this task, used by the readiness check at startup
+def warm_worker_task() -> None:
+    load_model()
+
+# pid and memory of the worker running this task (see process_memory), logged once the workers are warm
+def worker_memory_task() -> tuple[int, dict[str, float]]:
+    return os.getpid(), process_memory()
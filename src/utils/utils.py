@@ -1,16 +1,23 @@
 import functools
 import logging
-from typing import Any, Callable
+from typing import TYPE_CHECKING, Any, Callable, Optional
 import asyncio
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
-from botocore.exceptions import ClientError
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
-from botocore.client import BaseClient
 from io import BytesIO
 
-from src.errors import FileExtensionNotSupported
+from src.connectors.s3_connector import get_object_range
+from src.errors import FileExtensionNotSupported, MemoryBudgetExceeded
 from src.data_models.tables import File as FileModel
+from src.settings import FILE_SNIFF_BYTES
+from src.utils.buffers import FileBuffer, RequestMemory
+from src.utils.executors import run_io
+from src.validation.file_type_validation import check_file_content
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -41,7 +48,8 @@ def logging_decorator(func: Callable[..., Any]) -> Callable[..., Any]:
             logger.exception(
                 f"HTTPException raised in {func.__name__}: {http_exc.detail} (status code: {http_exc.status_code})"
             )
-            return JSONResponse(status_code=http_exc.status_code, content={"message": http_exc.detail})
+            # keep the exception's headers, e.g. Retry-After on a 429
+            return JSONResponse(status_code=http_exc.status_code, content={"message": http_exc.detail}, headers=http_exc.headers)
 
         except Exception as e:
             # Log the unexpected error and provide a generic response
@@ -50,24 +58,55 @@ def logging_decorator(func: Callable[..., Any]) -> Callable[..., Any]:
 
     return wrapper
 
-# download s3 file and then return Bytes object
-def download_file_return_bytes(s3_connection: BaseClient, bucket: str, s3_path: str) -> bytes:
+# open an s3 object, returns its streaming body (not read yet) and its size from the response headers
+def get_s3_object_body(s3_connection: "BaseClient", bucket: str, s3_path: str) -> tuple[Any, int]:
+    from botocore.exceptions import ClientError
+
     try:
         s3_object = s3_connection.get_object(Bucket=bucket, Key=s3_path)
-        file_content =  s3_object["Body"].read()
-        file_bytes = BytesIO(file_content)
-        return file_bytes
-    except s3_connection.s3.exceptions.NoSuchKey:
+        return s3_object["Body"], s3_object["ContentLength"]
+    except s3_connection.exceptions.NoSuchKey:
         raise FileNotFoundError(f"File '{s3_path}' not found in S3")
     except ClientError as e:
         raise Exception(f"Error accessing S3: {e}")
 
+# download s3 file and then return Bytes object
+# BytesIO shares the bytes read from the body rather than copying them, bounded memory downloads go
+# through download_file_buffer in src/utils/buffers.py
+def download_file_return_bytes(s3_connection: "BaseClient", bucket: str, s3_path: str) -> BytesIO:
+    body, _ = get_s3_object_body(s3_connection, bucket, s3_path)
+    return BytesIO(body.read())
+
+# fetch the first FILE_SNIFF_BYTES of an s3 file with a ranged GET and check them against the file's extension
+def sniff_s3_file(s3_connection: "BaseClient", bucket: str, s3_path: str, filename: str) -> None:
+    head = get_object_range(s3_connection, bucket, s3_path, 0, FILE_SNIFF_BYTES - 1)
+    check_file_content(filename, head)
+
+# download s3 file into a FileBuffer within the request's memory budget (see src/utils/buffers.py)
+# the size comes from the response headers so the file is admitted, spooled or rejected before its body is read
+# with a filename the start of the file is sniffed first, so a file that is not what its extension says
+# raises FileContentMismatch before any memory is reserved for it or its body is downloaded
+async def download_file_buffer(
+    s3_connection: "BaseClient", bucket: str, s3_path: str, request_memory: RequestMemory, filename: Optional[str] = None
+) -> FileBuffer:
+    if filename is not None and FILE_SNIFF_BYTES > 0:
+        await run_io(sniff_s3_file, s3_connection, bucket, s3_path, filename)
+    body, size = await run_io(get_s3_object_body, s3_connection, bucket, s3_path)
+    try:
+        in_memory = await request_memory.admit(size)
+    except MemoryBudgetExceeded:
+        body.close()
+        raise
+    return await run_io(FileBuffer.from_stream, body, not in_memory)
+
 # add the classification back to the file item in the db
 # prod circumstances this would not be a direct push, but a push to a queue and then a worker of the queue will do this as to not spam the DB
-def update_file_classification(db: Session, file_metadata: FileModel, file_class: str) -> None:
+def update_file_classification(db: Session, file_metadata: FileModel, file_class: str, model_version: Optional[str] = None) -> None:
     try:
         # Update the file classification in the database
         file_metadata.fileClassification = file_class  # Set the classification
+        if model_version is not None:
+            file_metadata.modelVersion = model_version
 
         # Commit the changes to the database
         db.commit()
@@ -88,4 +127,40 @@ def get_file_metadata(db: Session, customer_id: int, filename: str) -> FileModel
         FileModel.filename == filename
     ).first()
     
-    return file_metadata
\ No newline at end of file
+    return file_metadata
+
+# pull the file objects for many (customer_id, filename) pairs with a single query
+# returns a dict keyed by (customer_id, filename), pairs with no row in the db are simply absent
+def get_files_metadata(db: Session, pairs: list[tuple[int, str]]) -> dict[tuple[int, str], FileModel]:
+    unique_pairs = list(set(pairs))
+    if not unique_pairs:
+        return {}
+
+    files = db.query(FileModel).filter(
+        tuple_(FileModel.customerId, FileModel.filename).in_(unique_pairs)
+    ).all()
+
+    # keep the first row per pair to match get_file_metadata's .first() behaviour
+    files_metadata = {}
+    for file_metadata in sorted(files, key=lambda f: f.id):
+        files_metadata.setdefault((file_metadata.customerId, file_metadata.filename), file_metadata)
+    return files_metadata
+
+# add the classifications for many files back to the db in one commit rather than one commit per file
+def update_files_classification(db: Session, classifications: list[tuple[FileModel, str]], model_version: Optional[str] = None) -> None:
+    if not classifications:
+        return
+
+    try:
+        for file_metadata, file_class in classifications:
+            file_metadata.fileClassification = file_class
+            if model_version is not None:
+                file_metadata.modelVersion = model_version
+
+        db.commit()
+        logging.info(f"File classification updated for {len(classifications)} files")
+
+    except Exception as e:
+        logging.error(f"Error updating file classification for {len(classifications)} files: {str(e)}")
+        db.rollback()  # Rollback in case of error
+        raise Exception(f"Failed to update file classification for {len(classifications)} files")
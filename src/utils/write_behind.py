@@ -0,0 +1,193 @@
+"""
+Write behind persistence of classification results.
+
+Instead of a commit and refresh per classified file on the request path, results go into a bounded in process
+queue and a background thread writes them to the files table in bulk UPDATE (executemany) batches, flushing
+when WRITE_BEHIND_BATCH_SIZE results are queued or the oldest one has waited WRITE_BEHIND_FLUSH_INTERVAL seconds.
+
+- backpressure: callers block for up to WRITE_BEHIND_PUT_TIMEOUT when the queue is full, then WriteBehindQueueFull
+- durability: every submit returns a future resolved once its batch is committed, callers that need
+  read-your-write wait on it
+- shutdown: stop() drains and flushes whatever is queued
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from src.connectors.db_connector import SessionLocal
+from src.data_models.tables import File as FileModel
+from src.errors import WriteBehindQueueFull
+from src.settings import (
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_MAX_QUEUE,
+    WRITE_BEHIND_PUT_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+@dataclass
+class _PendingWrite:
+    file_id: int
+    file_class: str
+    model_version: Optional[str]
+    future: Future
+
+
+class ClassificationWriter:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+        put_timeout: float = WRITE_BEHIND_PUT_TIMEOUT,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "written": 0, "flushes": 0, "failed": 0, "rejected": 0}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="classification-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush everything still queued and stop the flusher thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, file_id: int, file_class: str, model_version: Optional[str] = None, block: bool = True) -> Future:
+        """
+        Queue a classification to be written, returns a future resolved once it is committed.
+        Blocks up to put_timeout when the queue is full and then raises WriteBehindQueueFull.
+        """
+        self.start()
+        pending = _PendingWrite(file_id, file_class, model_version, Future())
+        try:
+            self._queue.put(pending, block=block, timeout=self.put_timeout if block else None)
+        except queue.Full:
+            self._stats["rejected"] += 1
+            raise WriteBehindQueueFull()
+        self._stats["submitted"] += 1
+        return pending.future
+
+    async def submit_async(self, file_id: int, file_class: str, model_version: Optional[str] = None, wait: bool = False) -> None:
+        """
+        Queue a classification from the event loop without blocking it.
+        wait=True returns only once the write is committed (read-your-write).
+        """
+        try:
+            future = self.submit(file_id, file_class, model_version, block=False)
+        except WriteBehindQueueFull:
+            # queue full, wait for space off the event loop so backpressure does not stall other requests
+            from src.utils.executors import run_io
+            future = await run_io(self.submit, file_id, file_class, model_version)
+        if wait:
+            await asyncio.wrap_future(future)
+
+    def submit_many(self, classifications: list[tuple[int, str]], model_version: Optional[str] = None) -> list[Future]:
+        return [self.submit(file_id, file_class, model_version) for file_id, file_class in classifications]
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until everything queued so far has been written."""
+        marker = self.submit(-1, "")
+        marker.result(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is _STOP:
+                stopping = True
+                batch = []
+            else:
+                batch = [first]
+            # keep collecting until the batch is full or the oldest item has waited flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = 0 if stopping else deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    continue
+                batch.append(item)
+            if batch:
+                self._write(batch)
+        # drain anything submitted while stopping
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            self._write(leftover[start:start + self.batch_size])
+
+    def _write(self, batch: list[_PendingWrite]) -> None:
+        # last write wins when the same file is classified twice in one batch, id -1 is the flush marker
+        rows = {}
+        for pending in batch:
+            if pending.file_id >= 0:
+                rows[pending.file_id] = (pending.file_class, pending.model_version)
+        try:
+            if rows:
+                with self.session_factory() as session:
+                    # one executemany UPDATE ... WHERE id = ? per set of columns, usually just one for the whole batch
+                    with_version = [
+                        {"id": file_id, "fileClassification": file_class, "modelVersion": model_version}
+                        for file_id, (file_class, model_version) in rows.items() if model_version is not None
+                    ]
+                    without_version = [
+                        {"id": file_id, "fileClassification": file_class}
+                        for file_id, (file_class, model_version) in rows.items() if model_version is None
+                    ]
+                    for params in (with_version, without_version):
+                        if params:
+                            session.execute(update(FileModel), params)
+                    session.commit()
+            self._stats["written"] += len(rows)
+            self._stats["flushes"] += 1
+            for pending in batch:
+                pending.future.set_result(None)
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} file classifications: {e}")
+            self._stats["failed"] += len(rows)
+            for pending in batch:
+                pending.future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {**self._stats, "queued": self._queue.qsize()}
+
+
+# process wide writer, the flusher thread is started on first submit or at app startup
+classification_writer = ClassificationWriter(SessionLocal)
@@ -0,0 +1,57 @@
+import ipaddress
+import socket
+from typing import Optional
+from urllib.parse import urlsplit
+
+from src.errors import CallbackUrlNotAllowed
+from src.settings import JOB_CALLBACK_ALLOW_PRIVATE, JOB_CALLBACK_ALLOWED_HOSTS
+
+ALLOWED_SCHEMES = ("http", "https")
+
+
+# callback urls are POSTed by the job workers from inside the network, so they may only point at public
+# http(s) hosts (and only at JOB_CALLBACK_ALLOWED_HOSTS when set), never at the app's own network or the
+# cloud metadata endpoint
+def check_callback_url(url: str, allowed_hosts: Optional[list[str]] = None, allow_private: Optional[bool] = None) -> str:
+    allowed_hosts = JOB_CALLBACK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    allow_private = JOB_CALLBACK_ALLOW_PRIVATE if allow_private is None else allow_private
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ALLOWED_SCHEMES:
+        raise CallbackUrlNotAllowed("Callback url must be http or https")
+    host = (parts.hostname or "").lower().rstrip(".")
+    if not host:
+        raise CallbackUrlNotAllowed("Callback url has no host")
+    if allowed_hosts and not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in allowed_hosts):
+        raise CallbackUrlNotAllowed(f"Callback host {host} is not allowed")
+    if not allow_private:
+        if host == "localhost" or host.endswith(".localhost"):
+            raise CallbackUrlNotAllowed(f"Callback host {host} is not a public address")
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            address = None  # a name, its addresses are checked when the callback is sent
+        if address is not None:
+            _check_address(address)
+    return url
+
+
+# resolve the host of a callback url and check every address it resolves to is public, run right before the POST
+# so a name that pointed at a public address when the job was submitted cannot be moved to a private one
+def check_callback_host_addresses(url: str, allow_private: Optional[bool] = None) -> None:
+    if JOB_CALLBACK_ALLOW_PRIVATE if allow_private is None else allow_private:
+        return
+    parts = urlsplit(url)
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise CallbackUrlNotAllowed(f"Callback host {parts.hostname} does not resolve: {e}")
+    for info in infos:
+        _check_address(ipaddress.ip_address(info[4][0].split("%", 1)[0]))
+
+
+def _check_address(address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> None:
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    # is_global is false for private, loopback, link-local (incl. 169.254.169.254), shared and reserved ranges
+    if not address.is_global or address.is_multicast:
+        raise CallbackUrlNotAllowed(f"Callback address {address} is not a public address")
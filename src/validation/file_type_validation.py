@@ -1,5 +1,13 @@
 from src.settings import ALLOWED_EXTENSIONS
-from src.errors import FileExtensionNotSupported
+from src.errors import FileContentMismatch, FileExtensionNotSupported
+
+# signatures a file with each extension has to start with, PDFs may have junk before the header so theirs is
+# searched for in the first bytes. txt has no signature and is never rejected
+FILE_SIGNATURES = {
+    'pdf': b"%PDF-",
+    'jpg': b"\xff\xd8\xff",
+    'docx': b"PK\x03\x04",
+}
 
 # Allowed file extensions
 # this is a limiting factor
@@ -10,3 +18,13 @@ def allowed_file(filename: str) -> bool:
         return True
     else:
         raise FileExtensionNotSupported("File type not supported")
+
+# check the first bytes of a file against the signature of its extension
+def check_file_content(filename: str, head: bytes) -> None:
+    extension = filename.rsplit('.', 1)[-1].lower()
+    signature = FILE_SIGNATURES.get(extension)
+    if signature is None:
+        return
+    found = signature in head if extension == 'pdf' else head.startswith(signature)
+    if not found:
+        raise FileContentMismatch(f"File {filename} is not a valid {extension} file")
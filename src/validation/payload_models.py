@@ -1,9 +1,42 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field, HttpUrl, field_validator
+
+from src.settings import FILE_LOOKUP_MAX_FILENAMES, MAX_BATCH_SIZE
+from src.validation.callback_url_validation import check_callback_url
 
 class ClassifyFileRequest(BaseModel):
     filename: str
     customer_id: int
+    # only respond once the classification is committed to the db (read-your-write with write behind enabled)
+    wait_for_persistence: bool = False
 
 class ClassifyFileResponse(BaseModel):
     message: str
-    data: dict
\ No newline at end of file
+    data: dict
+
+# batch of files to classify in one call, capped at MAX_BATCH_SIZE items
+class ClassifyBatchRequest(BaseModel):
+    items: list[ClassifyFileRequest] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+class ClassifyBatchResponse(BaseModel):
+    message: str
+    data: dict
+
+# asynchronous classification job, callback_url is POSTed the job once it has finished
+# it must be a public http(s) url, see check_callback_url
+class ClassifyJobRequest(BaseModel):
+    filename: str
+    customer_id: int
+    callback_url: Optional[HttpUrl] = None
+
+    @field_validator("callback_url")
+    @classmethod
+    def callback_url_allowed(cls, callback_url: Optional[HttpUrl]) -> Optional[HttpUrl]:
+        if callback_url is not None:
+            check_callback_url(str(callback_url))
+        return callback_url
+
+# filenames of one customer to look up in one call, capped at FILE_LOOKUP_MAX_FILENAMES
+class FileLookupRequest(BaseModel):
+    filenames: list[str] = Field(min_length=1, max_length=FILE_LOOKUP_MAX_FILENAMES)
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import MagicMock
+
+from src.data_models.tables import File as FileModel
+from src.errors import AdmissionRejected
+from src.fastapi_app import app
+from src.utils.admission import CHEAP, EXPENSIVE, AdmissionController, Lane
+from src.utils.metrics import ADMISSION_DECISIONS
+
+
+def _controller(capacity: float = 2, max_queue: int = 8, max_queue_per_customer: int = 4, wait_seconds: float = 1.0) -> AdmissionController:
+    return AdmissionController(enabled=True, costs={"txt": 1, "pdf": 5, "jpg": 100}, expensive_cost=20, lanes={
+        CHEAP: Lane(CHEAP, capacity, max_queue, max_queue_per_customer, wait_seconds),
+        EXPENSIVE: Lane(EXPENSIVE, 100, max_queue, max_queue_per_customer, wait_seconds),
+    })
+
+# cost from the file type and size, images and large files go in the expensive lane
+def test_costs_and_lanes():
+    controller = _controller()
+    assert controller.estimate_cost("a.txt") == 1 and controller.estimate_cost("a.TXT", 512) == 1
+    assert controller.estimate_cost("a.pdf", 8 * 1024 * 1024) == 40
+    assert controller.lane_for([controller.estimate_cost("a.txt"), controller.estimate_cost("a.pdf")]).name == CHEAP
+    assert controller.lane_for([controller.estimate_cost("scan.jpg")]).name == EXPENSIVE
+    assert controller.lane_for([controller.estimate_cost("big.pdf", 8 * 1024 * 1024)]).name == EXPENSIVE
+
+# when room frees up the customer with the least in flight goes first, not the one with the longest backlog
+def test_waiting_customers_share_the_lane_fairly():
+    controller = _controller(capacity=2)
+    order = []
+
+    async def request(customer_id, name, release: asyncio.Event):
+        async with controller.admit(customer_id, [1]):
+            order.append(name)
+            await release.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(request(1, f"bulk_{i}", release)) for i in range(5)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(request(2, "other", release)))
+        await asyncio.sleep(0.01)
+        assert order == ["bulk_0", "bulk_1"] and controller.lanes[CHEAP].queued == 4
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order[:3] == ["bulk_0", "bulk_1", "other"]
+    assert controller.stats()[CHEAP] == {
+        "capacity": 2, "in_flight_cost": 0.0, "queued": 0, "queued_cost": 0.0, "customers_in_flight": 0, "customers_queued": 0,
+    }
+
+# a full queue, a full customer queue and a wait past the timeout are rejected with a retry after
+def test_saturated_lane_rejects():
+    controller = _controller(capacity=1, max_queue=2, max_queue_per_customer=1, wait_seconds=0.05)
+    rejected_before = ADMISSION_DECISIONS.value(lane=CHEAP, result="rejected_customer_queue_full")
+
+    async def hold(customer_id, release: asyncio.Event):
+        async with controller.admit(customer_id, [1]):
+            await release.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(1, release))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(hold(1, release)), asyncio.create_task(hold(2, release))]
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as customer_full:
+            await hold(1, release)
+        with pytest.raises(AdmissionRejected) as queue_full:
+            await hold(3, release)
+        timeouts = await asyncio.gather(*waiters, return_exceptions=True)
+        release.set()
+        await holder
+        return customer_full.value, queue_full.value, timeouts
+
+    customer_full, queue_full, timeouts = asyncio.run(scenario())
+    assert customer_full.status_code == 429 and customer_full.retry_after >= 1
+    assert "customer" in customer_full.msg and "customer" not in queue_full.msg
+    assert [type(outcome) for outcome in timeouts] == [AdmissionRejected, AdmissionRejected]
+    assert ADMISSION_DECISIONS.value(lane=CHEAP, result="rejected_customer_queue_full") == rejected_before + 1
+    assert controller.lanes[CHEAP].used == 0 and controller.lanes[CHEAP].queued == 0
+
+# a saturated service answers 429 with Retry-After rather than queueing the request
+def test_classify_file_returns_429_when_saturated(mocker):
+    controller = _controller(capacity=1, max_queue=0)
+    controller.lanes[CHEAP].used = 1
+    mocker.patch('src.fastapi_app.admission_controller', controller)
+    mocker.patch('src.fastapi_app.get_file_metadata', return_value=FileModel(s3Path='1/test.txt', filename="test.txt", customerId=1, sizeBytes=10))
+    mocker.patch('src.fastapi_app.get_db', return_value=MagicMock())
+    mocker.patch('src.fastapi_app.get_s3_client', return_value=MagicMock())
+    classify = mocker.patch('src.fastapi_app.classify_stored_file')
+
+    response = TestClient(app).post("/classify_file", json={"customer_id": 1, "filename": "test.txt"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    classify.assert_not_called()
+    assert "classify_admission_total" in TestClient(app).get("/metrics").text
@@ -2,14 +2,24 @@ import pytest
 from fastapi.testclient import TestClient
 import sys
 import os
+import threading
 
 from fastapi.testclient import TestClient
 
-from src.fastapi_app import app
+import src.utils.classify_pipeline as classify_pipeline
+from src.fastapi_app import app, get_db, get_s3_client
 from src.data_models.tables import File as FileModel
+from src.utils.classification_cache import ClassificationCache
+from src.utils.write_behind import ClassificationWriter
 
-from unittest.mock import MagicMock
-from io import BytesIO
+from unittest.mock import MagicMock, AsyncMock
+from src.utils.buffers import FileBuffer
+import boto3
+from moto import mock_aws
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from src.data_models.tables import Base
 
 # mock none obj back from db in files table
 @pytest.fixture
@@ -25,12 +35,12 @@ def mock_file_obj(mocker):
 # mock none returned from getting files bytes from s3
 @pytest.fixture
 def mock_s3_file_bytes_none(mocker):
-    return mocker.patch('src.fastapi_app.download_file_return_bytes', return_value = None)
+    return mocker.patch('src.utils.classify_pipeline.download_file_buffer', return_value = None)
 
 # mock writing to db to update item in db
 @pytest.fixture
 def update_file_classification(mocker):
-    return mocker.patch('src.fastapi_app.update_file_classification', return_value = None)
+    return mocker.patch('src.utils.classify_pipeline.update_file_classification', return_value = None)
 
 # mock the return from reading from s3 and getting file bytes
 @pytest.fixture
@@ -39,11 +49,8 @@ def mock_s3_file_bytes(mocker):
     with open('tests/test_files/bank_statement_1.pdf', "rb") as f:
         file_content = f.read()  # Read file content as bytes
     
-    # Create a BytesIO object to simulate file-like behavior
-    file_bytes_io = BytesIO(file_content)
-
-    # Mock `extract_text_from_file` to return extracted text from the file bytes
-    return mocker.patch('src.fastapi_app.download_file_return_bytes', return_value=file_bytes_io)
+    # Mock the download to return the file content as an in memory buffer
+    return mocker.patch('src.utils.classify_pipeline.download_file_buffer', return_value=FileBuffer.from_bytes(file_content))
 
 # Mock the database sessin
 @pytest.fixture
@@ -59,6 +66,28 @@ def mock_s3_client(mocker):
     mocker.patch('src.fastapi_app.get_s3_client', return_value=mock_s3)
     return mock_s3
 
+# memory only classification cache so tests never share cached results or touch the db table
+@pytest.fixture
+def mock_classification_cache(mocker):
+    cache = ClassificationCache(enabled=True, persistent=False)
+    mocker.patch('src.utils.classify_pipeline.classification_cache', cache)
+    mocker.patch('src.utils.batch_processing.classification_cache', cache)
+    return cache
+
+# mock the write behind queue so tests never start the flusher against the real db
+@pytest.fixture
+def mock_classification_writer(mocker):
+    writer = MagicMock()
+    writer.submit_async = AsyncMock(return_value=None)
+    mocker.patch('src.utils.classify_pipeline.classification_writer', writer)
+    mocker.patch('src.utils.batch_processing.classification_writer', writer)
+    return writer
+
+# the cascade is opt in, tests of the cascade turn it on
+@pytest.fixture
+def cascade_enabled(mocker):
+    return mocker.patch('src.utils.classify_pipeline.CASCADE_ENABLED', True)
+
 # Create a test client for FastAPI
 @pytest.fixture
 def client():
@@ -74,13 +103,215 @@ def test_classify_file_failed_file_bytes(mock_db_session, mock_s3_client, mock_f
     res = client.post("/classify_file", json={"customer_id": 1, "filename": "test.pdf"})
     assert res.status_code == 500
 
+# the db lookup of /get_file runs on the I/O pool, not on the event loop
+def test_get_file_reads_db_off_the_event_loop(client, mock_db_session, mocker):
+    threads = []
+
+    def lookup(db, customer_id, filename):
+        threads.append(threading.current_thread())
+        return None
+
+    mocker.patch('src.fastapi_app.get_file_metadata', side_effect=lookup)
+    response = client.get("/get_file", params={"filename": "test.pdf", "customer_id": 1})
+    assert response.status_code == 404
+    assert threads and threads[0].name.startswith("io")
+
 # Test case for a valid file classification
-def test_classify_file_valid(client, mock_db_session, mock_s3_client, mock_file_obj, mock_s3_file_bytes, update_file_classification):
+def test_classify_file_valid(client, mock_db_session, mock_s3_client, mock_file_obj, mock_s3_file_bytes, update_file_classification, mock_classification_cache, mock_classification_writer):
     response = client.post("/classify_file", json={"customer_id": 1, "filename": "test.pdf"})
 
     assert response.status_code == 200
     assert response.json()['data'] == {
         "file_class": "bank_statement",
         "filename": "test.pdf",
-        "customer_id": 1
-    }
\ No newline at end of file
+        "customer_id": 1,
+        "pages_read": 2,  # the text within the page budget is extracted, then classified in an inference batch
+        "tier": None  # the cascade is off by default
+    }
+
+# with the cascade on the statement is decided by the head model, a head model decision is not cached
+def test_classify_file_cascade_head_decision_is_not_cached(client, mock_db_session, mock_s3_client, mock_file_obj, mock_s3_file_bytes, update_file_classification, mock_classification_cache, mock_classification_writer, cascade_enabled):
+    for _ in range(2):
+        response = client.post("/classify_file", json={"customer_id": 1, "filename": "test.pdf"})
+        assert response.status_code == 200
+        assert response.json()['data'] == {
+            "file_class": "bank_statement",
+            "filename": "test.pdf",
+            "customer_id": 1,
+            "pages_read": 1,
+            "tier": 0
+        }
+    assert len(mock_classification_cache.memory) == 0
+
+# every stage of the request is reported in the Server-Timing header and counted on /metrics
+def test_classify_file_server_timing_and_metrics(client, mock_db_session, mock_s3_client, mock_file_obj, mock_s3_file_bytes, update_file_classification, mock_classification_cache, mock_classification_writer, cascade_enabled):
+    response = client.post("/classify_file", json={"customer_id": 1, "filename": "test.pdf"})
+    assert response.status_code == 200
+
+    stages = [entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")]
+    for stage in ["metadata_lookup", "download", "cache_lookup", "extract", "tier0", "db_write", "total"]:
+        assert stage in stages
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'classifications_total{file_type="pdf",file_class="bank_statement",source="model"}' in metrics.text
+    assert 'classify_stage_seconds_count{stage="tier0",file_type="pdf"}' in metrics.text
+    assert 'http_requests_total{method="POST",route="/classify_file",status="200"}' in metrics.text
+
+# the same bytes classified twice only go through extraction and inference once
+def test_classify_file_cache_hit(client, mock_db_session, mock_s3_client, mock_file_obj, update_file_classification, mock_classification_cache, mock_classification_writer, cascade_enabled, mocker):
+    with open('tests/test_files/bank_statement_1.pdf', "rb") as f:
+        file_content = f.read()
+    mocker.patch('src.utils.classify_pipeline.download_file_buffer', side_effect=lambda *args, **kwargs: FileBuffer.from_bytes(file_content))
+    mocker.patch('src.utils.classify_pipeline.INFERENCE_BATCHING', False)  # the whole cascade in one worker call
+    run_cpu = mocker.patch('src.utils.classify_pipeline.run_cpu', return_value=("Statement", "bank_statement", 1, {"extract": 0.01}, 1))
+
+    for _ in range(2):
+        response = client.post("/classify_file", json={"customer_id": 1, "filename": "test.pdf"})
+        assert response.status_code == 200
+        assert response.json()['data']['file_class'] == "bank_statement"
+    # the second call is a cache hit so no pages are read
+    assert response.json()['data']['pages_read'] == 0
+    assert response.json()['data']['tier'] is None
+
+    assert run_cpu.call_count == 1
+    stats = mock_classification_cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
+
+# mock the batch metadata lookup, only test.pdf exists in the db
+@pytest.fixture
+def mock_batch_file_objs(mocker):
+    file_obj = FileModel(id=1, s3Path='some/path/to/file', filename="test.pdf", customerId=1)
+    return mocker.patch('src.utils.batch_processing.get_files_metadata', return_value={(1, "test.pdf"): file_obj})
+
+# mock the batch s3 download, return a fresh buffer per call as the items are read in parallel
+@pytest.fixture
+def mock_batch_s3_file_bytes(mocker):
+    with open('tests/test_files/bank_statement_1.pdf', "rb") as f:
+        file_content = f.read()
+    return mocker.patch('src.utils.batch_processing.download_file_buffer', side_effect=lambda *args, **kwargs: FileBuffer.from_bytes(file_content))
+
+# mock the bulk db write
+@pytest.fixture
+def update_files_classification(mocker):
+    return mocker.patch('src.utils.batch_processing.update_files_classification', return_value=None)
+
+# Test case for a batch with valid, missing and unsupported files
+def test_classify_batch_partial_failures(client, mock_db_session, mock_s3_client, mock_batch_file_objs, mock_batch_s3_file_bytes, update_files_classification, mock_classification_cache, mock_classification_writer):
+    response = client.post("/classify_batch", json={"items": [
+        {"customer_id": 1, "filename": "test.pdf"},
+        {"customer_id": 1, "filename": "missing.pdf"},
+        {"customer_id": 1, "filename": "test.exe"},
+    ]})
+
+    assert response.status_code == 200
+    results = response.json()['data']['results']
+    assert [r["filename"] for r in results] == ["test.pdf", "missing.pdf", "test.exe"]
+    assert results[0]["file_class"] == "bank_statement" and results[0]["error"] is None
+    assert results[1]["file_class"] is None and "not found" in results[1]["error"]
+    assert results[2]["error"] == "File type not supported"
+    # only one file was downloaded and it was queued for the db in a single bulk submit
+    assert mock_batch_s3_file_bytes.call_count == 1
+    mock_classification_writer.submit_many.assert_called_once()
+    assert mock_classification_writer.submit_many.call_args.args[0] == [(1, "bank_statement")]
+    update_files_classification.assert_not_called()
+
+def test_classify_batch_empty(client, mock_db_session, mock_s3_client):
+    response = client.post("/classify_batch", json={"items": []})
+    assert response.status_code == 422
+
+
+# real in memory db and local S3 stand-in wired in through dependency overrides
+@pytest.fixture
+def local_backends():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="heron-data-test-bucket")
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_s3_client] = lambda: s3
+        try:
+            yield session_factory, s3
+        finally:
+            app.dependency_overrides.clear()
+
+# uploads stream to S3, store the content hash and the second copy of a document is classified from the cache
+def test_upload_stream_then_classify(client, local_backends, mock_classification_cache, mocker):
+    session_factory, s3 = local_backends
+    mocker.patch('src.fastapi_app.BUCKET_NAME', "heron-data-test-bucket")
+    writer = ClassificationWriter(session_factory, flush_interval=0.05)
+    mocker.patch('src.utils.classify_pipeline.classification_writer', writer)
+    with open('tests/test_files/invoice_1.pdf', "rb") as f:
+        file_content = f.read()
+
+    response = client.post("/upload_file/?customer_id=1", files={"file": ("invoice_1.pdf", file_content)})
+    assert response.status_code == 200
+    assert response.json()["size_bytes"] == len(file_content)
+    response = client.post("/upload_file_stream/?customer_id=1&filename=renamed.pdf", content=file_content)
+    assert response.status_code == 200
+    assert s3.get_object(Bucket="heron-data-test-bucket", Key="1/renamed.pdf")["Body"].read() == file_content
+
+    download = mocker.spy(classify_pipeline, 'download_file_buffer')
+    for filename in ("invoice_1.pdf", "renamed.pdf"):
+        # wait_for_persistence so the write behind row is committed before the response
+        response = client.post("/classify_file", json={"customer_id": 1, "filename": filename, "wait_for_persistence": True})
+        assert response.status_code == 200
+        assert response.json()['data']['file_class'] == "invoice"
+
+    # the renamed copy was a cache hit on the stored hash, so it was never downloaded
+    assert download.call_count == 1
+    with session_factory() as db:
+        assert {f.fileClassification for f in db.query(FileModel).all()} == {"invoice"}
+    writer.stop()
+
+# uploading different content under a name already used replaces the file, the next classification is of the new bytes
+def test_reupload_replaces_file_and_classification(client, local_backends, mock_classification_cache, mocker):
+    session_factory, s3 = local_backends
+    mocker.patch('src.fastapi_app.BUCKET_NAME', "heron-data-test-bucket")
+    writer = ClassificationWriter(session_factory, flush_interval=0.05)
+    mocker.patch('src.utils.classify_pipeline.classification_writer', writer)
+
+    classes = []
+    for path in ('tests/test_files/invoice_1.pdf', 'tests/test_files/bank_statement_1.pdf'):
+        with open(path, "rb") as f:
+            response = client.post("/upload_file/?customer_id=1", files={"file": ("doc.pdf", f.read())})
+        assert response.status_code == 200 and response.json()["file_id"] == 1
+        response = client.post("/classify_file", json={"customer_id": 1, "filename": "doc.pdf", "wait_for_persistence": True})
+        assert response.status_code == 200
+        classes.append(response.json()['data']['file_class'])
+
+    assert classes == ["invoice", "bank_statement"]
+    with session_factory() as db:
+        files = db.query(FileModel).all()
+        assert [(f.id, f.fileClassification) for f in files] == [(1, "bank_statement")]
+    writer.stop()
+
+# multipart form uploads are parsed as they arrive, the file is never spooled to local disk like an UploadFile
+def test_upload_file_form_is_not_spooled(client, local_backends, mocker):
+    session_factory, s3 = local_backends
+    mocker.patch('src.fastapi_app.BUCKET_NAME', "heron-data-test-bucket")
+    mocker.patch('starlette.formparsers.SpooledTemporaryFile', side_effect=AssertionError("upload was spooled"))
+    content = os.urandom(6 * 1024 * 1024)
+
+    response = client.post("/upload_file/?customer_id=1", data={"note": "scan"}, files={"file": ("big scan.jpg", content)})
+    assert response.status_code == 200
+    assert response.json()["filename"] == "big scan.jpg" and response.json()["size_bytes"] == len(content)
+    assert s3.get_object(Bucket="heron-data-test-bucket", Key="1/big scan.jpg")["Body"].read() == content
+
+    # a form without the file field, or a body that is not a form, is a 400
+    assert client.post("/upload_file/?customer_id=1", data={"note": "scan"}, files={"other": ("a.pdf", b"%PDF-")}).status_code == 400
+    assert client.post("/upload_file/?customer_id=1", content=b"%PDF-").status_code == 400
+
+def test_upload_stream_rejects_unsupported_type(client, local_backends):
+    response = client.post("/upload_file_stream/?customer_id=1&filename=virus.exe", content=b"MZ")
+    assert response.status_code == 400
@@ -0,0 +1,73 @@
+import boto3
+import pytest
+from moto import mock_aws
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.classifier import get_model_version
+from src.data_models.tables import Base, File as FileModel
+from src.scripts.backfill_classifications import BackfillSelection, run_backfill
+from src.utils.classification_cache import ClassificationCache
+from src.utils.executors import InlineExecutor
+
+BUCKET = "backfill-test-bucket"
+FILES = ["invoice_1.pdf", "bank_statement_1.pdf", "invoice_2.pdf", "bank_statement_2.pdf", "invoice_1.pdf", "bank_statement_3.pdf"]
+
+# 6 unclassified files (one duplicated content) for customer 1 and one already classified file for customer 2
+@pytest.fixture
+def backfill_env(mocker):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    mocker.patch('src.scripts.backfill_classifications.classification_cache', ClassificationCache(enabled=True, persistent=True))
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        with session_factory() as db:
+            for file_id, filename in enumerate(FILES, start=1):
+                with open(f"tests/test_files/{filename}", "rb") as f:
+                    s3.put_object(Bucket=BUCKET, Key=f"1/{file_id}_{filename}", Body=f.read())
+                db.add(FileModel(id=file_id, filename=filename, s3Path=f"1/{file_id}_{filename}", customerId=1))
+            db.add(FileModel(id=100, filename="old.pdf", s3Path="2/old.pdf", customerId=2, fileClassification="invoice"))
+            db.commit()
+        yield session_factory, s3
+
+def classifications(session_factory):
+    with session_factory() as db:
+        return {f.id: (f.fileClassification, f.modelVersion) for f in db.query(FileModel).all()}
+
+def test_backfill_dry_run_writes_nothing(backfill_env):
+    session_factory, s3 = backfill_env
+    report = run_backfill(session_factory, s3, BUCKET, BackfillSelection(), page_size=4, dry_run=True)
+    assert report.processed == 6
+    assert classifications(session_factory)[1] == (None, None)
+
+# a run stopped after 4 rows resumes from its checkpoint and classifies the rest
+def test_backfill_checkpoint_and_resume(backfill_env, tmp_path):
+    session_factory, s3 = backfill_env
+    checkpoint = str(tmp_path / "checkpoint.json")
+    kwargs = dict(page_size=2, chunk_size=2, cpu_executor=InlineExecutor(), io_workers=2, checkpoint_path=checkpoint)
+
+    first = run_backfill(session_factory, s3, BUCKET, BackfillSelection(customer_id=1), limit=4, **kwargs)
+    assert first.processed == 4 and first.last_id == 4 and not first.done
+    assert classifications(session_factory)[5] == (None, None)
+
+    second = run_backfill(session_factory, s3, BUCKET, BackfillSelection(customer_id=1), **kwargs)
+    assert second.done and second.processed == 6 and second.failed == 0
+    # file 5 has the same bytes as file 1, so it came from the cache
+    assert second.cached >= 1
+
+    model_version = get_model_version()
+    result = classifications(session_factory)
+    assert [result[file_id][0] for file_id in range(1, 7)] == [
+        "invoice", "bank_statement", "invoice", "bank_statement", "invoice", "bank_statement"
+    ]
+    assert all(result[file_id][1] == model_version for file_id in range(1, 7))
+    # the other customer's file was not selected
+    assert result[100] == ("invoice", None)
+
+    # a different selection cannot resume this checkpoint
+    with pytest.raises(ValueError):
+        run_backfill(session_factory, s3, BUCKET, BackfillSelection(mode="stale"), **kwargs)
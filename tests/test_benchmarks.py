@@ -0,0 +1,62 @@
+from collections import Counter
+from io import BytesIO
+
+import pytest
+
+from src.benchmarks.corpus import generate_documents, render_pdf
+from src.benchmarks.load_test import compare as compare_load, parse_mix, plan_files, summarise_requests
+from src.benchmarks.pipeline_benchmark import compare, run_benchmarks, summarise
+from src.classifier import classify_file_ml
+from src.utils.extract_text import DocxTextExtractor, PDFTextExtractor, TxtTextExtractor
+
+
+@pytest.mark.parametrize("file_format, extractor_cls", [
+    ("pdf", PDFTextExtractor),
+    ("docx", DocxTextExtractor),
+    ("txt", TxtTextExtractor),
+])
+def test_corpus_documents_extract_and_classify(file_format, extractor_cls):
+    for document, content in generate_documents(6, [file_format], seed=1):
+        text = extractor_cls().extract_text(BytesIO(content))
+        assert classify_file_ml(text) == document.label
+
+def test_corpus_pdf_pages():
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(BytesIO(render_pdf("\n".join(f"line {i}" for i in range(30)), pages=3)))
+    assert len(reader.pages) == 3
+    assert "line 29" in reader.pages[2].extract_text()
+
+def test_summarise():
+    result = summarise([0.001 * i for i in range(1, 101)], peak_bytes=2048, items_per_run=2)
+    assert result["runs"] == 100
+    assert result["p50_ms"] == pytest.approx(25.5, abs=0.5)
+    assert result["max_ms"] == pytest.approx(50)
+    assert result["peak_mem_kb"] == 2.0
+
+def test_run_benchmarks_reports_every_stage():
+    results = run_benchmarks(docs=9, repeat=1, formats=["pdf", "docx", "txt"], batch_size=4, seed=0, max_pages=2, skip_s3=True)
+
+    assert results["meta"]["docs"] == 9
+    for stage in ["extract_pdf", "extract_docx", "extract_txt", "clean_text", "model_load", "predict_single", "predict_batched"]:
+        assert {"mean_ms", "p50_ms", "p99_ms", "peak_mem_kb"} <= results["stages"][stage].keys()
+
+    deltas = compare(results, results)
+    assert all(delta["change_pct"] == 0 for delta in deltas.values())
+
+# the load test seeds files in the proportions of the mix, spread over the customers, and summarises a run
+def test_load_test_plan_and_summary():
+    mix = parse_mix("pdf=2,txt=1,docx=1")
+    assert mix == {"pdf": 0.5, "txt": 0.25, "docx": 0.25}
+    with pytest.raises(ValueError):
+        parse_mix("exe=1")
+
+    planned = list(plan_files(8, customers=3, mix=mix, seed=0, max_pages=1))
+    assert Counter(file_format for _, _, file_format, _ in planned) == {"pdf": 4, "txt": 2, "docx": 2}
+    assert {customer_id for customer_id, _, _, _ in planned} == {1, 2, 3}
+    assert len({(customer_id, filename) for customer_id, filename, _, _ in planned}) == 8
+
+    run = summarise_requests([0.01 * i for i in range(1, 101)], Counter({"200": 98, "503": 2}), seconds=10)
+    assert run["throughput_per_s"] == 9.8 and run["error_rate"] == 0.02
+    assert run["p50_ms"] == pytest.approx(505, abs=10) and run["p99_ms"] == pytest.approx(990, abs=10)
+    assert compare_load({"runs": {"workers_1": run}}, {"runs": {"workers_1": run}}) == {"workers_1": {"throughput_change_pct": 0.0, "p99_change_pct": 0.0}}
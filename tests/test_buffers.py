@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytest
+
+from src.errors import MemoryBudgetExceeded
+from src.utils.buffers import FileBuffer, MemoryBudget, RequestMemory
+from src.utils.tasks import extract_and_classify_timed_task, extract_text_task
+from src.utils.utils import download_file_buffer
+
+LINE = b"Invoice Number 1234 Item No: 01 - Web Development - $120.00\n"
+
+
+# S3 body stand-in that makes its content as it is read, so the test itself never holds a whole file
+class _LazyBody:
+    def __init__(self, size: int):
+        self.size = size
+        self.position = 0
+
+    def read(self, amount: int = -1) -> bytes:
+        amount = self.size - self.position if amount is None or amount < 0 else min(amount, self.size - self.position)
+        self.position += amount
+        return (LINE * (amount // len(LINE) + 1))[:amount]
+
+    def close(self) -> None:
+        pass
+
+def test_spooled_buffer_reads_hashes_and_pickles_as_path(tmp_path):
+    content = LINE * 1000
+    file_buffer = FileBuffer.from_stream(BytesIO(content), spool=True, spool_dir=str(tmp_path), chunk_size=4096)
+    assert file_buffer.spooled and file_buffer.size == len(content)
+    assert file_buffer.open().read() == content
+    assert bytes(file_buffer.view()[:7]) == b"Invoice"
+    assert file_buffer.sha256() == hashlib.sha256(content).hexdigest()
+
+    # a worker gets the path, not the content, and never deletes the file
+    copy = pickle.loads(pickle.dumps(file_buffer))
+    assert copy.data is None and copy.path == file_buffer.path
+    copy.close()
+    assert os.path.exists(file_buffer.path)
+    file_buffer.close()
+    assert not os.path.exists(file_buffer.path)
+
+    in_memory = FileBuffer.from_stream(BytesIO(content), spool=False)
+    assert not in_memory.spooled and in_memory.open().read() == content
+
+# a spooled file reaches a process pool worker as a path and is memory mapped there
+def test_spooled_buffer_in_process_pool(tmp_path):
+    with FileBuffer.from_stream(BytesIO(LINE * 100), spool=True, spool_dir=str(tmp_path)) as file_buffer:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            text = executor.submit(extract_text_task, file_buffer, "invoice.txt").result()
+    assert text.startswith("Invoice Number 1234")
+
+# close() closes the memory maps handed out by open() and view(), tasks close theirs when they are done
+def test_spooled_buffer_closes_its_mappings(tmp_path):
+    with open('files/bank_statement_1.pdf', 'rb') as f:
+        pdf = f.read()
+    file_buffer = FileBuffer.from_stream(BytesIO(pdf), spool=True, spool_dir=str(tmp_path))
+    reader = file_buffer.open()
+    view = file_buffer.view()
+    assert bytes(view[:5]) == b"%PDF-"
+    file_buffer.close()
+    assert reader.closed
+    with pytest.raises(ValueError):
+        view[:5]
+
+    # pages are read with early exit, so the extraction stops part way through the document
+    file_buffer = FileBuffer.from_stream(BytesIO(pdf), spool=True, spool_dir=str(tmp_path))
+    _, file_class, _, _ = extract_and_classify_timed_task(file_buffer, "statement.pdf")
+    assert file_class == "bank_statement"
+    assert file_buffer._mappings and all(mapped.closed for mapped in file_buffer._mappings)
+    file_buffer.close()
+
+# files past the request budget are spooled, the process budget queues, then rejects
+def test_memory_budgets():
+    async def scenario():
+        budget = MemoryBudget(limit_bytes=100, wait_seconds=0.2)
+        async with RequestMemory(limit_bytes=50, budget=budget) as request_memory:
+            assert await request_memory.admit(40) is True
+            assert await request_memory.admit(40) is False  # over the request budget, spooled
+            assert budget.used == 80
+
+            # a request holding nothing waits for room and gets it once the other request finishes
+            waiting = asyncio.ensure_future(RequestMemory(budget=budget).admit(30))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+        assert await waiting is True
+        assert budget.used == 30
+
+        # a request already holding memory is rejected rather than waiting
+        holder = RequestMemory(budget=budget)
+        await holder.admit(60)
+        with pytest.raises(MemoryBudgetExceeded) as busy:
+            await holder.admit(20)
+        assert busy.value.status_code == 503
+        # a request holding nothing waits wait_seconds, then is rejected
+        with pytest.raises(MemoryBudgetExceeded):
+            await RequestMemory(budget=budget).admit(20)
+        with pytest.raises(MemoryBudgetExceeded) as too_large:
+            await RequestMemory(budget=budget).admit(101)
+        assert too_large.value.status_code == 413
+        holder.release_all()
+        budget.release(30)
+        assert budget.used == 0 and not budget._waiters
+
+    asyncio.run(scenario())
+
+# a cancelled wait gives back its place in the queue, or the room it was granted just before the cancellation
+def test_cancelled_wait_does_not_leak_budget():
+    async def scenario():
+        budget = MemoryBudget(limit_bytes=100, wait_seconds=5)
+        await budget.acquire(100)
+        for cancel_after_release in (False, True):
+            waiting = asyncio.ensure_future(budget.acquire(50))
+            await asyncio.sleep(0.01)
+            if cancel_after_release:
+                budget.release(100)  # the waiter is granted, then cancelled before it runs
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            if not cancel_after_release:
+                assert not budget._waiters
+                budget.release(100)
+            assert budget.used == 0 and not budget._waiters
+            await budget.acquire(100)
+
+    asyncio.run(scenario())
+
+def _rss_anon_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+# concurrent large downloads are spooled, so peak anonymous memory stays far below the size of the files
+@pytest.mark.skipif(sys.platform != "linux", reason="reads /proc/self/status")
+def test_peak_memory_under_concurrent_large_files(mocker, record_property):
+    files, size = 4, 48 * 1024 * 1024
+    mocker.patch('src.utils.utils.get_s3_object_body', side_effect=lambda *args: (_LazyBody(size), size))
+    extract_text_task(LINE, "warm.txt")
+
+    peak = {"mb": 0.0}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            peak["mb"] = max(peak["mb"], _rss_anon_mb())
+            time.sleep(0.002)
+
+    async def classify_one(request_memory):
+        file_buffer = await download_file_buffer(None, "bucket", "big.txt", request_memory)
+        try:
+            content_hash = await asyncio.to_thread(file_buffer.sha256)
+            text = await asyncio.to_thread(extract_text_task, file_buffer, "big.txt")
+            return file_buffer.spooled, content_hash, text
+        finally:
+            file_buffer.close()
+
+    async def scenario():
+        budget = MemoryBudget(limit_bytes=files * size, wait_seconds=5)
+        results = []
+        for _ in range(files):
+            results.append(classify_one(RequestMemory(limit_bytes=8 * 1024 * 1024, budget=budget)))
+        return await asyncio.gather(*results)
+
+    baseline = _rss_anon_mb()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        stop.set()
+        sampler.join()
+
+    added_mb = peak["mb"] - baseline
+    record_property("peak_added_anon_mb", round(added_mb, 1))
+    assert all(spooled for spooled, _, _ in results)
+    assert len({content_hash for _, content_hash, _ in results}) == 1
+    assert all(text.startswith("Invoice Number 1234") for _, _, text in results)
+    # holding the files in memory would take files * size = 192MB
+    assert added_mb < 48
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.data_models.tables import Base, ClassificationCacheEntry
+from src.utils.classification_cache import ClassificationCache, LRUTTLCache, hash_file_bytes
+
+# in memory sqlite db with all the tables created
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUTTLCache(max_entries=2, max_bytes=1000, ttl_seconds=60)
+    cache.put("a", 1, size=1)
+    cache.put("b", 2, size=1)
+    assert cache.get("a") == 1  # a is now most recently used
+    cache.put("c", 3, size=1)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+def test_lru_evicts_on_bytes_and_ttl():
+    cache = LRUTTLCache(max_entries=10, max_bytes=10, ttl_seconds=0.05)
+    cache.put("a", 1, size=6)
+    cache.put("b", 2, size=6)
+    assert cache.get("a") is None and cache.size_bytes == 6
+    time.sleep(0.1)
+    assert cache.get("b") is None and len(cache) == 0
+
+# entries survive a fresh process (new memory tier) through the table
+def test_persistent_tier_hit(db_session):
+    content_hash = hash_file_bytes(b"invoice bytes")
+    ClassificationCache(persistent=True).put(db_session, content_hash, "v1", "Invoice Number 1", "invoice")
+
+    cache = ClassificationCache(persistent=True)
+    cached = cache.get(db_session, content_hash, "v1")
+    assert cached.file_class == "invoice"
+    assert cache.get(db_session, content_hash, "v1") is not None
+    assert cache.stats()["persistent_hits"] == 1 and cache.stats()["memory_hits"] == 1
+
+# a new model version never sees results from the old one and stale rows are purged
+def test_model_version_change_invalidates(db_session):
+    cache = ClassificationCache(persistent=True)
+    cache.put(db_session, "hash", "v1", "text", "invoice")
+    assert cache.get(db_session, "hash", "v1") is not None
+
+    assert cache.get(db_session, "hash", "v2") is None
+    assert len(cache.memory) == 0
+    assert db_session.query(ClassificationCacheEntry).count() == 0
+
+# a process starting on a model version does not purge the rows of the version other workers still serve
+def test_new_process_keeps_other_versions(db_session):
+    ClassificationCache(persistent=True).put(db_session, "hash", "v1", "text", "invoice")
+
+    new_worker = ClassificationCache(persistent=True)
+    assert new_worker.get(db_session, "hash", "v2") is None
+    old_worker = ClassificationCache(persistent=True)
+    assert old_worker.get(db_session, "hash", "v1").file_class == "invoice"
+
+    assert new_worker.purge_stale(db_session, "v2") == 1
+    assert db_session.query(ClassificationCacheEntry).count() == 0
@@ -0,0 +1,117 @@
+from io import BytesIO
+
+import pytest
+
+from src.benchmarks.corpus import render_scanned_pdf
+from src.head_model import HeadClassifier, filename_tokens
+from src.utils.cascade import CascadeClassifier, TIER_HEAD, TIER_OCR, TIER_TEXT_LAYER, parse_thresholds
+from src.utils.ocr_pool import OCRReaderPool
+
+PDF_FILE_PATH = 'files/bank_statement_1.pdf'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_parse_thresholds():
+    assert parse_thresholds("bank_statement=0.8, invoice=0.95,") == {"bank_statement": 0.8, "invoice": 0.95}
+    assert parse_thresholds("") == {}
+
+def test_head_model_round_trip(tmp_path):
+    model = HeadClassifier.fit(
+        [("invoice_1.pdf", "invoice number total due"), ("statement.pdf", "account holder statement period")],
+        ["invoice", "bank_statement"],
+    )
+    model.save(str(tmp_path / "head.json"))
+    loaded = HeadClassifier.load(str(tmp_path / "head.json"))
+
+    assert loaded.classify("scan.pdf", "invoice number 42 total due") == model.classify("scan.pdf", "invoice number 42 total due")
+    assert loaded.classify("scan.pdf", "invoice number 42 total due")[0] == "invoice"
+    assert filename_tokens("uploads/Bank_Statement-2023.pdf") == ["bank", "statement"]
+
+# a confident head model decides without reading the rest of the document
+def test_cascade_decides_at_head_when_confident():
+    timings = {}
+    result = CascadeClassifier(thresholds={}, default_threshold=0.5).classify(_read(PDF_FILE_PATH), "bank_statement_1.pdf", timings)
+    assert result.tier == TIER_HEAD
+    assert result.file_class == "bank_statement"
+    assert "tier1" not in timings
+
+# when no tier is confident every applicable tier runs and the most confident answer wins, TXT has no OCR tier
+def test_cascade_escalates_and_skips_tiers_that_cannot_help():
+    cascade = CascadeClassifier(thresholds={}, default_threshold=1.1)
+    text = b"Invoice Number: 1234\nDate: 15 December 2023\nItem: Design $50\nTotal Due: $50"
+    tiers = [result.tier for result in cascade.iter_tiers(text, "document.txt")]
+    assert tiers == [TIER_HEAD, TIER_TEXT_LAYER]
+
+    result = cascade.classify(text, "document.txt")
+    assert result.file_class == "invoice"
+
+# scanned PDFs have no text layer to classify, so the cascade goes from the head straight to OCR
+def test_cascade_ocrs_scanned_pdf(mocker):
+    reader_cls = mocker.patch('easyocr.Reader')
+    reader_cls.return_value.readtext.return_value = [([0, 0], "DRIVER LICENSE Expires DOB Height Weight Sex", 0.9)]
+    mocker.patch('src.utils.extract_text.get_ocr_pool', return_value=OCRReaderPool(size=1))
+    scanned = render_scanned_pdf("TEXAS DRIVER LICENSE\nNumber: D1234567", pages=1)
+
+    cascade = CascadeClassifier(thresholds={}, default_threshold=0.99)
+    tiers = [result.tier for result in cascade.iter_tiers(scanned, "scan_0001.pdf")]
+    assert tiers == [TIER_HEAD, TIER_OCR]
+    assert cascade.classify(scanned, "scan_0001.pdf").file_class == "driver_license"
+
+def test_cascade_without_head_model_starts_at_text_layer(tmp_path):
+    cascade = CascadeClassifier(thresholds={}, default_threshold=0.5, head_model_path=str(tmp_path / "missing.json"))
+    result = cascade.classify(_read(PDF_FILE_PATH), "bank_statement_1.pdf")
+    assert result.tier == TIER_TEXT_LAYER
+    assert result.file_class == "bank_statement"
+
+# with inference batching (the default) tier 1 of concurrent files is classified in one batch by the scheduler
+def test_cascade_tier1_is_batched_by_the_inference_scheduler(tmp_path, mocker):
+    import asyncio
+    import src.utils.classify_pipeline as classify_pipeline
+    from src.utils.buffers import FileBuffer
+    from src.utils.inference_scheduler import InferenceScheduler
+    from src.utils.tasks import classify_texts_task
+
+    batches = []
+
+    async def infer(texts):
+        batches.append(len(texts))
+        return classify_texts_task(texts)
+
+    async def run_inline(func, *args):
+        return func(*args)
+
+    cascade = CascadeClassifier(thresholds={}, default_threshold=0.5, head_model_path=str(tmp_path / "missing.json"))
+    mocker.patch('src.utils.tasks.get_cascade', return_value=cascade)
+    mocker.patch.object(classify_pipeline, 'get_cascade', return_value=cascade)
+    mocker.patch.object(classify_pipeline, 'run_cpu', run_inline)
+    mocker.patch.object(classify_pipeline, 'inference_scheduler', InferenceScheduler(window_seconds=1.0, infer=infer))
+    assert classify_pipeline.INFERENCE_BATCHING
+
+    async def scenario():
+        return await asyncio.gather(*[
+            classify_pipeline._cascade_classify_batched(FileBuffer.from_bytes(_read(f"files/{name}")), name)
+            for name in ("bank_statement_1.pdf", "invoice_1.pdf", "bank_statement_2.pdf")
+        ])
+
+    results = asyncio.run(scenario())
+    assert batches == [3]
+    assert [(file_class, tier) for _, file_class, _, _, tier in results] == [
+        ("bank_statement", TIER_TEXT_LAYER), ("invoice", TIER_TEXT_LAYER), ("bank_statement", TIER_TEXT_LAYER),
+    ]
+    assert all("inference" in timings and "tier1" in timings for _, _, _, timings, _ in results)
+
+# the offline evaluation replays thresholds over one recorded pass, a higher threshold can only escalate more
+def test_cascade_evaluation_replay():
+    from src.benchmarks.cascade_evaluation import _load_documents, baseline, record_documents, replay
+
+    records = record_documents(CascadeClassifier(thresholds={}, default_threshold=1.1), _load_documents(None, 6, ["txt"], 0, 1), hide_filenames=True)
+    low = replay(CascadeClassifier(thresholds={}, default_threshold=0.0), records)
+    high = replay(CascadeClassifier(thresholds={}, default_threshold=1.1), records)
+
+    assert low["decided_by"] == {"tier0": 6}
+    assert sum(high["decided_by"].values()) == 6
+    assert high["mean_latency_ms"] >= low["mean_latency_ms"]
+    assert 0 <= baseline(records)["accuracy"] <= 1
@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.data_models.tables import Base, File as FileModel
+from src.fastapi_app import app, get_db, get_session_factory
+from src.utils.file_listing import FileFilter, files_page_query, iter_files
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+CLASSES = [None, "invoice", "bank_statement"]
+
+
+# 30 files for customer 1, one a day, a third of each class and a third unclassified, and 5 for customer 2
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        for i in range(30):
+            session.add(FileModel(
+                filename=f"file_{i}.pdf", s3Path=f"1/file_{i}.pdf", customerId=1,
+                fileClassification=CLASSES[i % 3], uploadedAt=START + timedelta(days=i),
+            ))
+        for i in range(5):
+            session.add(FileModel(filename=f"file_{i}.pdf", s3Path=f"2/file_{i}.pdf", customerId=2))
+        session.commit()
+    return factory
+
+@pytest.fixture
+def client(session_factory):
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: session_factory
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+def _lines(response) -> list[dict]:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+# keyset pages cover every file once, in id order, with one query per page
+def test_iter_files_pages_by_keyset(session_factory):
+    statements = []
+    engine = session_factory.kw["bind"]
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        files = list(iter_files(session_factory, 1, FileFilter(), page_size=7))
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert [file["filename"] for file in files] == [f"file_{i}.pdf" for i in range(30)]
+    assert len(statements) == 5  # 7 + 7 + 7 + 7 + 2
+    assert all("files.id > ?" in statement for statement in statements)  # pages start after the last id, not at an offset
+
+    resumed = list(iter_files(session_factory, 1, FileFilter(), after_id=files[9]["id"], limit=4, page_size=3))
+    assert [file["filename"] for file in resumed] == [f"file_{i}.pdf" for i in range(10, 14)]
+
+# every page query is a range scan of a customer index rather than a scan of the whole table
+@pytest.mark.parametrize("file_filter, index", [
+    (FileFilter(), "ix_files_customer_id"),
+    (FileFilter(status="unclassified"), "ix_files_customer_class"),
+    (FileFilter(file_class="invoice"), "ix_files_customer_class"),
+])
+def test_listing_queries_use_the_customer_indexes(session_factory, file_filter, index):
+    query = files_page_query(1, file_filter, after_id=10, page_size=5)
+    compiled = query.compile(dialect=session_factory.kw["bind"].dialect, compile_kwargs={"literal_binds": True})
+    with session_factory() as db:
+        plan = " ".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all())
+    assert index in plan and "SCAN files" not in plan
+
+# the endpoint streams NDJSON filtered by status, class and upload time
+def test_list_customer_files_endpoint(client):
+    response = client.get("/customers/1/files", params={"status": "unclassified"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    files = _lines(response)
+    assert len(files) == 10 and all(file["file_class"] is None for file in files)
+
+    invoices = _lines(client.get("/customers/1/files", params={"file_class": "invoice", "limit": 3}))
+    assert [file["filename"] for file in invoices] == ["file_1.pdf", "file_4.pdf", "file_7.pdf"]
+
+    window = _lines(client.get("/customers/1/files", params={
+        "status": "classified", "uploaded_after": (START + timedelta(days=10)).isoformat(), "uploaded_before": (START + timedelta(days=16)).isoformat(),
+    }))
+    assert [file["filename"] for file in window] == ["file_10.pdf", "file_11.pdf", "file_13.pdf", "file_14.pdf"]
+
+    assert len(_lines(client.get("/customers/2/files"))) == 5
+    assert client.get("/customers/3/files").text == ""
+    assert client.get("/customers/1/files", params={"status": "done"}).status_code == 422
+
+# many filenames in one call, duplicates answered once and unknown ones reported as missing
+def test_lookup_customer_files(client):
+    response = client.post("/customers/1/files/lookup", json={"filenames": ["file_2.pdf", "file_1.pdf", "nope.pdf", "file_2.pdf"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [(file["filename"], file["file_class"]) for file in body["files"]] == [("file_2.pdf", "bank_statement"), ("file_1.pdf", "invoice")]
+    assert body["missing"] == ["nope.pdf"]
+    assert client.post("/customers/1/files/lookup", json={"filenames": []}).status_code == 422
@@ -0,0 +1,63 @@
+import json
+import os
+
+from src.classifier import clean_text, load_model
+from src.incremental_model import IncrementalTextClassifier, ReplayBuffer
+from src.scripts.train_incremental_model import (
+    corpus_files, extracted_documents, load_artifact, synthetic_documents, train, write_artifact,
+)
+from src.utils.executors import make_cpu_executor
+
+N_FEATURES = 2 ** 16
+
+
+def _predict(model, documents):
+    return model.predict([clean_text(text) for _, text in documents]).tolist()
+
+# a class added by a later run gets its own learner, the earlier classes are still recognised
+def test_new_class_is_added_without_retraining():
+    model = IncrementalTextClassifier(n_features=N_FEATURES)
+    model, replay, report = train(synthetic_documents(300, labels=["bank_statement", "invoice"]), model, ReplayBuffer(capacity=50), batch_size=64)
+    assert model.classes_.tolist() == ["bank_statement", "invoice"]
+    assert report.batches == 5 and report.holdout_documents == 30 and report.holdout_accuracy == 1.0
+
+    bank_statement_learner = model.learners["bank_statement"]
+    model, replay, report = train(synthetic_documents(150, seed=1, labels=["driver_license"]), model, replay, batch_size=64)
+    assert report.new_classes == ["driver_license"]
+    assert model.learners["bank_statement"] is bank_statement_learner
+    # the memory of the model is fixed by the hashed feature space, not by the corpus
+    assert all(learner.coef_.shape == (1, N_FEATURES) for learner in model.learners.values())
+    assert len(replay) <= 50 * 3
+
+    documents = list(synthetic_documents(30, seed=2))
+    assert _predict(model, documents) == [label for label, _ in documents]
+
+# every run writes the next version with its metadata, the artifact is served by load_model
+def test_versioned_artifact_is_served_by_load_model(tmp_path):
+    corpus = tmp_path / "corpus"
+    for label, text in synthetic_documents(60):
+        os.makedirs(corpus / label, exist_ok=True)
+        with open(corpus / label / f"{len(os.listdir(corpus / label))}.txt", "w") as f:
+            f.write(text)
+
+    executor = make_cpu_executor("inline")
+    documents = extracted_documents(corpus_files(str(corpus)), executor, io_workers=2, chunk_size=16)
+    model, replay, report = train(documents, IncrementalTextClassifier(n_features=N_FEATURES), batch_size=16)
+    assert report.documents == 60
+    first = write_artifact(model, replay, report, str(tmp_path / "models"))
+
+    model, replay, parent = load_artifact(first)
+    model, replay, report = train(synthetic_documents(30, seed=3), model, replay)
+    second = write_artifact(model, replay, report, str(tmp_path / "models"), parent=parent)
+    assert [os.path.basename(first), os.path.basename(second)] == ["text_classifier_incremental_v1.pkl", "text_classifier_incremental_v2.pkl"]
+
+    with open(second[:-len(".pkl")] + ".json") as f:
+        metadata = json.load(f)
+    assert metadata["version"] == 2 and metadata["parent"] == {"version": 1, "model_version": parent["model_version"]}
+    assert metadata["documents"] == {"bank_statement": 30, "invoice": 30, "driver_license": 30}
+
+    served = load_model(second)
+    documents = list(synthetic_documents(6, seed=4))
+    probabilities = served.predict_proba([clean_text(text) for _, text in documents])
+    assert probabilities.shape == (6, 3)
+    assert [served.classes_[idx] for idx in probabilities.argmax(axis=1)] == [label for label, _ in documents]
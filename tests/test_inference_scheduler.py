@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from src.utils.inference_scheduler import InferenceScheduler
+from src.utils.metrics import INFERENCE_BATCH_SIZE
+from src.utils.tasks import classify_texts_task
+
+INVOICE = "Invoice Number 1234 Item No: 01 - Web Development - $120.00 Total Due"
+STATEMENT = "Bank Statement Account Number 1234 Opening Balance Direct Deposit ATM Withdrawal Closing Balance"
+
+
+class RecordingInference:
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.batches = []
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return classify_texts_task(texts)
+
+# concurrent callers share one model call and each gets the row of its own text
+def test_concurrent_texts_are_classified_in_one_batch():
+    infer = RecordingInference()
+    scheduler = InferenceScheduler(window_seconds=1.0, max_batch_size=32, infer=infer)
+    batches_before = INFERENCE_BATCH_SIZE.snapshot()
+    classify_texts_task([INVOICE])  # load the model before timing
+
+    async def scenario():
+        return await asyncio.gather(*[scheduler.classify(text) for text in [INVOICE, STATEMENT, INVOICE]])
+
+    start = time.perf_counter()
+    results = asyncio.run(scenario())
+    # nothing was running, so the batch went straight away rather than after the window
+    assert time.perf_counter() - start < 0.5
+    assert infer.batches == [[INVOICE, STATEMENT, INVOICE]]
+    assert [file_class for (file_class, _), _ in results] == ["invoice", "bank_statement", "invoice"]
+    assert "inference" in results[0][1]
+    assert INFERENCE_BATCH_SIZE.snapshot() != batches_before
+
+# texts arriving while a batch runs go in the next batch, at most max_batch_size per batch, errors reach every caller
+def test_texts_collect_while_a_batch_runs():
+    infer = RecordingInference(delay=0.05)
+    scheduler = InferenceScheduler(window_seconds=1.0, max_batch_size=3, infer=infer)
+
+    async def scenario():
+        first = asyncio.ensure_future(scheduler.classify(INVOICE))
+        await asyncio.sleep(0.01)
+        rest = [asyncio.ensure_future(scheduler.classify(STATEMENT)) for _ in range(4)]
+        return await asyncio.gather(first, *rest)
+
+    start = time.perf_counter()
+    asyncio.run(scenario())
+    assert time.perf_counter() - start < 0.5  # flushed when full and when the running batch finished, not by the window
+    assert [len(batch) for batch in infer.batches] == [1, 3, 1]
+
+    failing = InferenceScheduler(window_seconds=0.01, infer=RecordingInference(error=ValueError("model missing")))
+
+    async def failing_scenario():
+        return await asyncio.gather(failing.classify(INVOICE), failing.classify(STATEMENT), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(failing_scenario())] == [ValueError, ValueError]
@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.data_models.tables import Base, File as FileModel
+from src.fastapi_app import app, get_db, get_job_queue
+from src.errors import CallbackUrlNotAllowed
+from src.utils.classify_pipeline import ClassificationOutcome
+from src.utils.job_queue import InMemoryQueueBackend, SQLiteQueueBackend
+from src.utils.jobs import JobWorkerPool, get_job, send_callback
+from src.validation.callback_url_validation import check_callback_url
+
+# in memory sqlite db shared across threads with one file for customer 1
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add(FileModel(id=1, filename="test.pdf", s3Path="1/test.pdf", customerId=1))
+        session.commit()
+    return factory
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, session_factory):
+    if request.param == "memory":
+        return InMemoryQueueBackend()
+    return SQLiteQueueBackend(session_factory)
+
+# the api backed by the in memory db and queue
+@pytest.fixture
+def job_client(session_factory):
+    queue = InMemoryQueueBackend()
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_job_queue] = lambda: queue
+    try:
+        yield TestClient(app), queue
+    finally:
+        app.dependency_overrides.clear()
+
+def make_pool(queue, session_factory):
+    return JobWorkerPool(queue, session_factory, lambda: None, "bucket", workers=1, visibility_timeout=30, max_attempts=2, retry_backoff=0)
+
+# received messages are hidden until their visibility timeout, then delivered again with a higher receive count
+def test_queue_visibility_timeout_and_dead_letter(backend):
+    backend.send({"job_id": "a"})
+    first = backend.receive(10, visibility_timeout=0.2)
+    assert [m.body for m in first] == [{"job_id": "a"}] and first[0].receive_count == 1
+    assert backend.receive(10, visibility_timeout=0.2) == []
+
+    time.sleep(0.25)
+    second = backend.receive(10, visibility_timeout=30)
+    assert second[0].receive_count == 2
+    backend.dead_letter(second[0].receipt_handle)
+    assert backend.receive(10, visibility_timeout=30) == []
+    assert backend.dead_letters() == [{"job_id": "a"}]
+
+    backend.send({"job_id": "b"})
+    message = backend.receive(10, visibility_timeout=30)[0]
+    backend.delete(message.receipt_handle)
+    backend.change_visibility(message.receipt_handle, 0)
+    assert backend.receive(10, visibility_timeout=30) == []
+
+# submit returns straight away, a worker runs the job and the status endpoint reports the class
+def test_job_submit_process_and_poll(job_client, session_factory, mocker):
+    client, queue = job_client
+    classify = mocker.patch('src.utils.jobs.classify_stored_file', return_value=ClassificationOutcome("invoice", 1, False))
+
+    response = client.post("/classify_jobs", json={"customer_id": 1, "filename": "test.pdf"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert client.get(f"/classify_jobs/{job_id}").json()["status"] == "queued"
+
+    pool = make_pool(queue, session_factory)
+    for message in queue.receive(10, visibility_timeout=30):
+        asyncio.run(pool.process(message))
+
+    job = client.get(f"/classify_jobs/{job_id}").json()
+    assert job["status"] == "succeeded" and job["file_class"] == "invoice" and job["attempts"] == 1
+    assert classify.call_count == 1
+    assert queue.receive(10, visibility_timeout=30) == []
+
+def test_job_rejects_unsupported_type_and_unknown_job(job_client):
+    client, _ = job_client
+    assert client.post("/classify_jobs", json={"customer_id": 1, "filename": "test.exe"}).status_code == 400
+    assert client.get("/classify_jobs/does-not-exist").status_code == 404
+
+# callback urls must be public http(s) urls, a name resolving to a private address is refused when the job finishes
+def test_job_callback_url_must_be_public(job_client, mocker):
+    client, queue = job_client
+    for callback_url in ("file:///etc/passwd", "ftp://example.com/hook", "http://127.0.0.1:8000/hook", "http://localhost/hook",
+                         "http://169.254.169.254/latest/meta-data/", "http://10.0.0.5/hook", "http://[::ffff:192.168.0.1]/hook"):
+        response = client.post("/classify_jobs", json={"customer_id": 1, "filename": "test.pdf", "callback_url": callback_url})
+        assert response.status_code == 422, callback_url
+    assert queue.receive(10, visibility_timeout=30) == []
+
+    response = client.post("/classify_jobs", json={"customer_id": 1, "filename": "test.pdf", "callback_url": "https://93.184.215.14/hook"})
+    assert response.status_code == 202
+
+    assert check_callback_url("https://api.example.com/hook", allowed_hosts=[".example.com"])
+    with pytest.raises(CallbackUrlNotAllowed):
+        check_callback_url("https://example.org/hook", allowed_hosts=[".example.com"])
+
+    post = mocker.patch('src.utils.jobs.httpx.post')
+    mocker.patch('src.validation.callback_url_validation.socket.getaddrinfo', return_value=[(None, None, None, "", ("10.0.0.5", 443))])
+    send_callback("https://hooks.example.com/done", {"status": "succeeded"})
+    post.assert_not_called()
+    mocker.patch('src.validation.callback_url_validation.socket.getaddrinfo', return_value=[(None, None, None, "", ("93.184.215.14", 443))])
+    send_callback("https://hooks.example.com/done", {"status": "succeeded"})
+    post.assert_called_once_with("https://hooks.example.com/done", json={"status": "succeeded"}, timeout=5, follow_redirects=False)
+
+# a file that always fails is retried up to max_attempts and then dead lettered
+def test_poison_job_is_retried_then_dead_lettered(job_client, session_factory, mocker):
+    client, queue = job_client
+    classify = mocker.patch('src.utils.jobs.classify_stored_file', side_effect=ValueError("corrupt file"))
+    job_id = client.post("/classify_jobs", json={"customer_id": 1, "filename": "test.pdf"}).json()["job_id"]
+
+    pool = make_pool(queue, session_factory)
+    for _ in range(3):
+        for message in queue.receive(10, visibility_timeout=30):
+            asyncio.run(pool.process(message))
+
+    job = client.get(f"/classify_jobs/{job_id}").json()
+    assert job["status"] == "dead" and job["attempts"] == 2 and "corrupt file" in job["error"]
+    assert classify.call_count == 2
+    assert queue.dead_letters() == [{"job_id": job_id}]
+
+# a missing file can never succeed so it fails without retrying
+def test_missing_file_job_fails_without_retry(job_client, session_factory):
+    client, queue = job_client
+    job_id = client.post("/classify_jobs", json={"customer_id": 1, "filename": "missing.pdf"}).json()["job_id"]
+
+    pool = make_pool(queue, session_factory)
+    for message in queue.receive(10, visibility_timeout=30):
+        asyncio.run(pool.process(message))
+
+    with session_factory() as db:
+        job = get_job(db, job_id)
+        assert job.status == "failed" and "not found" in job.error
+    assert queue.receive(10, visibility_timeout=30) == [] and queue.dead_letters() == []
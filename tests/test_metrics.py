@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from src.utils.metrics import MetricsRegistry, server_timing_header, span, STAGE_ERRORS
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "latency", ("stage",), buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value, stage="download")
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="download",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{stage="download",le="1"} 3' in text
+    assert 'latency_seconds_bucket{stage="download",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{stage="download"} 4' in text
+    assert 'latency_seconds_sum{stage="download"} 2.65' in text
+
+# /metrics on any worker reports the totals of every worker that wrote a snapshot
+def test_multiprocess_snapshots_are_summed(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    counter = registry.counter("requests_total", "requests", ("route",))
+    counter.inc(route="/classify_file")
+
+    other_worker = MetricsRegistry()
+    other_worker.counter("requests_total", "requests", ("route",)).inc(3, route="/classify_file")
+    with open(os.path.join(tmp_path, "metrics_999999.json"), "w") as f:
+        json.dump(other_worker.snapshot(), f)
+
+    registry.write_snapshot()  # this process's own snapshot is ignored in favour of its live values
+    counter.inc(route="/classify_file")
+
+    assert 'requests_total{route="/classify_file"} 5' in registry.render()
+
+def test_span_counts_errors_by_kind():
+    before = STAGE_ERRORS.value(stage="download", file_type="pdf", kind="FileNotFoundError")
+    with pytest.raises(FileNotFoundError):
+        with span("download", "pdf"):
+            raise FileNotFoundError("missing")
+    assert STAGE_ERRORS.value(stage="download", file_type="pdf", kind="FileNotFoundError") == before + 1
+
+def test_server_timing_header_sums_repeated_stages():
+    header = server_timing_header([("download", 0.010), ("download", 0.005), ("inference", 0.002)], total=0.02)
+    assert header == "download;dur=15.0, inference;dur=2.0, total;dur=20.0"
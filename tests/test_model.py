@@ -1,8 +1,19 @@
+import multiprocessing
+import sys
+import threading
+import time
+import numpy as np
 import pytest
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from unittest.mock import MagicMock
 from PIL import Image
-from src.utils.extract_text import PDFTextExtractor, TxtTextExtractor, OCRTextExtractor
-from src.classifier import classify_file_ml
+from src.utils.extract_text import DocxTextExtractor, PDFTextExtractor, TxtTextExtractor, OCRTextExtractor
+from src.utils.ocr_pool import OCRReaderPool, preprocess_image
+from src.utils.tasks import extract_and_classify_task
+from src.classifier import classify_file_ml, classify_files_ml, classify_pages_ml, clean_text, load_model
+from src.compiled_model import CompiledTextClassifier
+from src.scripts.compile_model import compile_pipeline, save_compiled
 
 # Path to sample test files (you need to create these files in your testing environment)
 PDF_FILE_PATH = 'files/bank_statement_1.pdf'
@@ -16,6 +27,39 @@ def test_pdf_text_extractor():
         text = extractor.extract_text(file_bytes)
         assert "Statement" in text  # Adjust this to match the content in your test PDF
 
+# page and character budgets stop the PDF from being read any further
+def test_pdf_text_extractor_budgets():
+    with open(PDF_FILE_PATH, 'rb') as f:
+        file_content = f.read()
+    full_pages = list(PDFTextExtractor(max_pages=0, max_chars=0).iter_pages(BytesIO(file_content)))
+    assert len(full_pages) == 2
+
+    assert len(list(PDFTextExtractor(max_pages=1, max_chars=0).iter_pages(BytesIO(file_content)))) == 1
+    text = PDFTextExtractor(max_pages=0, max_chars=100).extract_text(BytesIO(file_content))
+    assert text == "".join(full_pages)[:100]
+
+# incremental classification stops reading pages once it is confident
+def test_classify_pages_early_exit():
+    pages = iter(["Account Holder: John Doe Account Number: XXXX-6781 Statement Period: 2023-01 Direct Deposit ATM Withdrawal"] * 5)
+    file_class, confidence, pages_read, _ = classify_pages_ml(pages, confidence_threshold=0.4)
+    assert file_class == "bank_statement" and confidence >= 0.4
+    assert pages_read == 1
+    assert len(list(pages)) == 4  # the rest of the document was never consumed
+
+    _, _, pages_read, _ = classify_pages_ml(iter(["page one", "page two"]), confidence_threshold=0)
+    assert pages_read == 2
+
+# the model is only called at the checkpoints (pages 1, 2, 4, 8 ...) and once more when the pages run out
+def test_classify_pages_checkpoints(mocker):
+    predict = mocker.spy(load_model(), "predict_proba")
+    pages = ["Page", " one, of the document.", "Invoice Number 12", "34 Total"] + [" more text"] * 6
+    file_class, confidence, pages_read, text = classify_pages_ml(iter(pages), confidence_threshold=1.01)
+    assert pages_read == 10 and text == "".join(pages)
+    assert predict.call_count == 5  # pages 1, 2, 4, 8 and 10
+    # the text cleaned page by page is the text of the whole document cleaned at once
+    assert predict.call_args.args[0] == [clean_text("".join(pages))]
+    assert (file_class, confidence) == classify_files_ml(["".join(pages)])[0]
+
 # Test text extraction from JPG using OCR
 def test_ocr_text_extractor():
     with open(JPG_FILE_PATH, 'rb') as f:
@@ -24,6 +68,32 @@ def test_ocr_text_extractor():
         text = extractor.extract_text(file_bytes)
         assert "LICENSE" in text  # Assuming "sample" text exists in the test image (adjust accordingly)
 
+# readers are built once and reused across images rather than per call
+def test_ocr_reader_pool_reuses_reader(mocker):
+    # easyocr is imported lazily by the pool, a stand in module means the test does not need it installed
+    mock_reader_cls = MagicMock()
+    mocker.patch.dict(sys.modules, {"easyocr": MagicMock(Reader=mock_reader_cls)})
+    pool = OCRReaderPool(size=1)
+    mocker.patch('src.utils.extract_text.get_ocr_pool', return_value=pool)
+    mock_reader_cls.return_value.readtext.return_value = [([0, 0], "DRIVER LICENSE", 0.9)]
+
+    with open(JPG_FILE_PATH, 'rb') as f:
+        image_bytes = f.read()
+    extractor = OCRTextExtractor()
+    for _ in range(3):
+        assert extractor.extract_text(BytesIO(image_bytes)) == "DRIVER LICENSE"
+
+    assert mock_reader_cls.call_count == 1
+
+# images are converted to grayscale and capped at the max dimension
+def test_preprocess_image_downscales():
+    image = Image.new("RGB", (4000, 3000), "white")
+    processed = preprocess_image(image, max_dimension=1000)
+    assert processed.shape == (750, 1000)
+
+    small = preprocess_image(Image.new("RGB", (200, 100)), max_dimension=1000)
+    assert small.shape == (100, 200)
+
 # Test the text classification (this assumes you have a valid classifier model already trained)
 def test_classify_invoice():
     text = "Invoice Number: 1234 Date: 15 December 2023 Item: Design $50"
@@ -40,5 +110,138 @@ def test_classify_drivers_license():
     result = classify_file_ml(text)
     assert result == 'driver_license'
 
+# batched inference should agree with the single document path
+def test_classify_files_ml_batch():
+    texts = [
+        "Invoice Number: 1234 Date: 15 December 2023 Item: Design $50",
+        "Account Holder: John Doe 1 Account Number: XXXX-XXXX-XXXX-6781 Statement Period: 2023-01, Direct Deposit",
+        "ANY STATE DRIVER LICENSE License No. P99999999 Expires 00-00-00 JOE A SAMPLE",
+    ]
+    results = classify_files_ml(texts)
+    assert [file_class for file_class, _ in results] == [classify_file_ml(text) for text in texts]
+    assert all(0 < confidence <= 1 for _, confidence in results)
+    assert classify_files_ml([]) == []
+
+# the CPU tasks must run in a separate worker process, so arguments and results have to be picklable
+def test_extract_and_classify_task_in_process_pool():
+    with open(PDF_FILE_PATH, 'rb') as f:
+        file_content = f.read()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        text, file_class, pages_read = executor.submit(extract_and_classify_task, file_content, "bank_statement_1.pdf").result()
+    assert "Statement" in text
+    assert file_class == "bank_statement"
+    assert pages_read == 1
+
+# the compiled array model must give exactly the same answers as the pickled pipeline
+def test_compiled_model_parity(tmp_path):
+    pipeline = load_model("text_classifier_pipeline.pkl")
+    arrays, meta = compile_pipeline(pipeline)
+    save_compiled(arrays, meta, str(tmp_path))
+    compiled = CompiledTextClassifier.load(str(tmp_path), mmap=True)
+
+    texts = []
+    for path in ['files/bank_statement_1.pdf', 'files/bank_statement_2.pdf', 'files/invoice_1.pdf', 'files/invoice_2.pdf']:
+        with open(path, 'rb') as f:
+            texts.append(PDFTextExtractor().extract_text(BytesIO(f.read())))
+    texts += [
+        "Invoice Number: 1234 Date: 15 December 2023 Item: Design $50",
+        "ANY STATE DRIVER LICENSE License No. P99999999 Expires 00-00-00 JOE A SAMPLE",
+        "",
+    ]
+    texts = [clean_text(text) for text in texts]
+
+    assert list(compiled.predict(texts)) == list(pipeline.predict(texts))
+    assert np.array_equal(compiled.predict_proba(texts), pipeline.predict_proba(texts))
+
+# reader whose readtext is slow enough for overlapping calls to show up
+class _SlowReader:
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def readtext(self, image):
+        with self.tracker["lock"]:
+            self.tracker["active"] += 1
+            self.tracker["max_active"] = max(self.tracker["max_active"], self.tracker["active"])
+            self.tracker["calls"] += 1
+        time.sleep(0.05)
+        with self.tracker["lock"]:
+            self.tracker["active"] -= 1
+        return [([0, 0], "Account Holder Statement Period Debit Credit", 0.9)]
+
+# the pool builds _SlowReaders in place of easyocr readers, so the parallel path is tested without easyocr
+@pytest.fixture
+def slow_ocr_pool(mocker):
+    tracker = {"lock": threading.Lock(), "active": 0, "max_active": 0, "calls": 0}
+    mocker.patch.object(OCRReaderPool, '_create_reader', lambda self: _SlowReader(tracker))
+    return OCRReaderPool(size=4), tracker
+
+# scanned pages have no text layer, their page images are OCR'd in parallel up to the page cap
+def test_pdf_scanned_pages_are_ocrd_in_parallel(slow_ocr_pool):
+    from src.benchmarks.corpus import render_scanned_pdf
+    pool, tracker = slow_ocr_pool
+    scanned = render_scanned_pdf("\n".join(f"line {i}" for i in range(12)), pages=6)
+
+    pages = list(PDFTextExtractor(ocr_page_cap=5, ocr_workers=4, ocr_pool=pool).iter_pages(BytesIO(scanned)))
+
+    assert len(pages) == 6
+    assert all("Statement Period" in page for page in pages[:5])
+    assert pages[5] == ""  # over the page cap
+    assert tracker["calls"] == 5
+    assert tracker["max_active"] > 1
+
+    # no cap (None or 0, as for the page and character budgets) OCRs every scanned page, ocr=False none
+    assert all("Statement Period" in page for page in PDFTextExtractor(ocr_page_cap=None, ocr_pool=pool).iter_pages(BytesIO(scanned)))
+    assert tracker["calls"] == 11
+    extractor = PDFTextExtractor(ocr=False, ocr_pool=pool)
+    assert list(extractor.iter_pages(BytesIO(scanned))) == [""] * 6
+    assert tracker["calls"] == 11 and extractor.scanned_pages == 6
+
+# digital PDFs never touch the OCR readers
+def test_pdf_text_layer_skips_ocr(slow_ocr_pool):
+    pool, tracker = slow_ocr_pool
+    with open(PDF_FILE_PATH, 'rb') as f:
+        text = PDFTextExtractor(ocr_pool=pool).extract_text(BytesIO(f.read()))
+    assert "Statement" in text
+    assert tracker["calls"] == 0
+
+def _docx_with_table_header_and_footer() -> bytes:
+    from docx import Document
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = "Tech Solutions Ltd."
+    document.add_paragraph("Invoice Number: 12345")
+    table = document.add_table(rows=2, cols=2)
+    for row, (service, price) in enumerate([("Web Development", "$120.00"), ("Website Hosting", "$30.00")]):
+        table.cell(row, 0).text, table.cell(row, 1).text = service, price
+    document.add_paragraph("Total Due: $150.00")
+    document.sections[0].footer.paragraphs[0].text = "Page 1"
+    out = BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+# the streaming engine reads the header, the table cells and the footer python-docx paragraphs never saw
+def test_docx_stream_reads_tables_headers_and_footers():
+    content = _docx_with_table_header_and_footer()
+
+    text = DocxTextExtractor(engine="stream").extract_text(BytesIO(content))
+    lines = [line.split("\t") for line in text.splitlines()]
+    assert lines[0] == ["Tech Solutions Ltd."]
+    assert [cell.strip() for cell in lines[2] if cell] == ["Web Development", "$120.00"]
+    assert "Total Due: $150.00" in text and text.rstrip().endswith("Page 1")
+
+    legacy = DocxTextExtractor(engine="python-docx").extract_text(BytesIO(content))
+    assert "Web Development" not in legacy
+
+# the character budget stops parsing, and the head only parses as far as it needs
+def test_docx_stream_budget_stops_early(mocker):
+    content = _docx_with_table_header_and_footer()
+    full = DocxTextExtractor(engine="stream", max_chars=0).extract_text(BytesIO(content))
+
+    assert DocxTextExtractor(engine="stream", max_chars=30).extract_text(BytesIO(content)) == full[:30]
+    assert DocxTextExtractor(engine="stream").extract_head(BytesIO(content), 10) == full[:10]
+
+    fragments = mocker.spy(DocxTextExtractor, "_part_fragments")
+    DocxTextExtractor(engine="stream", max_chars=5).extract_text(BytesIO(content))
+    assert fragments.call_count == 1  # stopped inside the header, the body and footer were never parsed
+
 if __name__ == "__main__":
     pytest.main()
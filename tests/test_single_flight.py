@@ -0,0 +1,120 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import src.utils.classify_pipeline as classify_pipeline
+from src.data_models.tables import Base, File as FileModel
+from src.utils.buffers import FileBuffer
+from src.utils.classification_cache import ClassificationCache
+from src.utils.single_flight import LeaseTable, SingleFlight
+
+with open('tests/test_files/bank_statement_1.pdf', "rb") as f:
+    STATEMENT = f.read()
+
+
+@pytest.fixture
+def leases():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return LeaseTable(sessionmaker(bind=engine), ttl=0.5)
+
+# a retry storm on one file downloads, classifies and writes it once, every caller gets the same outcome
+def test_concurrent_duplicates_share_one_classification(mocker):
+    mocker.patch.object(classify_pipeline, "single_flight", SingleFlight())
+    mocker.patch.object(classify_pipeline, "classification_cache", ClassificationCache(enabled=True, persistent=False))
+    download = mocker.patch.object(classify_pipeline, "download_file_buffer", AsyncMock(side_effect=lambda *args: FileBuffer.from_bytes(STATEMENT)))
+    writer = MagicMock()
+    writer.submit_async = AsyncMock(return_value=None)
+    mocker.patch.object(classify_pipeline, "classification_writer", writer)
+
+    run_cpu = classify_pipeline.run_cpu
+    cpu_calls = []
+
+    async def slow_run_cpu(func, *args):
+        cpu_calls.append(args[-1])
+        await asyncio.sleep(0.1)  # long enough for every duplicate to arrive while the first one runs
+        return await run_cpu(func, *args)
+
+    mocker.patch.object(classify_pipeline, "run_cpu", slow_run_cpu)
+
+    async def scenario():
+        duplicates = [
+            classify_pipeline.classify_stored_file(MagicMock(), None, "bucket", FileModel(id=1, s3Path="1/a.pdf", filename="a.pdf", customerId=1))
+            for _ in range(5)
+        ]
+        other = classify_pipeline.classify_stored_file(MagicMock(), None, "bucket", FileModel(id=2, s3Path="2/a.pdf", filename="a.pdf", customerId=2))
+        return await asyncio.gather(*duplicates, other)
+
+    outcomes = asyncio.run(scenario())
+    assert len({outcome.file_class for outcome in outcomes}) == 1
+    assert cpu_calls == ["a.pdf", "a.pdf"]  # one per customer
+    assert download.await_count == 2
+    assert writer.submit_async.await_count == 2
+    assert classify_pipeline.single_flight.in_flight() == 0
+
+# an error reaches every caller of the call, a caller that gives up does not cancel the others and nothing is kept
+def test_single_flight_errors_and_cancellation():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append("fail")
+        await asyncio.sleep(0.05)
+        raise ValueError("corrupt file")
+
+    async def working():
+        calls.append("work")
+        await asyncio.sleep(0.05)
+        return "invoice"
+
+    async def scenario():
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, ValueError]
+
+        impatient = asyncio.ensure_future(flight.do("k", working))
+        patient = asyncio.ensure_future(flight.do("k", working))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        assert await patient == "invoice"
+
+    asyncio.run(scenario())
+    assert calls == ["fail", "work"]
+    assert flight.in_flight() == 0
+
+# workers sharing a lease table take turns: the second waits for the first to release the lease
+def test_lease_table_coalesces_across_workers(leases):
+    order = []
+
+    def worker(name):
+        async def classify():
+            order.append(f"{name} start")
+            await asyncio.sleep(0.2)
+            order.append(f"{name} end")
+            return name
+        return classify
+
+    async def scenario():
+        first, second = SingleFlight(leases, poll_seconds=0.02), SingleFlight(leases, poll_seconds=0.02)
+        running = asyncio.ensure_future(first.do("k", worker("first"), lease_key="1/a.pdf"))
+        await asyncio.sleep(0.05)
+        assert await second.do("k", worker("second"), lease_key="1/a.pdf") == "second"
+        assert await running == "first"
+
+    asyncio.run(scenario())
+    assert order == ["first start", "first end", "second start", "second end"]
+    assert leases.acquire("1/a.pdf", "next")  # released
+
+# a lease whose holder stopped renewing it is taken over once it expires
+def test_expired_lease_is_taken_over(leases):
+    assert leases.acquire("1/a.pdf", "dead worker")
+    assert not leases.acquire("1/a.pdf", "live worker")
+    time.sleep(0.6)
+    assert leases.acquire("1/a.pdf", "live worker")
+    assert not leases.renew("1/a.pdf", "dead worker")
+    leases.release("1/a.pdf", "dead worker")  # no effect, not the holder
+    assert not leases.acquire("1/a.pdf", "third worker")
@@ -0,0 +1,180 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import boto3
+import pytest
+from moto import mock_aws
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.connectors.db_connector import migrate_tables
+from src.data_models.tables import Base, Customer, File as FileModel
+from src.scripts.seed import seed
+
+# modules that must only be imported once their file type (or S3, or the model) is first needed
+HEAVY_MODULES = ["easyocr", "torch", "PyPDF2", "docx", "PIL", "boto3", "botocore", "sklearn", "numpy"]
+# generous budgets so slow CI machines pass, the measured values are recorded in the junit report
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 5))
+TIME_TO_READY_BUDGET = float(os.getenv("TIME_TO_READY_BUDGET", 60))
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import src.fastapi_app
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def test_app_import_is_lightweight(record_property):
+    # fresh interpreter so modules imported by other tests do not count
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    record_property("import_seconds", round(result["seconds"], 3))
+
+    assert result["loaded"] == []
+    assert result["seconds"] < IMPORT_TIME_BUDGET
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+# start the app in uvicorn on a free port against the sqlite db at db_path
+def _start_app(db_path):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SEED_ON_STARTUP": "false",
+        "JOB_WORKERS": "0",
+        "CPU_EXECUTOR": "thread",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.fastapi_app:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return server, port
+
+# boot the app in uvicorn and time how long until it answers /health and until /ready reports the model loaded
+def test_time_to_first_request_and_ready(tmp_path, record_property):
+    started = time.perf_counter()
+    server, port = _start_app(tmp_path / "app.db")
+    try:
+        time_to_health = time_to_ready = None
+        while time.perf_counter() - started < TIME_TO_READY_BUDGET:
+            if time_to_health is None and _get(f"http://127.0.0.1:{port}/health") == 200:
+                time_to_health = time.perf_counter() - started
+            if time_to_health is not None and _get(f"http://127.0.0.1:{port}/ready") == 200:
+                time_to_ready = time.perf_counter() - started
+                break
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    assert time_to_health is not None and time_to_ready is not None
+    record_property("time_to_first_request_seconds", round(time_to_health, 3))
+    record_property("time_to_ready_seconds", round(time_to_ready, 3))
+
+# tables of the original schema (files without the hash, size, model version and upload time columns)
+ORIGINAL_SCHEMA = [
+    "CREATE TABLE customers (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR)",
+    "CREATE TABLE files (id INTEGER NOT NULL PRIMARY KEY, filename VARCHAR NOT NULL, \"s3Path\" VARCHAR NOT NULL, "
+    "\"customerId\" INTEGER REFERENCES customers (id), \"fileClassification\" VARCHAR)",
+    "INSERT INTO customers (id, name) VALUES (1, 'Heron')",
+    "INSERT INTO files (id, filename, \"s3Path\", \"customerId\", \"fileClassification\") VALUES (1, 'invoice_1.pdf', '1/invoice_1.pdf', 1, 'invoice')",
+]
+
+# an app booted on a db created by the original version adds the new columns and indexes and serves the old rows
+def test_boot_migrates_original_schema(tmp_path):
+    db_path = tmp_path / "old.db"
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as connection:
+        for statement in ORIGINAL_SCHEMA:
+            connection.exec_driver_sql(statement)
+
+    server, port = _start_app(db_path)
+    try:
+        started = time.perf_counter()
+        while _get(f"http://127.0.0.1:{port}/health") != 200 and time.perf_counter() - started < TIME_TO_READY_BUDGET:
+            time.sleep(0.05)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/customers/1/files", timeout=5) as response:
+            files = [json.loads(line) for line in response.read().decode().splitlines()]
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    assert [(f["id"], f["filename"], f["file_class"], f["content_hash"]) for f in files] == [(1, "invoice_1.pdf", "invoice", None)]
+    indexes = {index["name"] for index in inspect(engine).get_indexes("files")}
+    assert {"ix_files_customer_filename", "ix_files_customer_uploaded"} <= indexes
+    # the app's own session sees the migrated table and a second run has nothing left to add
+    assert migrate_tables(engine) == []
+    with sessionmaker(bind=engine)() as db:
+        assert db.query(FileModel).one().uploadedAt is None
+
+# seeding twice uploads and writes nothing the second time, a changed file is re-uploaded and its class reset
+def test_seed_is_idempotent(tmp_path):
+    files_dir = tmp_path / "files"
+    files_dir.mkdir()
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (files_dir / name).write_text(f"invoice {name}")
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="seed-test-bucket")
+
+        first = seed(session_factory, s3, "seed-test-bucket", files_dir=str(files_dir), workers=4)
+        assert (first["uploaded"], first["skipped"], first["records"]) == (3, 0, 3)
+        with session_factory() as db:
+            db.query(FileModel).update({"fileClassification": "invoice"})
+            db.commit()
+
+        second = seed(session_factory, s3, "seed-test-bucket", files_dir=str(files_dir), workers=4)
+        assert (second["uploaded"], second["skipped"], second["records"]) == (0, 3, 0)
+
+        (files_dir / "b.txt").write_text("changed")
+        third = seed(session_factory, s3, "seed-test-bucket", files_dir=str(files_dir), workers=4)
+        assert (third["uploaded"], third["skipped"], third["records"]) == (1, 2, 1)
+
+        with session_factory() as db:
+            assert db.query(Customer).count() == 1
+            files = {f.filename: f for f in db.query(FileModel).all()}
+        assert len(files) == 3
+        assert files["b.txt"].fileClassification is None and files["a.txt"].fileClassification == "invoice"
+        assert s3.get_object(Bucket="seed-test-bucket", Key=f"{files['b.txt'].customerId}/b.txt")["Body"].read() == b"changed"
+
+# CPU workers forked from the preloaded forkserver start with the models loaded and the heap frozen (shared copy on write)
+@pytest.mark.skipif(sys.platform != "linux", reason="forkserver and /proc are Linux only")
+def test_cpu_workers_share_preloaded_models(record_property):
+    import gc
+
+    from src.utils.executors import make_cpu_executor
+    from src.utils.tasks import worker_memory_task
+
+    executor = make_cpu_executor("process", 1, start_method="forkserver", preload=True)
+    try:
+        frozen = executor.submit(gc.get_freeze_count).result(timeout=120)
+        _, memory = executor.submit(worker_memory_task).result(timeout=120)
+    finally:
+        executor.shutdown()
+
+    assert frozen > 0
+    assert memory["uss_mb"] < memory["rss_mb"]
+    record_property("cpu_worker_memory", memory)
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.connectors.s3_connector import get_s3_client, get_object_range
+from src.errors import FileContentMismatch
+from src.utils.buffers import RequestMemory
+from src.utils.streaming_upload import MultipartFileReader, stream_upload_to_s3
+from src.utils.utils import download_file_buffer, download_file_return_bytes
+
+BUCKET_NAME = "heron-data-test-bucket"
+PDF_FILE_PATH = 'files/invoice_3.pdf'
+
+# local S3 stand-in with the test bucket and one PDF in it
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET_NAME)
+        with open(PDF_FILE_PATH, "rb") as f:
+            client.put_object(Bucket=BUCKET_NAME, Key="1/invoice_3.pdf", Body=f.read())
+        yield client
+
+# one client is built for the whole app and reused
+def test_get_s3_client_is_shared():
+    get_s3_client.cache_clear()
+    try:
+        client = get_s3_client()
+        assert get_s3_client() is client
+        assert client.meta.config.max_pool_connections >= 10
+    finally:
+        get_s3_client.cache_clear()
+
+def test_download_file(s3_client):
+    with open(PDF_FILE_PATH, "rb") as f:
+        file_content = f.read()
+    assert download_file_return_bytes(s3_client, BUCKET_NAME, "1/invoice_3.pdf").getvalue() == file_content
+
+def test_get_object_range(s3_client):
+    with open(PDF_FILE_PATH, "rb") as f:
+        file_content = f.read()
+    assert get_object_range(s3_client, BUCKET_NAME, "1/invoice_3.pdf", 0, 4) == b"%PDF-"
+    assert get_object_range(s3_client, BUCKET_NAME, "1/invoice_3.pdf", 10, 10 + len(file_content)) == file_content[10:]
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="1/empty.txt", Body=b"")
+    assert get_object_range(s3_client, BUCKET_NAME, "1/empty.txt", 0, 1023) == b""
+    with pytest.raises(FileNotFoundError):
+        get_object_range(s3_client, BUCKET_NAME, "1/missing.pdf", 0, 4)
+
+# the start of the file is sniffed with a ranged GET, a file that is not what its extension says
+# is rejected without downloading its body
+def test_download_file_buffer_sniffs_before_downloading(s3_client, mocker):
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="1/fake.pdf", Body=b"MZ" + os.urandom(64 * 1024))
+    get_object = mocker.spy(s3_client, "get_object")
+
+    async def download(s3_path, filename):
+        async with RequestMemory() as request_memory:
+            file_buffer = await download_file_buffer(s3_client, BUCKET_NAME, s3_path, request_memory, filename)
+            file_buffer.close()
+
+    with pytest.raises(FileContentMismatch):
+        asyncio.run(download("1/fake.pdf", "fake.pdf"))
+    assert [call.kwargs.get("Range") for call in get_object.call_args_list] == ["bytes=0-1023"]
+
+    get_object.reset_mock()
+    asyncio.run(download("1/invoice_3.pdf", "invoice_3.pdf"))
+    assert [call.kwargs.get("Range") for call in get_object.call_args_list] == ["bytes=0-1023", None]
+
+def test_download_missing_file(s3_client):
+    with pytest.raises(FileNotFoundError):
+        download_file_return_bytes(s3_client, BUCKET_NAME, "1/missing.pdf")
+
+async def _chunks(content: bytes, chunk_size: int = 1024 * 1024):
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+# large files go up as a multipart upload and the hash is computed on the fly
+def test_stream_upload_multipart(s3_client):
+    content = os.urandom(12 * 1024 * 1024)
+    result = asyncio.run(stream_upload_to_s3(_chunks(content), s3_client, BUCKET_NAME, "1/big.jpg", part_size=5 * 1024 * 1024))
+
+    assert result.parts == 3 and result.size == len(content)
+    assert result.content_hash == hashlib.sha256(content).hexdigest()
+    assert s3_client.get_object(Bucket=BUCKET_NAME, Key="1/big.jpg")["Body"].read() == content
+
+# files smaller than a part are sent with a single put
+def test_stream_upload_small_file(s3_client):
+    result = asyncio.run(stream_upload_to_s3(_chunks(b"invoice number 1"), s3_client, BUCKET_NAME, "1/small.txt"))
+    assert result.parts == 1
+    assert s3_client.get_object(Bucket=BUCKET_NAME, Key="1/small.txt")["Body"].read() == b"invoice number 1"
+
+# a failure mid stream aborts the multipart upload so no parts are left behind
+def test_stream_upload_aborts_on_failure(s3_client):
+    async def failing_chunks():
+        yield os.urandom(6 * 1024 * 1024)
+        yield os.urandom(1024)
+        raise ConnectionError("client went away")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(stream_upload_to_s3(failing_chunks(), s3_client, BUCKET_NAME, "1/broken.pdf", part_size=5 * 1024 * 1024))
+
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET_NAME).get("Uploads", []) == []
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix="1/broken.pdf")
+
+# the file part of a form is read as the body arrives, whatever the chunk boundaries
+def test_multipart_file_reader():
+    content = os.urandom(100 * 1024)
+    body = (
+        b"--XyZ\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nscan\r\n"
+        b"--XyZ\r\nContent-Disposition: form-data; name=\"file\"; filename=\"invoice.pdf\"\r\n"
+        b"Content-Type: application/pdf\r\n\r\n" + content + b"\r\n--XyZ--\r\n"
+    )
+
+    async def read():
+        form = MultipartFileReader("multipart/form-data; boundary=XyZ", _chunks(body, chunk_size=7))
+        filename = await form.read_filename()
+        return filename, b"".join([chunk async for chunk in form.iter_file()])
+
+    assert asyncio.run(read()) == ("invoice.pdf", content)
+
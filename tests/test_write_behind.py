@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.data_models.tables import Base, File as FileModel
+from src.errors import WriteBehindQueueFull
+from src.utils.write_behind import ClassificationWriter
+
+# in memory sqlite db shared across threads, with 50 unclassified files
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add_all([FileModel(id=i, filename=f"file_{i}.pdf", s3Path=f"1/file_{i}.pdf", customerId=1) for i in range(1, 51)])
+        session.commit()
+    return factory
+
+# many submits are coalesced into a few bulk updates, the last class for a file wins
+def test_writer_batches_and_flushes_on_stop(session_factory):
+    writer = ClassificationWriter(session_factory, batch_size=20, flush_interval=0.05)
+    futures = writer.submit_many([(i, "invoice") for i in range(1, 51)])
+    futures.append(writer.submit(1, "bank_statement"))
+    writer.stop()
+
+    assert all(future.done() and future.exception() is None for future in futures)
+    stats = writer.stats()
+    assert stats["written"] <= 51 and stats["flushes"] <= 5 and stats["queued"] == 0
+    with session_factory() as db:
+        classes = {f.id: f.fileClassification for f in db.query(FileModel).all()}
+    assert classes[1] == "bank_statement"
+    assert all(classes[i] == "invoice" for i in range(2, 51))
+
+# a full queue blocks for put_timeout and then fails, rather than growing without bound
+def test_writer_backpressure(session_factory):
+    release = threading.Event()
+
+    def slow_session_factory():
+        release.wait(5)
+        return session_factory()
+
+    writer = ClassificationWriter(slow_session_factory, batch_size=1, flush_interval=0.01, max_queue=2, put_timeout=0.05)
+    first = writer.submit(1, "invoice")
+    # the flusher is stuck on the first write, so the queue fills up
+    submitted = [first]
+    with pytest.raises(WriteBehindQueueFull):
+        for i in range(2, 10):
+            submitted.append(writer.submit(i, "invoice"))
+    assert writer.stats()["rejected"] == 1
+
+    release.set()
+    writer.stop()
+    assert all(future.result(1) is None for future in submitted)